@@ -0,0 +1,247 @@
+"""
+Generates reproducible synthetic inputs for every stage of the pipeline, so that the
+throughput of the scripts can be measured without patient data.
+
+The generator writes:
+1. Franklin default/UTR CSV pairs per sample in Cohort_<n>_raw folders, as exported
+   from Franklin and read by processing.clean_franklin.
+2. eVai TXT outputs with a '##' metadata block in eVai_outputs, as read by clean_eVai.
+3. A VIPR TSV (prioritised_file.txt), as read by clean_VIPR.process_tsv.
+
+Variants are drawn from a shared pool with a skewed frequency distribution, so that
+most variants are seen in one sample and a few recur across many samples and cohorts,
+as in the real exports. The same seed always gives the same files.
+
+Usage:
+    python generate_synthetic.py OUTPUT_DIR --cohorts 5 --samples 20 --variants 20000
+"""
+
+import argparse
+import csv
+import os
+import random
+
+FRANKLIN_CLASSIFICATIONS = [
+    'PATHOGENIC', 'LIKELY_PATHOGENIC', 'UNCERTAIN_SIGNIFICANCE', 'POSSIBLY_PATHOGENIC_LOW',
+    'POSSIBLY_PATHOGENIC_MODERATE', 'POSSIBLY_BENIGN', 'LIKELY_BENIGN', 'BENIGN'
+]
+# Rough share of each classification in a Franklin export (mostly benign-leaning)
+FRANKLIN_WEIGHTS = [1, 2, 10, 6, 4, 20, 30, 27]
+
+EVAI_CLASSIFICATIONS = ['Pathogenic', 'Likely pathogenic', 'Uncertain significance', 'Likely benign', 'Benign']
+
+# Franklin export columns; only some of them are kept by clean_franklin
+FRANKLIN_COLUMNS = [
+    'Chromosome', 'Position', 'Ref', 'Alt', 'Gene', 'Transcript', 'Nucleotide', 'Protein',
+    'Effect', 'Genoox_Classification', 'Zygosity', 'Inheritance_Model', 'Allele_Frequency', 'Quality'
+]
+
+EVAI_COLUMNS = [
+    'Gene', 'HGVS_Coding', 'HGVS_Protein', 'Transcript', 'Classification', 'Sample_Zygosity',
+    'Condition_Inheritance', 'Pathogenicity_Score', 'Criteria'
+]
+
+VIPR_COLUMNS = [
+    'Chr', 'Start', 'End', 'Ref', 'Alt', 'Func.refGene', 'Gene.refGene', 'GeneDetail.refGene',
+    'ExonicFunc.refGene', 'AAChange.refGene', '.pred_P_LP'
+]
+
+
+def make_variant_pool(rng, pool_size, gene_count):
+    """
+    Creates a pool of synthetic variants.
+
+    Parameters:
+    - rng (random.Random): Seeded random number generator.
+    - pool_size (int): Number of distinct variants.
+    - gene_count (int): Number of distinct genes the variants fall in.
+
+    Returns:
+    - list: One dict per variant with chromosome, position, alleles, gene, transcript,
+      nucleotide (HGVS c.), protein change and Franklin classification.
+    """
+    genes = [f"GENE{index}" for index in range(gene_count)]
+    variants = []
+    for index in range(pool_size):
+        gene_index = rng.randrange(gene_count)
+        ref, alt = rng.sample('ACGT', 2)
+        position = rng.randint(1, 4000)
+        variants.append({
+            'chromosome': f"chr{gene_index % 22 + 1}",
+            'position': 1000000 + gene_index * 100000 + position,
+            'ref': ref,
+            'alt': alt,
+            'gene': genes[gene_index],
+            'transcript': f"NM_{gene_index:06d}.1",
+            'nucleotide': f"c.{position}{ref}>{alt}",
+            'protein': f"p.X{position // 3}X",
+            'classification': rng.choices(FRANKLIN_CLASSIFICATIONS, FRANKLIN_WEIGHTS)[0],
+        })
+    return variants
+
+
+def sample_variants(rng, pool, count):
+    """
+    Draws the variants of one sample. Low pool indices are drawn far more often than high
+    ones, which gives a long tail of variants seen in a single sample.
+
+    Parameters:
+    - rng (random.Random): Seeded random number generator.
+    - pool (list): Variant pool from make_variant_pool.
+    - count (int): Number of variants to draw.
+
+    Returns:
+    - list: Distinct variants in pool order.
+    """
+    chosen = set()
+    pool_size = len(pool)
+    attempts = 0
+    while len(chosen) < min(count, pool_size) and attempts < count * 20:
+        chosen.add(min(int(rng.paretovariate(1.1)) - 1, pool_size - 1) if rng.random() < 0.3
+                   else rng.randrange(pool_size))
+        attempts += 1
+    return [pool[index] for index in sorted(chosen)]
+
+
+def write_franklin_pair(rng, directory, sample, variants, duplicate_rate=0.02):
+    """
+    Writes the default and UTR Franklin exports of one sample. A small share of rows
+    appears in both files, so that clean_franklin has duplicates to drop.
+
+    Parameters:
+    - rng (random.Random): Seeded random number generator.
+    - directory (str): Cohort raw folder.
+    - sample (str): Sample name.
+    - variants (list): Variants of the sample.
+    - duplicate_rate (float): Share of rows repeated in the UTR file.
+
+    Returns:
+    - int: Number of rows written across both files.
+    """
+    split = int(len(variants) * 0.85)
+    default_rows = variants[:split]
+    utr_rows = variants[split:] + [variant for variant in default_rows if rng.random() < duplicate_rate]
+
+    rows_written = 0
+    for suffix, rows in (('', default_rows), (' (1)', utr_rows)):
+        path = os.path.join(directory, f"{sample}_single_snp_variants{suffix}.csv")
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(FRANKLIN_COLUMNS)
+            for variant in rows:
+                writer.writerow([
+                    variant['chromosome'], variant['position'], variant['ref'], variant['alt'], variant['gene'],
+                    variant['transcript'], f'"{variant["nucleotide"]}"', variant['protein'], 'missense_variant',
+                    variant['classification'], rng.choice(['HET', 'HOM']), rng.choice(['AD', 'AR', 'XL', '']),
+                    f"{rng.random() / 100:.5f}", rng.randint(30, 99),
+                ])
+                rows_written += 1
+    return rows_written
+
+
+def write_evai(rng, path, variants):
+    """
+    Writes one eVai TXT output, with its '##' metadata block and quoted CSV rows.
+
+    Parameters:
+    - rng (random.Random): Seeded random number generator.
+    - path (str): Output path.
+    - variants (list): Variants of the sample.
+
+    Returns:
+    - int: Number of data rows written.
+    """
+    with open(path, 'w', newline='') as file:
+        file.write("##fileformat=eVai export\n##genome=hg38\n##filters=default\n")
+        file.write(','.join(EVAI_COLUMNS) + '\n')
+        writer = csv.writer(file, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        for variant in variants:
+            writer.writerow([
+                variant['gene'], variant['nucleotide'], variant['protein'], variant['transcript'],
+                rng.choice(EVAI_CLASSIFICATIONS), rng.choice(['het', 'hom']), rng.choice(['AD', 'AR', 'AD, AR']),
+                f"{rng.random():.3f}", 'PM2, PP3',
+            ])
+    return len(variants)
+
+
+def write_vipr(rng, path, pool):
+    """
+    Writes a VIPR TSV covering the whole variant pool. Exonic variants carry their c.
+    values in AAChange.refGene and UTR variants in GeneDetail.refGene, as in ANNOVAR output.
+
+    Parameters:
+    - rng (random.Random): Seeded random number generator.
+    - path (str): Output path.
+    - pool (list): Variant pool from make_variant_pool.
+
+    Returns:
+    - int: Number of data rows written.
+    """
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file, delimiter='\t', lineterminator='\n')
+        writer.writerow(VIPR_COLUMNS)
+        for variant in pool:
+            gene = variant['gene']
+            if rng.random() < 0.8:
+                gene_detail = '.'
+                aa_change = (f"{gene}:{variant['transcript']}:exon2:{variant['nucleotide']}:{variant['protein']},"
+                             f"{gene}:{variant['transcript']}2:exon3:{variant['nucleotide']}:{variant['protein']}")
+            else:
+                gene_detail = f"{variant['transcript']}:{variant['nucleotide']}"
+                aa_change = '.'
+            writer.writerow([
+                variant['chromosome'], variant['position'], variant['position'], variant['ref'], variant['alt'],
+                'exonic' if aa_change != '.' else 'UTR3', gene, gene_detail, 'nonsynonymous SNV', aa_change,
+                f"{rng.random():.4f}",
+            ])
+    return len(pool)
+
+
+def generate(output_dir, cohorts=5, samples=10, variants=5000, evai_samples=None, seed=2024):
+    """
+    Writes a full synthetic data set to output_dir.
+
+    Parameters:
+    - output_dir (str): Directory to write the data set to.
+    - cohorts (int): Number of cohorts (Cohort_1_raw ... Cohort_<n>_raw).
+    - samples (int): Number of samples per cohort.
+    - variants (int): Number of variants per sample.
+    - evai_samples (int, optional): Number of eVai outputs. Defaults to the samples of the first cohort.
+    - seed (int): Random seed.
+
+    Returns:
+    - dict: Number of rows written per input type.
+    """
+    rng = random.Random(seed)
+    pool = make_variant_pool(rng, pool_size=max(variants * 5, 1000), gene_count=max(variants // 20, 50))
+    counts = {'franklin_rows': 0, 'evai_rows': 0, 'vipr_rows': 0}
+
+    for cohort in range(1, cohorts + 1):
+        directory = os.path.join(output_dir, f"Cohort_{cohort}_raw")
+        os.makedirs(directory, exist_ok=True)
+        for sample in range(1, samples + 1):
+            sample_name = f"CVD{cohort}{sample:04d}"
+            counts['franklin_rows'] += write_franklin_pair(
+                rng, directory, sample_name, sample_variants(rng, pool, variants))
+
+    evai_dir = os.path.join(output_dir, 'eVai_outputs')
+    os.makedirs(evai_dir, exist_ok=True)
+    for sample in range(1, (evai_samples if evai_samples is not None else samples) + 1):
+        counts['evai_rows'] += write_evai(
+            rng, os.path.join(evai_dir, f"CVD1{sample:04d}_eVai.txt"), sample_variants(rng, pool, variants))
+
+    counts['vipr_rows'] = write_vipr(rng, os.path.join(output_dir, 'prioritised_file.txt'), pool)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Franklin, eVai and VIPR inputs.")
+    parser.add_argument('output_dir', help="Directory to write the data set to.")
+    parser.add_argument('--cohorts', type=int, default=5, help="Number of cohorts (default: 5).")
+    parser.add_argument('--samples', type=int, default=10, help="Samples per cohort (default: 10).")
+    parser.add_argument('--variants', type=int, default=5000, help="Variants per sample (default: 5000).")
+    parser.add_argument('--seed', type=int, default=2024, help="Random seed (default: 2024).")
+    args = parser.parse_args()
+
+    counts = generate(args.output_dir, args.cohorts, args.samples, args.variants, seed=args.seed)
+    print(f"Synthetic data written to {args.output_dir}: {counts}")
@@ -0,0 +1,319 @@
+"""
+Benchmark harness for the pipeline stages. For each scale a synthetic data set is
+generated (see generate_synthetic.py), and every stage is run in a fresh process
+so that its peak memory is measured on its own:
+
+1. clean_franklin          (Bioinformatics-Pipeline/processing.py)
+2. count_variants          (Bioinformatics-Pipeline/processing.py)
+3. combine_cohorts         (Bioinformatics-Pipeline/processing.py)
+4. clean_eVai              (eVai-Franklin-Comparison/clean_eVai.py)
+5. clean_VIPR.process_tsv  (eVai-Franklin-Comparison/clean_VIPR.py)
+6. merge_with_VIPR         (eVai-Franklin-Comparison/merge_with_VIPR.py, hash and sort joins)
+
+Each stage reports the number of input rows, wall time, rows per second and peak
+resident memory (the stage process and any worker processes it started).
+
+Usage:
+    python run_benchmarks.py --scales small medium --workers 4 --json results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'Bioinformatics-Pipeline'))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'eVai-Franklin-Comparison'))
+
+from generate_synthetic import generate
+
+# Cohorts, samples per cohort and variants per sample of each scale
+SCALES = {
+    'small': (5, 4, 1000),
+    'medium': (5, 10, 10000),
+    'large': (5, 25, 50000),
+}
+
+CLASSIFICATIONS = [
+    'BENIGN', 'LIKELY_BENIGN', 'LIKELY_PATHOGENIC', 'PATHOGENIC', 'POSSIBLY_BENIGN',
+    'POSSIBLY_PATHOGENIC_LOW', 'POSSIBLY_PATHOGENIC_MODERATE', 'UNCERTAIN_SIGNIFICANCE'
+]
+
+
+def count_data_rows(file_path):
+    """
+    Counts the data rows of a CSV, TSV or eVai TXT file (lines after the header,
+    not counting '##' metadata lines).
+
+    Parameters:
+    - file_path (str): Path to the file.
+
+    Returns:
+    - int: Number of data rows.
+    """
+    rows = 0
+    with open(file_path, 'rb') as file:
+        for line in file:
+            if not line.startswith(b'##'):
+                rows += 1
+    return max(rows - 1, 0)
+
+
+def cohort_folders(cohorts):
+    """
+    Returns the raw and cleaned folder names of each cohort, as used by run_pipeline.
+
+    Parameters:
+    - cohorts (int): Number of cohorts.
+
+    Returns:
+    - list: (raw folder, cleaned folder) tuples.
+    """
+    return [(f"Cohort_{n}_raw", f"Cohort_{n}") for n in range(1, cohorts + 1)]
+
+
+def stage_clean_franklin(cohorts, workers, streaming):
+    from processing import clean_franklin, run_tasks
+
+    tasks = []
+    rows = 0
+    for raw_folder, output_folder in cohort_folders(cohorts):
+        os.makedirs(output_folder, exist_ok=True)
+        samples = sorted({f.split('_single_snp_variants')[0] for f in os.listdir(raw_folder)})
+        for sample in samples:
+            file_default = os.path.join(raw_folder, f"{sample}_single_snp_variants.csv")
+            file_UTR = os.path.join(raw_folder, f"{sample}_single_snp_variants (1).csv")
+            rows += count_data_rows(file_default) + count_data_rows(file_UTR)
+            tasks.append((file_default, file_UTR, os.path.join(output_folder, f"{sample}.csv"), streaming))
+
+    start = time.perf_counter()
+    run_tasks(clean_franklin, tasks, workers)
+    return rows, time.perf_counter() - start
+
+
+def stage_count_variants(cohorts, workers, streaming):
+    from processing import count_variants, run_tasks
+
+    output_folders = [output_folder for _, output_folder in cohort_folders(cohorts)]
+    rows = sum(count_data_rows(os.path.join(folder, f))
+               for folder in output_folders for f in os.listdir(folder) if f.endswith('.csv'))
+
+    start = time.perf_counter()
+    run_tasks(count_variants, [(folder,) for folder in output_folders], workers)
+    return rows, time.perf_counter() - start
+
+
+def stage_combine_cohorts(cohorts, workers, streaming):
+    from processing import combine_cohorts
+
+    cohort_names = [output_folder for _, output_folder in cohort_folders(cohorts)]
+    rows = 0
+    for cohort in cohort_names:
+        for classification in CLASSIFICATIONS:
+            file_path = os.path.join('variant_classifications', cohort,
+                                     f"{cohort}_{classification}_gene_nucleotide.csv")
+            if os.path.exists(file_path):
+                rows += count_data_rows(file_path)
+
+    start = time.perf_counter()
+    combine_cohorts(CLASSIFICATIONS, cohort_names, cohort_names[:-1])
+    return rows, time.perf_counter() - start
+
+
+def stage_clean_evai(cohorts, workers, streaming):
+    from clean_eVai import clean_directory, columns_to_keep
+
+    rows = sum(count_data_rows(os.path.join('eVai_outputs', f)) for f in os.listdir('eVai_outputs'))
+
+    start = time.perf_counter()
+    clean_directory('eVai_outputs', 'clean_eVai_outputs', columns_to_keep, workers=workers)
+    return rows, time.perf_counter() - start
+
+
+def stage_clean_vipr(cohorts, workers, streaming):
+    from clean_VIPR import process_tsv
+
+    rows = count_data_rows('prioritised_file.txt')
+
+    start = time.perf_counter()
+    process_tsv('prioritised_file.txt', 'extracted_prioritised_file.csv', workers=workers)
+    return rows, time.perf_counter() - start
+
+
+def join_stage(mode):
+    def stage(cohorts, workers, streaming):
+        from merge_with_VIPR import join_with_prioritised
+
+        rows = count_data_rows('extracted_prioritised_file.csv') + sum(
+            count_data_rows(os.path.join('clean_eVai_outputs', f)) for f in os.listdir('clean_eVai_outputs'))
+
+        start = time.perf_counter()
+        join_with_prioritised('clean_eVai_outputs', 'extracted_prioritised_file.csv', ['Gene', 'HGVS_Coding'],
+                              f"eVai_VIPR_{mode}.csv", mode=mode)
+        return rows, time.perf_counter() - start
+    return stage
+
+
+# Stages in the order they are run; later stages read the outputs of earlier ones
+STAGES = [
+    ('clean_franklin', stage_clean_franklin),
+    ('count_variants', stage_count_variants),
+    ('combine_cohorts', stage_combine_cohorts),
+    ('clean_eVai', stage_clean_evai),
+    ('clean_VIPR', stage_clean_vipr),
+    ('merge_with_VIPR (hash)', join_stage('hash')),
+    ('merge_with_VIPR (sort)', join_stage('sort')),
+]
+
+
+def peak_memory_mb():
+    """
+    Returns the peak resident memory of this process and of its finished worker processes.
+
+    Returns:
+    - float: Peak resident set size in MB.
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * unit / (1024 * 1024)
+
+
+def run_stage(stage_index, work_dir, cohorts, workers, streaming, results):
+    """
+    Runs one stage inside a fresh process and puts its measurements on a queue, or the
+    traceback of the stage under 'error' if it fails. Output of the stage itself is
+    suppressed so that only the report is printed.
+    """
+    os.chdir(work_dir)
+    name, stage = STAGES[stage_index]
+    # Redirect at the file descriptor level so worker processes are silenced as well
+    sys.stdout.flush()
+    stdout_fd = os.dup(1)
+    devnull_fd = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull_fd, 1)
+    error = None
+    try:
+        cpu_start = time.process_time()
+        rows, seconds = stage(cohorts, workers, streaming)
+        cpu_seconds = time.process_time() - cpu_start
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        sys.stdout.flush()
+        os.dup2(stdout_fd, 1)
+        os.close(devnull_fd)
+        os.close(stdout_fd)
+    if error is not None:
+        results.put({'stage': name, 'error': error})
+        return
+    results.put({
+        'stage': name,
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'cpu_seconds': round(cpu_seconds, 4),
+        'rows_per_second': round(rows / seconds) if seconds > 0 else None,
+        'peak_memory_mb': round(peak_memory_mb(), 1),
+    })
+
+
+def benchmark_scale(scale, work_dir, workers=1, streaming=True, seed=2024):
+    """
+    Generates the data set of one scale in work_dir and runs every stage on it.
+
+    Parameters:
+    - scale (str): Name of the scale in SCALES.
+    - work_dir (str): Empty directory to generate the data set and outputs in.
+    - workers (int): Number of worker processes passed to the stages that support them.
+    - streaming (bool): Run clean_franklin in streaming mode.
+    - seed (int): Random seed of the generator.
+
+    Returns:
+    - list: One result dict per stage.
+    """
+    cohorts, samples, variants = SCALES[scale]
+    print(f"Generating {scale} data set ({cohorts} cohorts x {samples} samples x {variants} variants)...")
+    # The data set is generated in its own process: peak memory is inherited by child
+    # processes on Linux, so the harness itself must stay small
+    context = multiprocessing.get_context('spawn')
+    generator = context.Process(target=generate, args=(work_dir, cohorts, samples, variants),
+                                kwargs={'seed': seed})
+    generator.start()
+    generator.join()
+    if generator.exitcode != 0:
+        raise RuntimeError(f"Generating the {scale} data set failed.")
+
+    results = []
+    for stage_index, (name, _) in enumerate(STAGES):
+        stage_results = context.Queue()
+        process = context.Process(target=run_stage,
+                                  args=(stage_index, work_dir, cohorts, workers, streaming, stage_results))
+        process.start()
+        # Wait for the result while the stage process is alive, so a process that dies
+        # without a result (e.g. killed for running out of memory) does not block the harness
+        result = None
+        while result is None and (process.is_alive() or not stage_results.empty()):
+            try:
+                result = stage_results.get(timeout=1)
+            except queue.Empty:
+                continue
+        process.join()
+        if result is None or 'error' in result or process.exitcode != 0:
+            details = f"\n{result['error']}" if result and 'error' in result else f" (exit code {process.exitcode})"
+            raise RuntimeError(f"Stage {name} failed at scale {scale}.{details}")
+        result['scale'] = scale
+        results.append(result)
+        print(f"  {name:<24} {result['rows']:>10} rows {result['seconds']:>9.3f} s "
+              f"{result['rows_per_second'] or 0:>10} rows/s {result['peak_memory_mb']:>8.1f} MB")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic cohorts.")
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small', 'medium'],
+                        help="Scales to run (default: small medium).")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes per stage (default: 1).")
+    parser.add_argument('--no-streaming', action='store_true', help="Run clean_franklin in the legacy in-memory mode.")
+    parser.add_argument('--seed', type=int, default=2024, help="Random seed (default: 2024).")
+    parser.add_argument('--work-dir', help="Directory for the data sets (default: a temporary directory).")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated data sets and outputs.")
+    parser.add_argument('--json', help="Write the results to this JSON file.")
+    args = parser.parse_args()
+    if args.work_dir:
+        for scale in args.scales:
+            scale_dir = os.path.join(args.work_dir, scale)
+            if os.path.isdir(scale_dir) and os.listdir(scale_dir):
+                parser.error(f"{scale_dir} already exists and is not empty; remove it or use another --work-dir.")
+
+    base_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='vc_bench_')
+    # Only the directories the harness fills are removed: the temporary directory, or the
+    # <work-dir>/<scale> directories of a given --work-dir, which are new or were empty
+    created_dirs = [] if args.work_dir else [base_dir]
+    all_results = []
+    try:
+        for scale in args.scales:
+            scale_dir = os.path.join(base_dir, scale)
+            os.makedirs(scale_dir, exist_ok=True)
+            if args.work_dir:
+                created_dirs.append(scale_dir)
+            all_results.extend(benchmark_scale(scale, scale_dir, args.workers, not args.no_streaming, args.seed))
+    finally:
+        if not args.keep:
+            for created_dir in created_dirs:
+                shutil.rmtree(created_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'workers': args.workers, 'streaming': not args.no_streaming, 'results': all_results},
+                      json_file, indent=2)
+        print(f"Results written to {args.json}")
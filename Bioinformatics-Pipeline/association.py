@@ -0,0 +1,365 @@
+"""
+Cohort association testing for the cleaned samples of processing.py.
+
+A sparse variant x sample incidence matrix (scipy.sparse CSR, one row per variant of one
+classification and one column per sample) is built from the cleaned cohort files, so
+memory grows with the number of carriers rather than with variants x samples. The
+carriers of every variant in every cohort are then a single product of the matrix with
+the sample x cohort indicator matrix, and the tests below run on whole columns at once.
+
+For every variant the carriers in the case cohorts are compared with the carriers in the
+control cohorts with:
+- Fisher's exact test (two-sided, as in R's fisher.test). With the case and control sizes
+  fixed, the null distribution only depends on the total number of carriers, so variants
+  are batched by carrier total and each hypergeometric distribution is computed once,
+  from a table of log-factorials.
+- Pearson's chi-square test with Yates' continuity correction (as in R's chisq.test).
+Both p-values are corrected for multiple testing with the Benjamini-Hochberg procedure,
+and the variants are written to a table ranked by Fisher p-value.
+
+Requires NumPy and SciPy.
+"""
+
+import csv
+import os
+from array import array
+
+try:
+    import numpy as np
+    from scipy import sparse
+    from scipy.special import erfc
+except ImportError:
+    np = None
+
+
+def build_incidence_matrix(cohort_samples, read_variants, classifications):
+    """
+    Builds the variant x sample incidence matrix of the cleaned samples.
+
+    Parameters:
+    - cohort_samples (dict): Cohort name to a list of (sample name, cleaned file path).
+    - read_variants (callable): Yields (Gene, Nucleotide, Genoox_Classification) for a file
+      (processing.read_sample_variants).
+    - classifications (list): Classifications to include.
+
+    Returns:
+    - tuple: The sample names (column i is sample i), the cohort index of each sample (an
+      array), the (classification, Gene_Nucleotide) of each row and the CSR matrix with a
+      1 for every carrier.
+    """
+    if np is None:
+        raise ImportError("Association testing needs the 'numpy' and 'scipy' packages (pip install numpy scipy).")
+    sample_names = []
+    sample_cohorts = array('I')
+    variant_index = {}
+    rows = array('I')
+    columns = array('I')
+    included = set(classifications)
+    for cohort_number, samples in enumerate(cohort_samples.values()):
+        for sample, file_path in samples:
+            sample_id = len(sample_names)
+            sample_names.append(sample)
+            sample_cohorts.append(cohort_number)
+            for gene, nucleotide, classification in read_variants(file_path):
+                if classification in included:
+                    key = (classification, f"{gene}_{nucleotide}")
+                    row = variant_index.get(key)
+                    if row is None:
+                        row = variant_index[key] = len(variant_index)
+                    rows.append(row)
+                    columns.append(sample_id)
+
+    rows = np.frombuffer(rows, dtype=np.uint32) if rows else np.zeros(0, dtype=np.uint32)
+    columns = np.frombuffer(columns, dtype=np.uint32) if columns else np.zeros(0, dtype=np.uint32)
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                               shape=(len(variant_index), len(sample_names)))
+    # A variant listed twice for a sample is still one carrier
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    sample_cohorts = np.array(sample_cohorts, dtype=np.int64)
+    return sample_names, sample_cohorts, list(variant_index), matrix
+
+
+def cohort_carriers(matrix, sample_cohorts, cohort_count):
+    """
+    Counts the carriers of every variant in every cohort.
+
+    Parameters:
+    - matrix (scipy.sparse.csr_matrix): Variant x sample incidence matrix.
+    - sample_cohorts (numpy.ndarray): Cohort index of each sample.
+    - cohort_count (int): Number of cohorts.
+
+    Returns:
+    - numpy.ndarray: Variant x cohort carrier counts.
+    """
+    indicator = sparse.csr_matrix((np.ones(len(sample_cohorts), dtype=np.int32),
+                                   (np.arange(len(sample_cohorts)), sample_cohorts)),
+                                  shape=(len(sample_cohorts), cohort_count))
+    return np.asarray((matrix @ indicator).todense())
+
+
+def log_factorials(n):
+    """
+    Returns the table of log(k!) for k = 0..n.
+
+    Parameters:
+    - n (int): Largest k.
+
+    Returns:
+    - numpy.ndarray: log(k!) for each k.
+    """
+    return np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, n + 1, dtype=np.float64)))))
+
+
+class FisherExact:
+    """
+    Two-sided Fisher's exact test for 2x2 tables with fixed case and control group sizes.
+    The hypergeometric distribution of each carrier total is computed once, with its
+    probabilities sorted so that the p-values of all variants with that total are one
+    vectorised binary search.
+    """
+
+    def __init__(self, case_size, control_size):
+        self.case_size = case_size
+        self.control_size = control_size
+        self.log_factorial = log_factorials(case_size + control_size)
+
+    def _distribution(self, carriers):
+        n1, n2, lf = self.case_size, self.control_size, self.log_factorial
+        low, high = max(0, carriers - n2), min(carriers, n1)
+        x = np.arange(low, high + 1)
+        # log C(n1, x) + log C(n2, K - x) - log C(n1 + n2, K)
+        log_total = lf[carriers] + lf[n1 + n2 - carriers] - lf[n1 + n2]
+        probabilities = np.exp(log_total + lf[n1] - lf[x] - lf[n1 - x] + lf[n2] - lf[carriers - x] - lf[n2 - carriers + x])
+        ordered = np.sort(probabilities)
+        return low, probabilities, ordered, np.cumsum(ordered)
+
+    def p_values(self, case_carriers, control_carriers):
+        """
+        Returns the two-sided p-values: for each variant, the total probability of the
+        tables with the same carrier total that are no more likely than the observed one.
+
+        Parameters:
+        - case_carriers (numpy.ndarray): Carriers in the case group of each variant.
+        - control_carriers (numpy.ndarray): Carriers in the control group of each variant.
+
+        Returns:
+        - numpy.ndarray: The p-values.
+        """
+        totals = case_carriers + control_carriers
+        p_values = np.zeros(len(totals))
+        # Variants grouped by carrier total, one distribution per group
+        order = np.argsort(totals, kind='stable')
+        unique_totals, starts = np.unique(totals[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for carriers, start, end in zip(unique_totals.tolist(), starts, ends):
+            indices = order[start:end]
+            low, probabilities, ordered, cumulative = self._distribution(carriers)
+            # Relative tolerance as in R's fisher.test, so ties in floating point are counted
+            thresholds = probabilities[case_carriers[indices] - low] * (1 + 1e-7)
+            positions = np.searchsorted(ordered, thresholds, side='right')
+            p_values[indices] = np.where(positions > 0, np.minimum(1.0, cumulative[np.maximum(positions - 1, 0)]), 0.0)
+        return p_values
+
+
+def chi_square(case_carriers, case_size, control_carriers, control_size):
+    """
+    Pearson's chi-square test of 2x2 tables with Yates' continuity correction.
+
+    Parameters:
+    - case_carriers (numpy.ndarray): Carriers in the case group of each variant.
+    - case_size (int): Samples in the case group.
+    - control_carriers (numpy.ndarray): Carriers in the control group of each variant.
+    - control_size (int): Samples in the control group.
+
+    Returns:
+    - tuple: (chi-square statistics, p-values). The p-value is 1 when a margin is zero.
+    """
+    total = case_size + control_size
+    carriers = (case_carriers + control_carriers).astype(np.float64)
+    non_carriers = total - carriers
+    difference = np.abs(case_carriers * (control_size - control_carriers).astype(np.float64)
+                        - control_carriers * (case_size - case_carriers).astype(np.float64))
+    difference = np.maximum(0.0, difference - total / 2)
+    denominator = case_size * control_size * carriers * non_carriers
+    valid = denominator > 0
+    statistics = np.zeros(len(carriers))
+    statistics[valid] = total * difference[valid] ** 2 / denominator[valid]
+    # Upper tail of the chi-square distribution with one degree of freedom
+    return statistics, np.where(valid, erfc(np.sqrt(statistics / 2)), 1.0)
+
+
+def odds_ratio(case_carriers, case_size, control_carriers, control_size):
+    """
+    Sample odds ratios of carrying each variant in the case group, with 0.5 added to every
+    cell of the tables where one of them is zero (Haldane-Anscombe correction).
+
+    Returns:
+    - numpy.ndarray: The odds ratios.
+    """
+    cells = np.stack([case_carriers, case_size - case_carriers,
+                      control_carriers, control_size - control_carriers]).astype(np.float64)
+    cells += np.where((cells == 0).any(axis=0), 0.5, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (cells[0] * cells[3]) / (cells[1] * cells[2])
+
+
+def benjamini_hochberg(p_values):
+    """
+    Benjamini-Hochberg adjusted p-values (false discovery rate), as R's p.adjust(method = "BH").
+
+    Parameters:
+    - p_values (numpy.ndarray): The p-values.
+
+    Returns:
+    - numpy.ndarray: Adjusted p-values, in the order of p_values.
+    """
+    count = len(p_values)
+    adjusted = np.zeros(count)
+    if not count:
+        return adjusted
+    # Decreasing p-values, ties in their original order as in R's order(p, decreasing = TRUE)
+    order = np.argsort(-p_values, kind='stable')
+    ranks = count - np.arange(count)
+    adjusted[order] = np.minimum.accumulate(np.minimum(1.0, p_values[order] * count / ranks))
+    return adjusted
+
+
+def test_association(carriers, variant_keys, cohorts, case_cohorts, control_cohorts, cohort_sizes):
+    """
+    Tests every variant for a difference in carrier frequency between case and control cohorts.
+
+    Parameters:
+    - carriers (numpy.ndarray): Variant x cohort carrier counts, from cohort_carriers.
+    - variant_keys (list): (classification, Gene_Nucleotide) of each variant.
+    - cohorts (list): Cohort names, in the column order of carriers.
+    - case_cohorts (list): Cohorts in the case group.
+    - control_cohorts (list): Cohorts in the control group.
+    - cohort_sizes (numpy.ndarray): Number of samples of each cohort.
+
+    Returns:
+    - dict: Columns of the results for the variants carried by at least one case or
+      control sample, ranked by Fisher p-value: 'keys' (classification, Gene_Nucleotide),
+      'carriers' and 'frequencies' (variant x cohort), and arrays of the case and control
+      carriers, the odds ratio and the raw and Benjamini-Hochberg adjusted p-values.
+    """
+    case_columns = [cohorts.index(cohort) for cohort in case_cohorts]
+    control_columns = [cohorts.index(cohort) for cohort in control_cohorts]
+    case_size = int(cohort_sizes[case_columns].sum())
+    control_size = int(cohort_sizes[control_columns].sum())
+    case_carriers = carriers[:, case_columns].sum(axis=1)
+    control_carriers = carriers[:, control_columns].sum(axis=1)
+
+    tested = np.nonzero(case_carriers + control_carriers)[0]
+    case_carriers = case_carriers[tested]
+    control_carriers = control_carriers[tested]
+    statistics, chi_square_p = chi_square(case_carriers, case_size, control_carriers, control_size)
+    fisher_p = FisherExact(case_size, control_size).p_values(case_carriers, control_carriers)
+    keys = [variant_keys[index] for index in tested.tolist()]
+
+    # Ranked by Fisher p-value, then chi-square p-value, then Gene_Nucleotide
+    key_rank = np.empty(len(keys), dtype=np.int64)
+    key_rank[sorted(range(len(keys)), key=lambda index: keys[index][1])] = np.arange(len(keys))
+    ranking = np.lexsort((key_rank, chi_square_p, fisher_p))
+
+    tested_carriers = carriers[tested]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frequencies = np.where(cohort_sizes > 0, tested_carriers / np.maximum(cohort_sizes, 1), 0.0)
+    results = {
+        'carriers': tested_carriers,
+        'frequencies': frequencies,
+        'Case_Carriers': case_carriers,
+        'Control_Carriers': control_carriers,
+        'Odds_Ratio': odds_ratio(case_carriers, case_size, control_carriers, control_size),
+        'Fisher_P': fisher_p,
+        'Fisher_Q': benjamini_hochberg(fisher_p),
+        'Chi_Square': statistics,
+        'Chi_Square_P': chi_square_p,
+        'Chi_Square_Q': benjamini_hochberg(chi_square_p),
+    }
+    results = {column: values[ranking] for column, values in results.items()}
+    results['keys'] = [keys[index] for index in ranking.tolist()]
+    return results
+
+
+def write_association_table(results, cohorts, output_file):
+    """
+    Writes ranked association results to a CSV file.
+
+    Parameters:
+    - results (dict): Results from test_association.
+    - cohorts (list): Cohort names, in column order.
+    - output_file (str): Path to the output CSV file.
+    """
+    statistics = ['Case_Carriers', 'Control_Carriers', 'Odds_Ratio', 'Fisher_P', 'Fisher_Q',
+                  'Chi_Square', 'Chi_Square_P', 'Chi_Square_Q']
+    fieldnames = ['Rank', 'Gene_Nucleotide', 'Classification']
+    for cohort in cohorts:
+        fieldnames += [f"{cohort}_Carriers", f"{cohort}_Frequency"]
+    fieldnames += statistics
+
+    columns = [results[column].tolist() for column in statistics]
+    with open(output_file, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(fieldnames)
+        for rank, ((classification, gene_nucleotide), carriers, frequencies, *values) in enumerate(
+                zip(results['keys'], results['carriers'].tolist(), results['frequencies'].tolist(), *columns), start=1):
+            row = [rank, gene_nucleotide, classification]
+            for cohort_carriers_count, frequency in zip(carriers, frequencies):
+                row += [cohort_carriers_count, f"{frequency:.6g}"]
+            row += [f"{value:.6g}" if isinstance(value, float) else value for value in values]
+            writer.writerow(row)
+
+
+def run_association(cohort_samples, read_variants, classifications, case_cohorts=None, control_cohorts=None,
+                    output_dir="variant_classifications/all_cohorts"):
+    """
+    Builds the incidence matrix of all cohorts and writes one ranked association table per
+    case definition to output_dir. Without case_cohorts, every cohort is tested against
+    all others (association_<cohort>_vs_rest.csv); otherwise the given case cohorts are
+    tested against the control cohorts (association_<cases>_vs_<controls>.csv).
+
+    Parameters:
+    - cohort_samples (dict): Cohort name to a list of (sample name, cleaned file path).
+    - read_variants (callable): Yields (Gene, Nucleotide, Genoox_Classification) for a file.
+    - classifications (list): Classifications to include.
+    - case_cohorts (list, optional): Cohorts in the case group.
+    - control_cohorts (list, optional): Cohorts in the control group. Defaults to all other
+      cohorts; can only be given with case_cohorts.
+    - output_dir (str): Directory for the association tables.
+
+    Returns:
+    - dict: Output file path to the number of variants tested.
+    """
+    if control_cohorts and not case_cohorts:
+        raise ValueError("Control cohorts need case cohorts to be compared with (--case-cohorts).")
+
+    sample_names, sample_cohorts, variant_keys, matrix = build_incidence_matrix(
+        cohort_samples, read_variants, classifications)
+    cohorts = list(cohort_samples)
+    print(f"Incidence matrix: {len(variant_keys)} variants x {len(sample_names)} samples "
+          f"({matrix.nnz} carriers).")
+    carriers = cohort_carriers(matrix, sample_cohorts, len(cohorts))
+    cohort_sizes = np.bincount(sample_cohorts, minlength=len(cohorts))
+
+    if case_cohorts:
+        comparisons = [(list(case_cohorts), list(control_cohorts) if control_cohorts else
+                        [cohort for cohort in cohorts if cohort not in case_cohorts])]
+    else:
+        comparisons = [([cohort], [other for other in cohorts if other != cohort]) for cohort in cohorts]
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = {}
+    for cases, controls in comparisons:
+        missing = [cohort for cohort in cases + controls if cohort not in cohorts]
+        if missing:
+            raise ValueError(f"Unknown cohorts: {', '.join(missing)}")
+        if not controls:
+            continue
+        name = f"{'_'.join(cases)}_vs_{'rest' if not control_cohorts else '_'.join(controls)}"
+        output_file = os.path.join(output_dir, f"association_{name}.csv")
+        results = test_association(carriers, variant_keys, cohorts, cases, controls, cohort_sizes)
+        write_association_table(results, cohorts, output_file)
+        written[output_file] = len(results['keys'])
+    print("Association testing complete.")
+    return written
@@ -0,0 +1,214 @@
+"""
+Compact binary columnar form of the cleaned per-sample files written by clean_franklin.
+
+Each column is dictionary-encoded: the distinct values are stored once and every row
+holds a 32-bit code into that dictionary. The codes of each column are stored as one
+contiguous, 4-byte aligned block so that a reader can memory-map the file and use the
+codes in place, without parsing text or allocating a dict per row.
+
+File layout (native byte order, recorded in the header):
+- 8-byte magic b'VCOL1\\x00\\x00\\x00', 1-byte byte order flag (0 little, 1 big), 3 bytes padding
+- uint32 row count, uint32 column count
+- per column: uint32 name length, name (UTF-8), uint32 dictionary size,
+  uint32 offsets (dictionary size + 1) into the UTF-8 dictionary blob, the blob,
+  padding to a 4-byte boundary and finally uint32 codes (one per row)
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from compressed_io import strip_compression
+
+MAGIC = b'VCOL1\x00\x00\x00'
+EXTENSION = '.vcol'
+
+
+def columnar_path_for(csv_path):
+    """
+    Returns the path of the columnar file that belongs to a cleaned sample CSV file.
+
+    Parameters:
+    - csv_path (str): Path to the cleaned sample CSV file (compressed or not).
+
+    Returns:
+    - str: Path with the .csv extension (and any .gz or .zst) replaced by .vcol.
+    """
+    return os.path.splitext(strip_compression(csv_path))[0] + EXTENSION
+
+
+def has_fresh_columnar(csv_path):
+    """
+    Checks whether a columnar file exists for a CSV file and is at least as new as it,
+    so that a CSV rewritten without its columnar form is never shadowed by a stale cache.
+
+    Parameters:
+    - csv_path (str): Path to the cleaned sample CSV file.
+
+    Returns:
+    - bool: True if the columnar file can be used instead of the CSV file.
+    """
+    columnar_path = columnar_path_for(csv_path)
+    return (os.path.exists(columnar_path)
+            and os.path.getmtime(columnar_path) >= os.path.getmtime(csv_path))
+
+
+class ColumnarWriter:
+    """
+    Collects rows column by column and writes them to a columnar file on close.
+    Only the distinct values and one 32-bit code per cell are held in memory.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self.dictionaries = [{} for _ in self.columns]
+        self.codes = [array('I') for _ in self.columns]
+
+    def add_row(self, values):
+        """
+        Appends one row.
+
+        Parameters:
+        - values (sequence): One string value per column, in column order.
+        """
+        for dictionary, codes, value in zip(self.dictionaries, self.codes, values):
+            code = dictionary.get(value)
+            if code is None:
+                code = dictionary[value] = len(dictionary)
+            codes.append(code)
+
+    def close(self):
+        """
+        Writes the collected rows to the columnar file. The file is written to a
+        temporary path first so that readers never see a partly written file.
+        """
+        temp_path = f"{self.path}.tmp"
+        row_count = len(self.codes[0]) if self.codes else 0
+        with open(temp_path, 'wb') as file:
+            file.write(MAGIC)
+            file.write(struct.pack('=B3x', 0 if sys.byteorder == 'little' else 1))
+            file.write(struct.pack('=II', row_count, len(self.columns)))
+            for name, dictionary, codes in zip(self.columns, self.dictionaries, self.codes):
+                encoded_name = name.encode('utf-8')
+                file.write(struct.pack('=I', len(encoded_name)))
+                file.write(encoded_name)
+
+                # Dictionary values in code order, as offsets into one UTF-8 blob
+                encoded_values = [value.encode('utf-8') for value in dictionary]
+                offsets = array('I', [0])
+                for encoded_value in encoded_values:
+                    offsets.append(offsets[-1] + len(encoded_value))
+                file.write(struct.pack('=I', len(encoded_values)))
+                file.write(offsets.tobytes())
+                file.write(b''.join(encoded_values))
+
+                # Align the codes so they can be used in place through a memoryview
+                file.write(b'\x00' * (-file.tell() % 4))
+                file.write(codes.tobytes())
+        os.replace(temp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class ColumnarReader:
+    """
+    Memory-maps a columnar file. Column codes are exposed as memoryviews over the mapped
+    file, and only the (small) column dictionaries are decoded into Python strings.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self.dictionaries = {}
+        self.codes = {}
+        self.columns = []
+        self._parse()
+
+    def _parse(self):
+        view = self._view
+        if bytes(view[:8]) != MAGIC:
+            raise ValueError(f"{self.path} is not a columnar sample file.")
+        byte_order = 'little' if view[8] == 0 else 'big'
+        self.row_count, column_count = struct.unpack_from('=II', view, 12)
+        position = 20
+
+        for _ in range(column_count):
+            (name_length,) = struct.unpack_from('=I', view, position)
+            position += 4
+            name = bytes(view[position:position + name_length]).decode('utf-8')
+            position += name_length
+
+            (dictionary_size,) = struct.unpack_from('=I', view, position)
+            position += 4
+            offsets = array('I')
+            offsets.frombytes(view[position:position + 4 * (dictionary_size + 1)])
+            if byte_order != sys.byteorder:
+                offsets.byteswap()
+            position += 4 * (dictionary_size + 1)
+            blob = bytes(view[position:position + offsets[-1]])
+            position += offsets[-1]
+            dictionary = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(dictionary_size)]
+
+            position += -position % 4
+            code_bytes = view[position:position + 4 * self.row_count]
+            position += 4 * self.row_count
+            if byte_order == sys.byteorder:
+                codes = code_bytes.cast('I')
+            else:
+                # Files written on a machine with the other byte order are copied once
+                codes = array('I')
+                codes.frombytes(code_bytes)
+                codes.byteswap()
+
+            self.columns.append(name)
+            self.dictionaries[name] = dictionary
+            self.codes[name] = codes
+
+    def rows(self, columns):
+        """
+        Yields the decoded values of the given columns, one tuple per row. Values are the
+        shared dictionary strings, so no new strings are created per row.
+
+        Parameters:
+        - columns (list): Column names to return.
+
+        Yields:
+        - tuple: One value per requested column.
+        """
+        dictionaries = [self.dictionaries[column] for column in columns]
+        codes = [self.codes[column] for column in columns]
+        if len(columns) == 1:
+            dictionary = dictionaries[0]
+            for code in codes[0]:
+                yield (dictionary[code],)
+            return
+        for row_codes in zip(*codes):
+            yield tuple(dictionary[code] for dictionary, code in zip(dictionaries, row_codes))
+
+    def close(self):
+        """
+        Releases the memory map and closes the file.
+        """
+        for column, codes in self.codes.items():
+            if isinstance(codes, memoryview):
+                codes.release()
+        self.codes = {}
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
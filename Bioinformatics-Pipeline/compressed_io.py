@@ -0,0 +1,239 @@
+"""
+Transparent compressed text I/O for the pipeline and comparison scripts.
+
+open_text opens a text file for reading or writing and picks the compression from the
+file extension: '.gz' is gzip and '.zst' is Zstandard (the optional 'zstandard' package),
+anything else is a plain file opened with open(). When a compressed file is read, the
+decompression runs on a background thread that stays a few chunks ahead of the reader,
+so parsing the rows overlaps with reading and inflating the next ones (zlib and zstd
+release the GIL while they work).
+
+The cleaned sample files may therefore be '<sample>.csv', '<sample>.csv.gz' or
+'<sample>.csv.zst'; list_files and strip_compression let the scripts find them by the
+name they would have without compression.
+"""
+
+import gzip
+import io
+import os
+import queue
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File extension of each compression
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+COMPRESSIONS = {extension: compression for compression, extension in EXTENSIONS.items()}
+
+# Compression levels used when none is given (gzip.open would use the much slower 9)
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+# Size of each decompressed chunk and the number of chunks read ahead
+CHUNK_SIZE = 1024 * 1024
+READ_AHEAD_CHUNKS = 4
+
+
+def compression_of(path):
+    """
+    Returns the compression of a file from its extension.
+
+    Parameters:
+    - path (str): Path to the file.
+
+    Returns:
+    - str or None: 'gzip', 'zstd' or None for a plain file.
+    """
+    return COMPRESSIONS.get(os.path.splitext(path)[1])
+
+
+def strip_compression(path):
+    """
+    Returns a path without its compression extension, e.g. 'CVD46.csv' for 'CVD46.csv.gz'.
+
+    Parameters:
+    - path (str): Path to the file.
+
+    Returns:
+    - str: The path as it would be without compression.
+    """
+    return os.path.splitext(path)[0] if compression_of(path) else path
+
+
+def with_compression(path, compression=None):
+    """
+    Adds the extension of a compression to a path.
+
+    Parameters:
+    - path (str): Path to the uncompressed file.
+    - compression (str, optional): 'gzip', 'zstd' or None.
+
+    Returns:
+    - str: The path with the compression extension, or the path itself when compression is None.
+    """
+    if compression is None:
+        return path
+    if compression not in EXTENSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+    return path + EXTENSIONS[compression]
+
+
+def existing_path(path):
+    """
+    Finds the file of a path that may have been written with compression.
+
+    Parameters:
+    - path (str): Path to the uncompressed file.
+
+    Returns:
+    - str: The path itself if it exists, otherwise its first compressed form that exists,
+      otherwise the path itself.
+    """
+    if os.path.exists(path):
+        return path
+    for extension in EXTENSIONS.values():
+        if os.path.exists(path + extension):
+            return path + extension
+    return path
+
+
+def list_files(directory, extension):
+    """
+    Lists the files of a directory with an extension, compressed or not, sorted by their
+    name without compression (so the order is the same whether or not they are compressed).
+
+    Parameters:
+    - directory (str): Directory to list.
+    - extension (str): Extension of the uncompressed files, e.g. '.csv'.
+
+    Returns:
+    - list: (name without the extension, file name) pairs.
+    """
+    files = []
+    for file_name in os.listdir(directory):
+        stripped = strip_compression(file_name)
+        if stripped.endswith(extension):
+            files.append((stripped[:-len(extension)], file_name))
+    files.sort(key=lambda x: (strip_compression(x[1]), x[1]))
+    return files
+
+
+class ReadAheadReader(io.RawIOBase):
+    """
+    Reads a binary stream on a background thread. Chunks are put on a bounded queue
+    as they are read, so at most READ_AHEAD_CHUNKS chunks are held in memory.
+    """
+
+    def __init__(self, raw, chunk_size=CHUNK_SIZE, read_ahead=READ_AHEAD_CHUNKS):
+        super().__init__()
+        self._raw = raw
+        self._chunks = queue.Queue(maxsize=read_ahead)
+        self._stop = threading.Event()
+        self._error = None
+        self._pending = memoryview(b'')
+        self._finished = False
+        self._thread = threading.Thread(target=self._fill, args=(chunk_size,), daemon=True)
+        self._thread.start()
+
+    def _put(self, chunk):
+        # Waits for room on the queue, unless the reader is closed in the meantime
+        while not self._stop.is_set():
+            try:
+                self._chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _fill(self, chunk_size):
+        try:
+            while not self._stop.is_set():
+                chunk = self._raw.read(chunk_size)
+                if not chunk:
+                    break
+                self._put(chunk)
+        except Exception as error:
+            self._error = error
+        finally:
+            # An empty chunk marks the end of the stream
+            self._put(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            if self._finished:
+                return 0
+            chunk = self._chunks.get()
+            if not chunk:
+                self._finished = True
+                if self._error is not None:
+                    raise self._error
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._raw.close()
+        super().close()
+
+
+def open_compressed_binary(path, mode, level=None):
+    """
+    Opens the binary stream of a compressed file.
+
+    Parameters:
+    - path (str): Path to a '.gz' or '.zst' file.
+    - mode (str): 'rb' or 'wb'.
+    - level (int, optional): Compression level when writing.
+
+    Returns:
+    - file object: The decompressed (or compressing) binary stream.
+    """
+    compression = compression_of(path)
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+    if compression == 'gzip':
+        return gzip.open(path, mode, compresslevel=level)
+    if zstandard is None:
+        raise ImportError(f"Reading or writing {path} needs the 'zstandard' package (pip install zstandard).")
+    file = open(path, mode)
+    if mode == 'rb':
+        return zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True, closefd=True)
+    return zstandard.ZstdCompressor(level=level).stream_writer(file, closefd=True)
+
+
+def open_text(path, mode='r', encoding=None, newline=None, read_ahead=True, level=None):
+    """
+    Opens a text file, compressed or not, choosing the compression from its extension.
+
+    Parameters:
+    - path (str): Path to the file ('.gz' for gzip, '.zst' for Zstandard).
+    - mode (str): 'r' or 'w'.
+    - encoding (str, optional): Text encoding, as for open().
+    - newline (str, optional): Newline handling, as for open() ('' for csv files).
+    - read_ahead (bool): If True, decompress on a background thread while reading.
+    - level (int, optional): Compression level when writing (DEFAULT_LEVELS by default).
+
+    Returns:
+    - file object: A text stream that is used like the file object of open().
+    """
+    if mode not in ('r', 'w'):
+        raise ValueError(f"Unsupported mode: {mode}")
+    if compression_of(path) is None:
+        return open(path, mode, encoding=encoding, newline=newline)
+
+    binary = open_compressed_binary(path, mode + 'b', level)
+    if mode == 'r':
+        binary = io.BufferedReader(ReadAheadReader(binary) if read_ahead else binary, CHUNK_SIZE)
+    else:
+        binary = io.BufferedWriter(binary, CHUNK_SIZE)
+    return io.TextIOWrapper(binary, encoding=encoding, newline=newline)
@@ -0,0 +1,108 @@
+"""
+Canonical form of the (Gene, Nucleotide) keys that the scripts join and deduplicate on.
+
+Franklin, eVai, VIPR and the VCF annotations write the same variant slightly differently:
+with quotes or doubled "" artefacts from the exports, stray whitespace, a transcript
+prefix ('NM_000059.4:c.68A>G') or lower case bases ('c.68a>g'). normalise_gene and
+normalise_nucleotide reduce every value to one form:
+- quotes, "" artefacts and whitespace are removed
+- a transcript or reference sequence prefix before the HGVS description is dropped
+- the coordinate type is lower case ('c.', 'g.', 'n.', 'm.') and, in DNA descriptions,
+  the bases of every substitution and of deleted, inserted, duplicated or inverted
+  sequences are upper case ('c.68A>G', 'c.123dupA', 'c.10_11delinsAG')
+Other values (e.g. '.' or '') are only stripped.
+
+The same few hundred thousand variants recur across thousands of samples, so the results
+are kept in bounded LRU caches (CACHE_SIZE entries per function and process) and each
+distinct string is only parsed once.
+"""
+
+import re
+from functools import lru_cache
+
+# Entries kept in each cache
+CACHE_SIZE = 1 << 18
+
+# Quotes and whitespace left around values by the exports
+STRIP_CHARACTERS = '"\' \t\r\n'
+
+# Transcript or reference sequence prefix, e.g. 'NM_000059.4:' (or 'BRCA2:NM_000059.4:exon2:'),
+# before the HGVS description
+TRANSCRIPT_PREFIX = re.compile(r'^(?:[^:.]*(?:\.\d+)?:)+(?=[cgmnrp]\.)', re.IGNORECASE)
+
+# Substitution anywhere in a DNA description, e.g. the 'a>g' of 'c.68a>g'
+SUBSTITUTION = re.compile(r'([ACGTNacgtn])>([ACGTNacgtn])')
+
+# Sequence after a deletion, insertion, duplication or inversion, e.g. the 'ag' of 'c.10_11delinsag'
+SEQUENCE = re.compile(r'(delins|del|ins|dup|inv)([ACGTNacgtn]+)(?![A-Za-z])')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalise_gene(gene):
+    """
+    Returns the canonical form of a gene symbol.
+
+    Parameters:
+    - gene (str): Gene symbol as written by any of the tools.
+
+    Returns:
+    - str: The symbol without quotes, "" artefacts and surrounding whitespace.
+    """
+    return gene.replace('""', '').strip(STRIP_CHARACTERS)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalise_nucleotide(nucleotide):
+    """
+    Returns the canonical form of an HGVS nucleotide description.
+
+    Parameters:
+    - nucleotide (str): Nucleotide (Franklin), HGVS_Coding (eVai) or c. value (VIPR, VCF).
+
+    Returns:
+    - str: The description without quotes, whitespace or transcript prefix, with a lower
+      case coordinate type and upper case bases.
+    """
+    value = ''.join(nucleotide.replace('""', '').strip(STRIP_CHARACTERS).split())
+    value = TRANSCRIPT_PREFIX.sub('', value, count=1)
+    if len(value) > 1 and value[1] == '.' and value[0] in 'CGMNRP':
+        value = value[0].lower() + value[1:]
+    if value[:2] in ('c.', 'g.', 'm.', 'n.'):
+        value = SUBSTITUTION.sub(lambda match: f"{match.group(1).upper()}>{match.group(2).upper()}", value)
+        value = SEQUENCE.sub(lambda match: match.group(1) + match.group(2).upper(), value)
+    return value
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def variant_key(gene, nucleotide):
+    """
+    Returns the canonical (Gene, Nucleotide) key of a variant.
+
+    Parameters:
+    - gene (str): Gene symbol.
+    - nucleotide (str): HGVS nucleotide description.
+
+    Returns:
+    - tuple: The normalised gene and nucleotide.
+    """
+    return normalise_gene(gene), normalise_nucleotide(nucleotide)
+
+
+def normalise_field(field, value):
+    """
+    Normalises the value of a key field by its column name: Gene with normalise_gene,
+    Nucleotide and HGVS_Coding with normalise_nucleotide. Other fields are only stripped.
+
+    Parameters:
+    - field (str): Column name.
+    - value (str): Value of the column.
+
+    Returns:
+    - str: The normalised value.
+    """
+    if field == 'Gene':
+        return normalise_gene(value)
+    if field in ('Nucleotide', 'HGVS_Coding'):
+        return normalise_nucleotide(value)
+    return value.replace('""', '').strip(STRIP_CHARACTERS)
+
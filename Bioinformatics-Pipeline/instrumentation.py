@@ -0,0 +1,215 @@
+"""
+Per-stage instrumentation for run_pipeline.
+
+Every task of a stage (one sample for cleaning, one cohort for counting, and so on) is
+run through instrumented_call, which records its wall time, CPU time and its peak
+resident memory, and optionally profiles it with cProfile. Worker processes are reused
+across tasks, so the peak is reset before each task where the platform allows it (Linux);
+elsewhere it is the high-water mark of the worker process so far, which includes the
+tasks it ran before.
+The counters returned by the task itself (rows read and written, duplicates dropped)
+are added to its measurements. PipelineReport collects the measurements per stage,
+per cohort and per sample and writes them to a JSON report.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+from datetime import datetime
+
+# Counters that a task may return in a dict and that are summed per cohort and stage
+COUNTERS = ['rows_read', 'rows_written', 'duplicates']
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident memory of the current process.
+
+    Returns:
+    - float: Peak resident set size in MB.
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / (1024 * 1024)
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident memory of the current process (Linux only), so that
+    task_peak_rss_mb measures the task that runs next rather than everything the
+    process ran before.
+
+    Returns:
+    - bool: True if the peak was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def task_peak_rss_mb():
+    """
+    Returns the peak resident memory of the current process since reset_peak_rss.
+    Unlike ru_maxrss, the VmHWM field of /proc/self/status follows the reset.
+
+    Returns:
+    - float: Peak resident set size in MB.
+    """
+    with open('/proc/self/status', 'r') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return peak_rss_mb()
+
+
+def instrumented_call(function, args, profile_path=None):
+    """
+    Calls a function and measures it. Module-level so that it can run in a worker process.
+
+    Parameters:
+    - function (callable): Module-level function to call.
+    - args (tuple): Arguments of the call.
+    - profile_path (str, optional): Path to dump cProfile data of the call to.
+
+    Returns:
+    - tuple: The result of the call and a dict with wall_seconds, cpu_seconds, peak_rss_mb,
+      peak_rss_scope and any COUNTERS in the result. peak_rss_scope is 'task' when
+      peak_rss_mb is the peak of this call alone, or 'process' when the peak could not be
+      reset and it is the high-water mark of the process that ran the call so far.
+    """
+    reset = reset_peak_rss()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if profile_path:
+        profile = cProfile.Profile()
+        result = profile.runcall(function, *args)
+        profile.dump_stats(profile_path)
+    else:
+        result = function(*args)
+    metrics = {
+        'wall_seconds': round(time.perf_counter() - wall_start, 4),
+        'cpu_seconds': round(time.process_time() - cpu_start, 4),
+        'peak_rss_mb': round(task_peak_rss_mb() if reset else peak_rss_mb(), 1),
+        'peak_rss_scope': 'task' if reset else 'process',
+    }
+    if isinstance(result, dict):
+        metrics.update({counter: result[counter] for counter in COUNTERS if counter in result})
+    return result, metrics
+
+
+def add_metrics(total, metrics):
+    """
+    Adds the measurements of one task to a running total: times and counters are summed,
+    and peak memory is the maximum.
+
+    Parameters:
+    - total (dict): Running total, updated in place.
+    - metrics (dict): Measurements of one task.
+    """
+    for key, value in metrics.items():
+        if key == 'peak_rss_mb':
+            total[key] = max(total.get(key, 0), value)
+        elif key in COUNTERS or key.endswith('_seconds'):
+            total[key] = round(total.get(key, 0) + value, 4)
+    total['tasks'] = total.get('tasks', 0) + 1
+
+
+class PipelineReport:
+    """
+    Collects the measurements of a pipeline run and writes them to a JSON report.
+    """
+
+    def __init__(self, settings=None, profile_dir=None):
+        self.settings = settings or {}
+        self.profile_dir = profile_dir
+        self.stages = {}
+        self.cohorts = {}
+        self.started = datetime.now()
+        self._start = time.perf_counter()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def profile_path(self, stage, label):
+        """
+        Returns the path to dump the cProfile data of one task to, or None when profiling is off.
+
+        Parameters:
+        - stage (str): Stage name.
+        - label (tuple): (cohort, sample) of the task; either may be None.
+
+        Returns:
+        - str or None: Path of the .prof file.
+        """
+        if not self.profile_dir:
+            return None
+        name = '_'.join([stage] + [part for part in label if part])
+        return os.path.join(self.profile_dir, f"{name}.prof")
+
+    def record_stage(self, stage, wall_seconds, labels, task_metrics):
+        """
+        Records a finished stage and the measurements of its tasks.
+
+        Parameters:
+        - stage (str): Stage name (e.g. 'clean', 'count', 'combine').
+        - wall_seconds (float): Wall time of the whole stage, including parallel tasks.
+        - labels (list): (cohort, sample) of each task; either may be None.
+        - task_metrics (list): Measurements of each task, from instrumented_call.
+        """
+        # Stages without tasks (e.g. nothing changed in an incremental run) are left out
+        if not task_metrics:
+            return
+        summary = self.stages.setdefault(stage, {})
+        summary['wall_seconds'] = round(summary.get('wall_seconds', 0) + wall_seconds, 4)
+        for (cohort, sample), metrics in zip(labels, task_metrics):
+            # The wall time of the stage is measured as a whole; the wall times of its
+            # tasks, which overlap when run in parallel, are summed apart from it
+            stage_metrics = {('task_wall_seconds' if key == 'wall_seconds' else key): value
+                             for key, value in metrics.items()}
+            add_metrics(summary, stage_metrics)
+            if cohort is None:
+                continue
+            cohort_report = self.cohorts.setdefault(cohort, {'stages': {}, 'samples': {}})
+            add_metrics(cohort_report['stages'].setdefault(stage, {}), metrics)
+            if sample is not None:
+                cohort_report['samples'].setdefault(sample, {})[stage] = metrics
+
+        # Profiles of all tasks of the stage are merged into one file with a text summary
+        if self.profile_dir:
+            profile_paths = [self.profile_path(stage, label) for label in labels]
+            profile_paths = [path for path in profile_paths if os.path.exists(path)]
+            if profile_paths:
+                stats = pstats.Stats(*profile_paths)
+                # Named apart from the task profiles, which are '<stage>.prof' for unlabelled tasks
+                stats.dump_stats(os.path.join(self.profile_dir, f"{stage}_merged.prof"))
+                with open(os.path.join(self.profile_dir, f"{stage}_top.txt"), 'w') as summary_file:
+                    pstats.Stats(*profile_paths, stream=summary_file).sort_stats('cumulative').print_stats(30)
+
+    def to_dict(self):
+        """
+        Returns the report as a JSON-serialisable dict.
+        """
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'wall_seconds': round(time.perf_counter() - self._start, 4),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'settings': self.settings,
+            'stages': self.stages,
+            'cohorts': self.cohorts,
+        }
+
+    def save(self, report_path):
+        """
+        Writes the report to a JSON file.
+
+        Parameters:
+        - report_path (str): Path of the JSON report.
+        """
+        with open(report_path, 'w') as report_file:
+            json.dump(self.to_dict(), report_file, indent=2)
@@ -12,6 +12,8 @@ The script consists of three main functions:
    a consolidated view of variant occurrences across cohorts.
 
 Output:
+- Generates per-cohort summaries by variant (*_gene_nucleotide.csv) and by gene (*_gene.csv)
+  for each classification.
 - Generates eight output files, one for each classification, summarising variant 
   distribution across cohorts.
 
@@ -19,78 +21,397 @@ Author: Yentl Lamprecht (24952818@sun.ac.za)
 Date: 2024/11/04
 """
 
+import argparse
 import csv
+import hashlib
+import heapq
+import json
+import math
 import os
+import shutil
+import tempfile
+import time
+import zlib
+from array import array
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, groupby
 
+from association import run_association
+from columnar import ColumnarReader, ColumnarWriter, columnar_path_for, has_fresh_columnar
+from compressed_io import existing_path, list_files, open_text, strip_compression, with_compression
+from hgvs_normalise import normalise_gene, variant_key
+from instrumentation import PipelineReport, instrumented_call
+from vcf_ingest import read_gene_panel, read_vcf_records
+from variant_index import build_index
 
-def clean_franklin(input_file_path_default, input_file_path_UTR, output_file_path):
+# Maximum number of rows of a count file sorted in memory at once by combine_cohorts
+SORT_CHUNK_SIZE = 1000000
+
+def clean_franklin(input_file_path_default, input_file_path_UTR, output_file_path,
+                   streaming=False, duplicates_file_path=None, columnar_file_path=None):
     """
     Cleans and merges two Franklin input CSV files for a sample by removing unnecessary columns
     and duplicate rows. Writes the cleaned data to an output CSV file.
 
+    In streaming mode the rows of both input files are chained straight into the writer,
+    so only the set of (Gene, Nucleotide) keys is held in memory. Duplicate rows are
+    counted instead of printed, and optionally written to a side-file.
+
     Parameters:
     - input_file_path_default (str): Path to the first input CSV file (default variants).
     - input_file_path_UTR (str): Path to the second input CSV file (UTR variants).
     - output_file_path (str): Path to save the cleaned and merged output CSV file.
+    - streaming (bool): If True, stream rows instead of reading both files into memory
+      and summarise duplicates instead of printing each one.
+    - duplicates_file_path (str, optional): Path to a CSV file that receives the cleaned
+      duplicate rows. Only used in streaming mode.
+    - columnar_file_path (str, optional): Path to also write the cleaned rows to in the
+      binary columnar form (see columnar.py), which count_variants reads without CSV parsing.
 
     Returns:
-    - None: Writes the cleaned data to the specified output file.
+    - dict: Counts of rows read, rows written and duplicates dropped. Writes the cleaned
+      data to the specified output file.
     """
-    # Columns to retain in the output file for easier analysis
-    columns_to_keep = ["Gene", "Nucleotide", "Genoox_Classification", "Zygosity", "Inheritance_Model"]
-
-    # Read and merge rows from both input files
-    merged_rows = []
-    with open(input_file_path_default, 'r', encoding='utf-8') as infile1, open(input_file_path_UTR, 'r', encoding='utf-8') as infile2:
+    with open_text(input_file_path_default, 'r', encoding='utf-8') as infile1, open_text(input_file_path_UTR, 'r', encoding='utf-8') as infile2:
         reader1 = csv.DictReader(infile1)
         reader2 = csv.DictReader(infile2)
-        
-        for row in reader1:
-            merged_rows.append(row)
-        for row in reader2:
-            merged_rows.append(row)
 
-    # Write the cleaned and filtered data to a new file
-    with open(output_file_path, 'w', newline='', encoding='utf-8') as outfile:
+        # Chain rows from both input files; the legacy mode reads them all into memory first
+        merged_rows = chain(reader1, reader2)
+        if not streaming:
+            merged_rows = list(merged_rows)
+
+        return write_cleaned_rows(merged_rows, output_file_path, streaming, duplicates_file_path, columnar_file_path)
+
+
+def clean_vcf(vcf_file_path, output_file_path, streaming=False, duplicates_file_path=None,
+              columnar_file_path=None, genes=None):
+    """
+    Cleans a VCF file produced by variant_calling.pbs (plain or bgzip) into the same cleaned
+    sample file that clean_franklin writes for a pair of Franklin exports. Gene and
+    Nucleotide are taken from the ANN/CSQ annotations and the classification from ClinVar
+    CLNSIG (see vcf_ingest.py).
+
+    Parameters:
+    - vcf_file_path (str): Path to the sample VCF file (.vcf or .vcf.gz).
+    - output_file_path (str): Path to save the cleaned output CSV file.
+    - streaming (bool): If True, stream records instead of reading them all into memory
+      and summarise duplicates instead of printing each one.
+    - duplicates_file_path (str, optional): Path to a CSV file that receives the duplicate
+      rows. Only used in streaming mode.
+    - columnar_file_path (str, optional): Path to also write the cleaned rows to in the
+      binary columnar form.
+    - genes (set, optional): Gene panel. Only the blocks of the VCF that hold these genes
+      are read, using the block index of the file.
+
+    Returns:
+    - dict: Counts of rows read, rows written and duplicates dropped.
+    """
+    records = read_vcf_records(vcf_file_path, genes=genes)
+    if not streaming:
+        records = list(records)
+    return write_cleaned_rows(records, output_file_path, streaming, duplicates_file_path, columnar_file_path)
+
+
+def write_cleaned_rows(merged_rows, output_file_path, streaming=False, duplicates_file_path=None,
+                       columnar_file_path=None):
+    """
+    Writes the cleaned columns of a sample's rows to its output CSV file, dropping rows
+    whose (Gene, Nucleotide) pair was already written. Used by clean_franklin and clean_vcf.
+
+    Parameters:
+    - merged_rows (iterable): Row dicts with at least the columns to keep.
+    - output_file_path (str): Path to save the cleaned output CSV file.
+    - streaming (bool): If True, summarise duplicates instead of printing each one.
+    - duplicates_file_path (str, optional): Path to a CSV file that receives the cleaned
+      duplicate rows. Only used in streaming mode.
+    - columnar_file_path (str, optional): Path to also write the cleaned rows to in the
+      binary columnar form.
+
+    Returns:
+    - dict: Counts of rows read, rows written and duplicates dropped.
+    """
+    # Columns to retain in the output file for easier analysis
+    columns_to_keep = ["Gene", "Nucleotide", "Genoox_Classification", "Zygosity", "Inheritance_Model"]
+
+    with open_text(output_file_path, 'w', newline='', encoding='utf-8') as outfile:
+        # Write the cleaned and filtered data to a new file
         writer = csv.DictWriter(outfile, fieldnames=columns_to_keep)
         writer.writeheader()
 
+        # Duplicates are written to an optional side-file when streaming
+        duplicates_file = None
+        duplicates_writer = None
+        if streaming and duplicates_file_path:
+            duplicates_file = open_text(duplicates_file_path, 'w', newline='', encoding='utf-8')
+            duplicates_writer = csv.DictWriter(duplicates_file, fieldnames=columns_to_keep)
+            duplicates_writer.writeheader()
+
+        # Cleaned rows are also collected column by column for the columnar form
+        columnar_writer = ColumnarWriter(columnar_file_path, columns_to_keep) if columnar_file_path else None
+
         seen_entries = set()
         duplicate_entries = []
+        duplicate_count = 0
+        rows_read = 0
 
-        # Process and clean each row
-        for row in merged_rows:
-            unique_id = (row["Gene"], row["Nucleotide"])
-            if unique_id in seen_entries:
-                duplicate_entries.append(row)
-            else:
-                seen_entries.add(unique_id)
-                cleaned_row = {key: row[key].replace('""', '').strip('"') for key in columns_to_keep}
-                writer.writerow(cleaned_row)
-
-        if duplicate_entries:
-            print(f"Duplicate entries found in {output_file_path}:")
-            for entry in duplicate_entries:
-                print(entry)
+        try:
+            # Process and clean each row
+            for row in merged_rows:
+                rows_read += 1
+                # Gene and Nucleotide are written in their canonical form (see hgvs_normalise.py),
+                # so rows that only differ in quoting, transcript prefix or case are duplicates
+                unique_id = variant_key(row["Gene"], row["Nucleotide"])
+                if unique_id in seen_entries:
+                    duplicate_count += 1
+                    if not streaming:
+                        duplicate_entries.append(row)
+                    elif duplicates_writer is not None:
+                        duplicates_writer.writerow({key: row[key].replace('""', '').strip('"') for key in columns_to_keep})
+                else:
+                    seen_entries.add(unique_id)
+                    cleaned_row = {key: row[key].replace('""', '').strip('"') for key in columns_to_keep}
+                    cleaned_row["Gene"], cleaned_row["Nucleotide"] = unique_id
+                    writer.writerow(cleaned_row)
+                    if columnar_writer is not None:
+                        columnar_writer.add_row([cleaned_row[key] for key in columns_to_keep])
+        finally:
+            if duplicates_file is not None:
+                duplicates_file.close()
+
+    # Written after the CSV file so that the columnar form is never older than it
+    if columnar_writer is not None:
+        columnar_writer.close()
+
+    if streaming:
+        if duplicate_count:
+            destination = f" (written to {duplicates_file_path})" if duplicates_writer is not None else ""
+            print(f"{duplicate_count} duplicate entries found in {output_file_path}{destination}.")
         else:
             print(f"No duplicates found in {output_file_path}.")
+    elif duplicate_entries:
+        print(f"Duplicate entries found in {output_file_path}:")
+        for entry in duplicate_entries:
+            print(entry)
+    else:
+        print(f"No duplicates found in {output_file_path}.")
     print("Data cleaning complete.")
+    return {'rows_read': rows_read, 'rows_written': len(seen_entries), 'duplicates': duplicate_count}
 
   
-def count_variants(path_to_csv_files):
+def add_sample(sample_set, sample_id):
+    """
+    Adds an interned sample ID to a compact sample set. A set holding one sample is stored
+    as the bare integer ID; larger sets are stored as an unsigned int array of IDs.
+
+    Parameters:
+    - sample_set (int, array or None): Existing sample set, or None for an empty set.
+    - sample_id (int): Interned sample ID to add.
+
+    Returns:
+    - int or array: The updated sample set.
+    """
+    if sample_set is None:
+        return sample_id
+    if isinstance(sample_set, int):
+        return array('I', (sample_set, sample_id))
+    sample_set.append(sample_id)
+    return sample_set
+
+
+def sample_set_ids(sample_set):
+    """
+    Returns the interned sample IDs held in a compact sample set.
+
+    Parameters:
+    - sample_set (int or array): Sample set built with add_sample.
+
+    Returns:
+    - tuple or array: Sample IDs in the order they were added.
+    """
+    if isinstance(sample_set, int):
+        return (sample_set,)
+    return sample_set
+
+
+def sample_set_size(sample_set):
+    """
+    Returns the number of samples in a compact sample set.
+
+    Parameters:
+    - sample_set (int or array): Sample set built with add_sample.
+
+    Returns:
+    - int: The number of samples.
+    """
+    return 1 if isinstance(sample_set, int) else len(sample_set)
+
+
+def minimum_sample_count(sample_total, min_sample_count=1, min_cohort_frequency=0.0):
+    """
+    Returns the smallest Sample_Count that meets both a minimum sample count and a minimum
+    fraction of the cohort's samples.
+
+    Parameters:
+    - sample_total (int): Number of samples in the cohort.
+    - min_sample_count (int): Minimum number of samples.
+    - min_cohort_frequency (float): Minimum fraction of the cohort's samples (0 to 1).
+
+    Returns:
+    - int: The minimum Sample_Count.
+    """
+    # Rounded first so that e.g. 0.1 * 30 is 3 and not 3.0000000000000004
+    return max(min_sample_count, 1, math.ceil(round(min_cohort_frequency * sample_total, 9)))
+
+
+def check_pruning_options(min_sample_count=1, min_cohort_frequency=0.0, top_k=None):
+    """
+    Checks the limits on the variants kept by count_variants and raises a ValueError if
+    one of them is out of range.
+
+    Parameters:
+    - min_sample_count (int): Minimum number of samples, at least 1.
+    - min_cohort_frequency (float): Minimum fraction of the cohort's samples, from 0 to 1.
+    - top_k (int, optional): Number of variants kept per classification, at least 1.
+    """
+    if min_sample_count < 1:
+        raise ValueError(f"The minimum sample count must be at least 1, not {min_sample_count}.")
+    if not 0 <= min_cohort_frequency <= 1:
+        raise ValueError(f"The minimum cohort frequency must be from 0 to 1, not {min_cohort_frequency}.")
+    if top_k is not None and top_k < 1:
+        raise ValueError(f"top-k must be at least 1, not {top_k}.")
+
+
+def prune_variants(variants, remaining, minimum, top_k=None):
+    """
+    Removes the variants of one classification that can no longer be written, even if
+    they are found in every sample that is still to be read: those that cannot reach the
+    minimum sample count, and, with top_k, those that cannot reach the sample count of the
+    current k-th variant (counts only grow, so that count is a lower bound of the final one).
+
+    Parameters:
+    - variants (dict): Gene_Nucleotide to its compact sample set.
+    - remaining (int): Number of samples still to be read.
+    - minimum (int): Minimum sample count of a written variant.
+    - top_k (int, optional): Number of variants written per classification.
+
+    Returns:
+    - int: The sample count a variant needs to reach to be kept.
+    """
+    floor = minimum
+    if top_k is not None and len(variants) > top_k:
+        floor = max(floor, heapq.nlargest(top_k, map(sample_set_size, variants.values()))[-1])
+    if floor - remaining > 1:
+        for gene_nucleotide in [gene_nucleotide for gene_nucleotide, sample_set in variants.items()
+                                if sample_set_size(sample_set) + remaining < floor]:
+            del variants[gene_nucleotide]
+    return floor
+
+
+def select_counts(counts, minimum=1, top_k=None):
+    """
+    Orders (key, sample IDs) pairs by sample count, highest first, keeping only those with
+    at least minimum samples. With top_k, only the first top_k are selected with a heap
+    instead of sorting every pair. Pairs with equal counts keep their order in both cases.
+
+    Parameters:
+    - counts (iterable): (Gene_Nucleotide or Gene, sample IDs) pairs.
+    - minimum (int): Minimum number of samples.
+    - top_k (int, optional): Maximum number of pairs to return.
+
+    Returns:
+    - list: The selected pairs.
+    """
+    if minimum > 1:
+        counts = (count for count in counts if len(count[1]) >= minimum)
+    if top_k is not None:
+        return heapq.nlargest(top_k, counts, key=lambda x: len(x[1]))
+    return sorted(counts, key=lambda x: len(x[1]), reverse=True)
+
+
+def bitmap_ids(bitmap):
+    """
+    Returns the sample IDs set in a sample bitmap, in ascending order.
+
+    Parameters:
+    - bitmap (int): Bitmap with bit i set for every sample ID i in the set.
+
+    Returns:
+    - list: Sample IDs in ascending order.
+    """
+    ids = []
+    while bitmap:
+        lowest_bit = bitmap & -bitmap
+        ids.append(lowest_bit.bit_length() - 1)
+        bitmap ^= lowest_bit
+    return ids
+
+
+def read_sample_variants(file_path):
+    """
+    Reads the Gene, Nucleotide and Genoox_Classification columns of a cleaned sample file.
+    The binary columnar form is used when it exists and is up to date; otherwise the CSV
+    file is parsed. Gene and Nucleotide are normalised, so files cleaned before the
+    normalisation was added are counted with the same keys.
+
+    Parameters:
+    - file_path (str): Path to the cleaned sample CSV file.
+
+    Yields:
+    - tuple: (Gene, Nucleotide, Genoox_Classification) for each row.
+    """
+    if has_fresh_columnar(file_path):
+        with ColumnarReader(columnar_path_for(file_path)) as reader:
+            for gene, nucleotide, classification in reader.rows(['Gene', 'Nucleotide', 'Genoox_Classification']):
+                gene, nucleotide = variant_key(gene, nucleotide)
+                yield gene, nucleotide, classification
+        return
+
+    with open_text(file_path, mode='r') as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            gene, nucleotide = variant_key(row['Gene'], row['Nucleotide'])
+            yield gene, nucleotide, row['Genoox_Classification']
+
+
+def count_variants(path_to_csv_files, write_files=True, return_tables=False, min_sample_count=1,
+                   min_cohort_frequency=0.0, top_k=None, output_dir='variant_classifications'):
     """
     Counts and categorises variants by classification for each cohort.
     For each classification, it groups data by Gene_Nucleotide and Gene, creating two summary
     CSV files for further analysis.
 
+    Sample names are interned to integer IDs. Variant-level sample sets are stored as a
+    single ID or an array of IDs, and gene-level sample sets as integer bitmaps, so memory
+    grows with the number of sample memberships rather than with the sample name strings.
+
+    With a minimum sample count, a minimum cohort frequency or top_k, variants are pruned
+    while the samples are read: once a variant cannot reach the minimum (or the count of
+    the current k-th variant of its classification) even if it is in every remaining
+    sample, it is dropped, and new variants are no longer added when too few samples are
+    left. The rows written are the same as the full counts filtered afterwards; the same
+    limits are applied to the gene-level rows when they are written.
+
     Parameters:
     - path_to_csv_files (str): Path to the directory containing CSV files for the cohort samples.
+    - write_files (bool): If True, write the per-classification summary CSV files.
+    - return_tables (bool): If True, also return the summary rows, so they can be handed to
+      combine_cohorts or write_long_tables without reading the files back.
+    - min_sample_count (int): Only write rows with at least this many samples.
+    - min_cohort_frequency (float): Only write rows found in at least this fraction of the
+      cohort's samples (0 to 1).
+    - top_k (int, optional): Only write the top_k rows with the most samples per classification.
+    - output_dir (str): Directory the per-cohort folder of summary files is written to.
 
     Returns:
-    - None: Generates CSV files summarising variant counts by Gene_Nucleotide and Gene.
+    - dict: Counts of rows read and rows written. With return_tables, 'gene_nucleotide' and
+      'gene' map each classification to its (Gene_Nucleotide or Gene, Sample_Count, Samples)
+      rows, sorted by sample count as in the files.
     """
 
+    check_pruning_options(min_sample_count, min_cohort_frequency, top_k)
+
     # Extract cohort name from the path (e.g., 'Cohort_1' from 'Cohort_1/')
     cohort_name = os.path.basename(path_to_csv_files)
 
@@ -98,144 +419,1023 @@ def count_variants(path_to_csv_files):
                       'POSSIBLY_PATHOGENIC_LOW', 'POSSIBLY_PATHOGENIC_MODERATE', 
                       'POSSIBLY_BENIGN', 'LIKELY_BENIGN', 'BENIGN']
     
-    gene_nucleotide_data = {classification: defaultdict(list) for classification in classifications}
-    gene_data = {classification: defaultdict(set) for classification in classifications}
-
-    # Process each .csv file in the specified directory
-    for filename in os.listdir(path_to_csv_files):
-        if filename.endswith('.csv'):
-            sample_name = filename.replace('.csv', '')
-            file_path = os.path.join(path_to_csv_files, filename)
-            with open(file_path, mode='r') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    gene = row['Gene']
-                    nucleotide = row['Nucleotide']
-                    genoox_classification = row['Genoox_Classification']
-                    gene_nucleotide = f"{gene}_{nucleotide}"
+    gene_nucleotide_data = {classification: {} for classification in classifications}
+    gene_data = {classification: defaultdict(int) for classification in classifications}
+
+    # Sample names, indexed by their interned sample ID
+    sample_names = []
+    rows_read = 0
+    rows_written = 0
 
-                    # Group data by classification
-                    if genoox_classification in gene_nucleotide_data:
-                        gene_nucleotide_data[genoox_classification][gene_nucleotide].append(sample_name)
-                        gene_data[genoox_classification][gene].add(sample_name)
+    sample_files = list_files(path_to_csv_files, '.csv')
+    minimum = minimum_sample_count(len(sample_files), min_sample_count, min_cohort_frequency)
+    pruning = minimum > 1 or top_k is not None
+    # Sample count a variant must still be able to reach, per classification
+    floors = {classification: minimum for classification in classifications}
+    pruned_size = 0
+
+    # Process each .csv file (compressed or not) in the specified directory, in sorted
+    # order so that the Samples column is the same from run to run
+    for sample_name, filename in sample_files:
+        sample_id = len(sample_names)
+        sample_bit = 1 << sample_id
+        sample_names.append(sample_name)
+        remaining = len(sample_files) - sample_id - 1
+        file_path = os.path.join(path_to_csv_files, filename)
+        for gene, nucleotide, genoox_classification in read_sample_variants(file_path):
+            rows_read += 1
+            gene_nucleotide = f"{gene}_{nucleotide}"
+
+            # Group data by classification
+            if genoox_classification in gene_nucleotide_data:
+                variants = gene_nucleotide_data[genoox_classification]
+                sample_set = variants.get(gene_nucleotide)
+                # A variant first seen now can only be written if enough samples are left
+                if sample_set is not None or 1 + remaining >= floors[genoox_classification]:
+                    variants[gene_nucleotide] = add_sample(sample_set, sample_id)
+                gene_data[genoox_classification][gene] |= sample_bit
+
+        # Variants that can no longer be written are dropped whenever the number held has
+        # doubled, and after each of the last samples, where the minimum starts to bite
+        if pruning:
+            held = sum(len(variants) for variants in gene_nucleotide_data.values())
+            if held >= 2 * pruned_size or remaining < minimum - 1:
+                for classification, variants in gene_nucleotide_data.items():
+                    floors[classification] = prune_variants(variants, remaining, minimum, top_k)
+                pruned_size = sum(len(variants) for variants in gene_nucleotide_data.values())
+
+    # Write output files to the output directory (variant_classifications by default)
+    cohort_dir = os.path.join(output_dir, cohort_name)
+    if write_files:
+        os.makedirs(cohort_dir, exist_ok=True)
+
+    tables = {'gene_nucleotide': {}, 'gene': {}}
 
     # Output results for each classification
     for classification in classifications:
-        gene_nucleotide_output = [
-            {
-                'Gene_Nucleotide': gene_nucleotide,
-                'Sample_Count': len(samples),
-                'Samples': ', '.join(samples)
-            }
-            for gene_nucleotide, samples in gene_nucleotide_data[classification].items()
-        ]
-        gene_nucleotide_output.sort(key=lambda x: x['Sample_Count'], reverse=True)
-        # Write output files to the variant_classifications directory
-        output_dir = 'variant_classifications'
-        os.makedirs(output_dir, exist_ok=True)
-        cohort_dir = os.path.join(output_dir, cohort_name)
-        os.makedirs(cohort_dir, exist_ok=True)
+        # Sort the variants by sample count; rows are built as they are written
+        gene_nucleotide_counts = select_counts(
+            ((gene_nucleotide, sample_set_ids(samples))
+             for gene_nucleotide, samples in gene_nucleotide_data[classification].items()),
+            minimum, top_k)
 
-        with open(os.path.join(cohort_dir, f'{cohort_name}_{classification}_gene_nucleotide.csv'), mode='w', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=['Gene_Nucleotide', 'Sample_Count', 'Samples'])
-            writer.writeheader()
-            writer.writerows(gene_nucleotide_output)
+        # Gene-level summary: the number of samples with any variant of this classification in the gene
+        gene_counts = select_counts(
+            ((gene, bitmap_ids(bitmap)) for gene, bitmap in gene_data[classification].items()),
+            minimum, top_k)
+
+        for level, key, counts in (('gene_nucleotide', 'Gene_Nucleotide', gene_nucleotide_counts),
+                                   ('gene', 'Gene', gene_counts)):
+            rows = ((name, len(sample_ids), ', '.join(sample_names[sample_id] for sample_id in sample_ids))
+                    for name, sample_ids in counts)
+            if return_tables:
+                rows = tables[level][classification] = list(rows)
+            if write_files:
+                with open(os.path.join(cohort_dir, f'{cohort_name}_{classification}_{level}.csv'), mode='w', newline='') as file:
+                    writer = csv.writer(file)
+                    writer.writerow([key, 'Sample_Count', 'Samples'])
+                    writer.writerows(rows)
+            rows_written += len(counts)
 
     print("Variant counts complete.")
+    result = {'rows_read': rows_read, 'rows_written': rows_written}
+    if return_tables:
+        result.update(tables)
+    return result
 
 
-def combine_cohorts(classifications, cohorts):
+def write_long_tables(cohort_tables, classifications, output_dir='variant_classifications'):
+    """
+    Writes the variant counts of all cohorts to two long-format tables instead of one file
+    per cohort, classification and level: cohort_variant_counts.csv (Cohort, Classification,
+    Gene_Nucleotide, Sample_Count, Samples) and cohort_gene_counts.csv (Cohort,
+    Classification, Gene, Sample_Count, Samples). Within a cohort and classification, rows
+    are in the same order as in the per-cohort files.
+
+    Parameters:
+    - cohort_tables (dict): Cohort name to the result of count_variants(..., return_tables=True).
+    - classifications (list): Classifications to write, in row order.
+    - output_dir (str): Directory for the two tables.
+
+    Returns:
+    - dict: Count of rows written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rows_written = 0
+    for level, key, file_name in (('gene_nucleotide', 'Gene_Nucleotide', 'cohort_variant_counts.csv'),
+                                  ('gene', 'Gene', 'cohort_gene_counts.csv')):
+        with open(os.path.join(output_dir, file_name), mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Cohort', 'Classification', key, 'Sample_Count', 'Samples'])
+            for cohort, tables in cohort_tables.items():
+                for classification in classifications:
+                    rows = tables[level].get(classification, [])
+                    writer.writerows([cohort, classification] + list(row) for row in rows)
+                    rows_written += len(rows)
+    print("Long-format tables complete.")
+    return {'rows_written': rows_written}
+
+
+def sorted_count_rows(file_path, chunk_size=SORT_CHUNK_SIZE):
+    """
+    Reads a per-cohort *_gene_nucleotide.csv file and yields its counts sorted by
+    Gene_Nucleotide. Files larger than chunk_size rows are sorted in runs that are
+    spilled to temporary files and merged back, so memory is bounded by chunk_size.
+
+    Parameters:
+    - file_path (str): Path to the per-cohort count file.
+    - chunk_size (int): Maximum number of rows sorted in memory at once.
+
+    Yields:
+    - tuple: (Gene_Nucleotide, Sample_Count) in ascending Gene_Nucleotide order.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        run_paths = []
+        chunk = []
+        with open(file_path, newline='', mode='r') as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                chunk.append((row['Gene_Nucleotide'], int(row['Sample_Count'])))
+                if len(chunk) >= chunk_size:
+                    run_paths.append(spill_sorted_run(chunk, temp_dir, len(run_paths)))
+                    chunk = []
+
+        # Small files never touch the disk
+        if not run_paths:
+            chunk.sort()
+            yield from chunk
+            return
+
+        if chunk:
+            run_paths.append(spill_sorted_run(chunk, temp_dir, len(run_paths)))
+        runs = [open(run_path, newline='') for run_path in run_paths]
+        try:
+            readers = [((gene_nucleotide, int(count)) for gene_nucleotide, count in csv.reader(run)) for run in runs]
+            yield from heapq.merge(*readers)
+        finally:
+            for run in runs:
+                run.close()
+
+
+def spill_sorted_run(chunk, temp_dir, run_number):
+    """
+    Sorts a chunk of (Gene_Nucleotide, Sample_Count) rows and writes it to a temporary run file.
+
+    Parameters:
+    - chunk (list): Rows to sort and write.
+    - temp_dir (str): Directory for the run file.
+    - run_number (int): Sequence number used to name the run file.
+
+    Returns:
+    - str: Path to the written run file.
+    """
+    chunk.sort()
+    run_path = os.path.join(temp_dir, f"run_{run_number}.csv")
+    with open(run_path, mode='w', newline='') as run:
+        csv.writer(run).writerows(chunk)
+    return run_path
+
+
+def combine_cohorts(classifications, cohorts, total_cohorts=None, cohort_tables=None, chunk_size=SORT_CHUNK_SIZE,
+                    output_dir='variant_classifications'):
     """
     Combines variant count data across multiple cohorts for a set of classifications.
     Each cohort's data is merged based on the Gene_Nucleotide identifier to provide an overview
     of the variant counts across all cohorts.
 
+    The per-cohort files are read once each, sorted by Gene_Nucleotide and combined with a
+    streaming k-way merge, so all classifications are written in a single pass and memory
+    does not grow with the number of variants or cohorts. Rows in the combined files are
+    ordered by Gene_Nucleotide.
+
+    When cohort_tables is given, the counts are taken from the results of count_variants
+    instead, and the per-cohort files are not read (or needed).
+
     Parameters:
     - classifications (list): List of variant classifications to include in the merged data.
     - cohorts (list): List of cohort names to process and merge.
+    - total_cohorts (list, optional): Cohorts summed into the Total column. Defaults to all cohorts.
+    - cohort_tables (dict, optional): Cohort name to the result of
+      count_variants(..., return_tables=True).
+    - chunk_size (int): Maximum number of rows per cohort file sorted in memory at once.
+    - output_dir (str): Directory holding the per-cohort folders; the combined files are
+      written to its all_cohorts folder.
 
     Returns:
-    - None: Outputs a CSV file for each classification showing the combined counts across cohorts.
+    - dict: Counts of rows read and rows written. Outputs a CSV file for each classification
+      showing the combined counts across cohorts.
     """
+    if total_cohorts is None:
+        total_cohorts = cohorts
+    total_indices = [index for index, cohort in enumerate(cohorts) if cohort in total_cohorts]
 
-    # Helper function to read data from CSV for each cohort
-    def read_csv_to_dict(filepath, cohort_name):
-        data = {}
-        with open(filepath, newline='', mode='r') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                gene_nucleotide = row['Gene_Nucleotide']
-                sample_count = int(row['Sample_Count'])
-                data[gene_nucleotide] = {cohort_name: sample_count}
-        return data
-
-    # Merge data across cohorts for a given classification
-    def merge_cohort_data(classification):
-        merged_data = {}
-        for cohort in cohorts:
-            file_path = os.path.join("variant_classifications", cohort, f"{cohort}_{classification}_gene_nucleotide.csv")
+    # Stream of (classification, Gene_Nucleotide, cohort index, count) for one cohort,
+    # ordered by classification and then Gene_Nucleotide
+    def cohort_stream(cohort_index, cohort):
+        if cohort_tables is not None:
+            if cohort not in cohort_tables:
+                print(f"Warning: No counts for {cohort}. Skipping...")
+                return
+            for classification in sorted(classifications):
+                rows = cohort_tables[cohort]['gene_nucleotide'].get(classification, [])
+                for gene_nucleotide, sample_count in sorted(row[:2] for row in rows):
+                    yield classification, gene_nucleotide, cohort_index, sample_count
+            return
+        for classification in sorted(classifications):
+            file_path = os.path.join(output_dir, cohort, f"{cohort}_{classification}_gene_nucleotide.csv")
             # Check if the file exists before reading
-            if os.path.exists(file_path):
-                cohort_data = read_csv_to_dict(file_path, cohort)
-                for gene_nucleotide, counts in cohort_data.items():
-                    if gene_nucleotide not in merged_data:
-                        merged_data[gene_nucleotide] = {cohort: 0 for cohort in cohorts}
-                    merged_data[gene_nucleotide].update(counts)
-            else:
+            if not os.path.exists(file_path):
                 print(f"Warning: The file {file_path} does not exist. Skipping...")
+                continue
+            for gene_nucleotide, sample_count in sorted_count_rows(file_path, chunk_size):
+                yield classification, gene_nucleotide, cohort_index, sample_count
+
+    combined_dir = os.path.join(output_dir, "all_cohorts")
+    os.makedirs(combined_dir, exist_ok=True)
+
+    # Open one output file per classification so they are all written in the same pass
+    fieldnames = ['Gene_Nucleotide'] + cohorts + ['Total']
+    output_files = {}
+    writers = {}
+    rows_read = 0
+    rows_written = 0
+    try:
+        for classification in classifications:
+            output_file = os.path.join(combined_dir, f"combined_cohorts_{classification}_gene_nucleotide.csv")
+            output_files[classification] = open(output_file, mode='w', newline='')
+            writers[classification] = csv.writer(output_files[classification])
+            writers[classification].writerow(fieldnames)
+
+        # k-way merge across cohorts, grouping rows that share a classification and variant
+        streams = [cohort_stream(cohort_index, cohort) for cohort_index, cohort in enumerate(cohorts)]
+        merged = heapq.merge(*streams)
+        for (classification, gene_nucleotide), group in groupby(merged, key=lambda x: (x[0], x[1])):
+            counts = [0] * len(cohorts)
+            for _, _, cohort_index, sample_count in group:
+                counts[cohort_index] = sample_count
+                rows_read += 1
+            total = sum(counts[index] for index in total_indices)
+            writers[classification].writerow([gene_nucleotide] + counts + [total])
+            rows_written += 1
+    finally:
+        for output_file in output_files.values():
+            output_file.close()
+
+    print("Merging complete.")
+    return {'rows_read': rows_read, 'rows_written': rows_written}
+
+
+def file_fingerprint(file_path, previous=None):
+    """
+    Records the size, modification time and SHA-256 hash of an input file. The hash of a
+    previous fingerprint is reused when the size and modification time are unchanged, so
+    unchanged files are not re-read.
+
+    Parameters:
+    - file_path (str): Path to the file.
+    - previous (dict, optional): Fingerprint recorded for the same file in an earlier run.
+
+    Returns:
+    - dict: Fingerprint with 'path', 'size', 'mtime' and 'sha256' keys.
+    """
+    stat = os.stat(file_path)
+    fingerprint = {'path': file_path, 'size': stat.st_size, 'mtime': stat.st_mtime}
+    if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime:
+        fingerprint['sha256'] = previous['sha256']
+        return fingerprint
+
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(block)
+    fingerprint['sha256'] = sha256.hexdigest()
+    return fingerprint
+
+
+def load_manifest(manifest_path):
+    """
+    Loads the manifest of sample input fingerprints written by an earlier incremental run.
+
+    Parameters:
+    - manifest_path (str): Path to the JSON manifest.
+
+    Returns:
+    - dict: Fingerprints keyed by '<cohort output folder>/<sample>', or an empty dict.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+
+def save_manifest(manifest, manifest_path):
+    """
+    Writes the manifest of sample input fingerprints, replacing any earlier manifest.
+
+    Parameters:
+    - manifest (dict): Fingerprints keyed by '<cohort output folder>/<sample>'.
+    - manifest_path (str): Path to the JSON manifest.
+
+    Returns:
+    - None: Writes the manifest file.
+    """
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def update_cohort_counts(path_to_csv_files, classifications, updated_samples, removed_samples,
+                         output_dir='variant_classifications'):
+    """
+    Patches the per-cohort count files written by count_variants after samples were added,
+    changed or removed. Only the cleaned files of the added or changed samples are read;
+    removed and changed samples are taken out of the existing Samples columns.
+
+    Sample lists keep the same sorted order as a full recount. Rows with equal sample
+    counts keep their existing order, with new variants placed after them.
+
+    Parameters:
+    - path_to_csv_files (str): Path to the cohort directory of cleaned sample CSV files.
+    - classifications (list): Variant classifications to update.
+    - updated_samples (list): Names of samples that were added or changed.
+    - removed_samples (list): Names of samples that were removed.
+    - output_dir (str): Directory holding the per-cohort folder of summary files.
+
+    Returns:
+    - dict: Change in Sample_Count per Gene_Nucleotide, keyed by classification.
+    """
+    cohort_name = os.path.basename(path_to_csv_files)
+    cohort_dir = os.path.join(output_dir, cohort_name)
+    samples_to_drop = set(updated_samples) | set(removed_samples)
 
-        output_dir = "variant_classifications/all_cohorts"
-        os.makedirs(output_dir, exist_ok=True)
+    # Variants and genes of the added or changed samples
+    new_variants = {classification: defaultdict(list) for classification in classifications}
+    new_genes = {classification: defaultdict(set) for classification in classifications}
+    for sample_name in updated_samples:
+        for gene, nucleotide, genoox_classification in read_sample_variants(existing_path(os.path.join(path_to_csv_files, f"{sample_name}.csv"))):
+            if genoox_classification in new_variants:
+                new_variants[genoox_classification][f"{gene}_{nucleotide}"].append(sample_name)
+                new_genes[genoox_classification][gene].add(sample_name)
 
-        # Output file for merged data
-        output_file = os.path.join(output_dir, f"combined_cohorts_{classification}_gene_nucleotide.csv")
-        with open(output_file, mode='w', newline='') as csvfile:
-            fieldnames = ['Gene_Nucleotide'] + cohorts + ['Total']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    # Patch one count file and return the change in Sample_Count for each key
+    def patch_file(file_path, key_field, additions):
+        with open(file_path, mode='r', newline='') as file:
+            rows = [(row[key_field], row['Samples'].split(', ') if row['Samples'] else [])
+                    for row in csv.DictReader(file)]
+
+        changes = {}
+        patched = []
+        for key, samples in rows:
+            kept = [sample for sample in samples if sample not in samples_to_drop]
+            kept.extend(additions.pop(key, ()))
+            changes[key] = len(kept) - len(samples)
+            if kept:
+                patched.append((key, kept))
+        for key, samples in additions.items():
+            changes[key] = len(samples)
+            patched.append((key, list(samples)))
+
+        # Samples are listed in the same sorted file order as count_variants uses
+        for _, samples in patched:
+            samples.sort(key=lambda sample: f"{sample}.csv")
+        patched.sort(key=lambda x: len(x[1]), reverse=True)
+
+        temp_path = f"{file_path}.tmp"
+        with open(temp_path, mode='w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=[key_field, 'Sample_Count', 'Samples'])
             writer.writeheader()
-            for gene_nucleotide, counts in merged_data.items():
-                total = counts['Cohort_1'] + counts['Cohort_2'] + counts['Cohort_3'] + counts['Cohort_4']
-                writer.writerow({
-                    'Gene_Nucleotide': gene_nucleotide,
-                    'Cohort_1': counts['Cohort_1'],
-                    'Cohort_2': counts['Cohort_2'],
-                    'Cohort_3': counts['Cohort_3'],
-                    'Cohort_4': counts['Cohort_4'],
-                    'Total': total,
-                    'Cohort_5': counts['Cohort_5']
-                })
+            for key, samples in patched:
+                writer.writerow({key_field: key, 'Sample_Count': len(samples), 'Samples': ', '.join(samples)})
+        os.replace(temp_path, file_path)
+        return {key: change for key, change in changes.items() if change}
 
+    deltas = {}
     for classification in classifications:
-        merge_cohort_data(classification)
-    print("Merging complete.")
+        deltas[classification] = patch_file(
+            os.path.join(cohort_dir, f'{cohort_name}_{classification}_gene_nucleotide.csv'),
+            'Gene_Nucleotide', new_variants[classification])
+        patch_file(os.path.join(cohort_dir, f'{cohort_name}_{classification}_gene.csv'),
+                   'Gene', new_genes[classification])
+
+    print(f"Variant counts updated for {cohort_name}.")
+    return deltas
+
+
+def apply_combined_deltas(classifications, cohorts, cohort_deltas, total_cohorts=None,
+                          output_dir='variant_classifications'):
+    """
+    Applies per-cohort changes in Sample_Count to the combined files written by
+    combine_cohorts, instead of re-reading every cohort file. Rows whose counts all
+    drop to zero are removed and new variants are inserted in Gene_Nucleotide order.
+
+    Parameters:
+    - classifications (list): List of variant classifications to update.
+    - cohorts (list): List of cohort names, in the column order of the combined files.
+    - cohort_deltas (dict): Output of update_cohort_counts, keyed by cohort name.
+    - total_cohorts (list, optional): Cohorts summed into the Total column. Defaults to all cohorts.
+    - output_dir (str): Directory holding the all_cohorts folder of combined files.
+
+    Returns:
+    - bool: False if a combined file is missing or has different columns, in which case
+      nothing is changed and combine_cohorts should be run instead.
+    """
+    if total_cohorts is None:
+        total_cohorts = cohorts
+    total_indices = [index for index, cohort in enumerate(cohorts) if cohort in total_cohorts]
+    fieldnames = ['Gene_Nucleotide'] + cohorts + ['Total']
+    combined_dir = os.path.join(output_dir, "all_cohorts")
+
+    # Check every combined file before changing any of them
+    for classification in classifications:
+        file_path = os.path.join(combined_dir, f"combined_cohorts_{classification}_gene_nucleotide.csv")
+        if not os.path.exists(file_path):
+            return False
+        with open(file_path, mode='r', newline='') as file:
+            if next(csv.reader(file), None) != fieldnames:
+                return False
+
+    for classification in classifications:
+        # Changes for this classification as a list of per-cohort deltas per variant
+        deltas = defaultdict(lambda: [0] * len(cohorts))
+        for cohort_index, cohort in enumerate(cohorts):
+            for gene_nucleotide, change in cohort_deltas.get(cohort, {}).get(classification, {}).items():
+                deltas[gene_nucleotide][cohort_index] += change
+        if not deltas:
+            continue
+
+        file_path = os.path.join(combined_dir, f"combined_cohorts_{classification}_gene_nucleotide.csv")
+        temp_path = f"{file_path}.tmp"
+        with open(file_path, mode='r', newline='') as infile, open(temp_path, mode='w', newline='') as outfile:
+            reader = csv.reader(infile)
+            writer = csv.writer(outfile)
+            writer.writerow(next(reader))
+
+            existing = ((row[0], [int(count) for count in row[1:-1]]) for row in reader)
+            added = ((gene_nucleotide, [0] * len(cohorts)) for gene_nucleotide in sorted(deltas))
+            # Both streams are ordered by Gene_Nucleotide, so they can be merged as they are read
+            for gene_nucleotide, group in groupby(heapq.merge(existing, added, key=lambda x: x[0]), key=lambda x: x[0]):
+                counts = [sum(values) for values in zip(*(counts for _, counts in group))]
+                for cohort_index, change in enumerate(deltas.get(gene_nucleotide, ())):
+                    counts[cohort_index] += change
+                if any(counts):
+                    writer.writerow([gene_nucleotide] + counts + [sum(counts[index] for index in total_indices)])
+        os.replace(temp_path, file_path)
+
+    print("Combined counts updated.")
+    return True
+
+
+# Written into a shard folder once its map or reduce step has finished
+MAP_MARKER = 'map_complete.json'
+REDUCE_MARKER = 'reduce_complete.json'
+
+
+def shard_of(gene, shards):
+    """
+    Returns the shard of a gene. CRC-32 is used instead of hash() so that every process and
+    node puts a gene in the same shard.
+
+    Parameters:
+    - gene (str): Normalised gene symbol.
+    - shards (int): Number of shards.
+
+    Returns:
+    - int: Shard index, from 0 to shards - 1.
+    """
+    return zlib.crc32(gene.encode('utf-8')) % shards
+
+
+def clear_shards(shard_dir):
+    """
+    Removes the shard folders (shard_<i>) of an earlier run from shard_dir. Nothing else
+    in shard_dir is removed.
+
+    Parameters:
+    - shard_dir (str): Folder holding all shards.
+    """
+    if not os.path.isdir(shard_dir):
+        return
+    for entry in os.scandir(shard_dir):
+        if entry.is_dir(follow_symlinks=False) and entry.name.startswith('shard_') and entry.name[6:].isdigit():
+            shutil.rmtree(entry.path)
+
+
+def write_shard_marker(shard_folder, marker, contents):
+    """
+    Writes the marker of a finished map or reduce step into a shard folder.
+
+    Parameters:
+    - shard_folder (str): Folder of the shard.
+    - marker (str): MAP_MARKER or REDUCE_MARKER.
+    - contents (dict): Details of the step, e.g. the number of shards.
+    """
+    temp_path = os.path.join(shard_folder, f"{marker}.tmp")
+    with open(temp_path, 'w') as file:
+        json.dump(contents, file, indent=2)
+    os.replace(temp_path, os.path.join(shard_folder, marker))
+
+
+def read_shard_marker(shard_folder, marker):
+    """
+    Reads the marker of a finished map or reduce step of a shard folder.
+
+    Parameters:
+    - shard_folder (str): Folder of the shard.
+    - marker (str): MAP_MARKER or REDUCE_MARKER.
+
+    Returns:
+    - dict or None: Details of the step, or None if it has not finished.
+    """
+    marker_path = os.path.join(shard_folder, marker)
+    if not os.path.exists(marker_path):
+        return None
+    with open(marker_path, 'r') as file:
+        return json.load(file)
+
+
+def shard_path(shard_dir, shard_index):
+    """
+    Returns the folder of one shard, e.g. 'shards/shard_3'.
+
+    Parameters:
+    - shard_dir (str): Folder holding all shards.
+    - shard_index (int): Shard index.
+
+    Returns:
+    - str: Path of the shard folder.
+    """
+    return os.path.join(shard_dir, f"shard_{shard_index}")
+
+
+def shard_sample(file_path, cohort, shard_dir, shards):
+    """
+    Map step of the sharded mode: splits the rows of a cleaned sample file by the hash of
+    their Gene into one file per shard (<shard_dir>/shard_<i>/<cohort>/<sample>.csv).
+
+    Every shard gets a file for every sample, with only the header when none of the
+    sample's genes fall in it, so each reducer sees the full list of samples of a cohort
+    (for the Samples column and --min-cohort-frequency). All variants of a gene are in one
+    shard, so the variant and gene counts of a shard are final for its genes.
+
+    Parameters:
+    - file_path (str): Path to the cleaned sample file (optionally compressed).
+    - cohort (str): Cohort folder name.
+    - shard_dir (str): Folder holding all shards.
+    - shards (int): Number of shards.
+
+    Returns:
+    - dict: Counts of rows read and rows written.
+    """
+    file_name = os.path.basename(file_path)
+    rows_read = 0
+    shard_files = []
+    try:
+        with open_text(file_path, mode='r', newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader, None)
+            writers = []
+            for shard_index in range(shards):
+                shard_files.append(open_text(os.path.join(shard_path(shard_dir, shard_index), cohort, file_name),
+                                             mode='w', newline=''))
+                writers.append(csv.writer(shard_files[-1]))
+                if header is not None:
+                    writers[-1].writerow(header)
+            if header is not None:
+                gene_index = header.index('Gene')
+                for row in reader:
+                    rows_read += 1
+                    writers[shard_of(normalise_gene(row[gene_index]), shards)].writerow(row)
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+    return {'rows_read': rows_read, 'rows_written': rows_read}
+
+
+def reduce_shard(shard_folder, classifications, cohorts, total_cohorts=None, min_sample_count=1,
+                 min_cohort_frequency=0.0, shards=None):
+    """
+    Reduce step of the sharded mode: counts the variants of every cohort in one shard and
+    combines them across cohorts, writing the usual variant_classifications layout inside
+    the shard folder. The counts are handed to combine_cohorts in memory. Reducers do not
+    depend on each other, so each can run on its own node (e.g. as a PBS array job).
+
+    The shard must have been mapped completely (MAP_MARKER), so that a reducer that runs
+    before or after a failed map job fails instead of counting an empty or partial shard.
+    REDUCE_MARKER is written once the shard has been counted and combined.
+
+    Parameters:
+    - shard_folder (str): Folder of the shard, written by shard_sample.
+    - classifications (list): Classifications to combine.
+    - cohorts (list): Cohort names, in the column order of the combined files.
+    - total_cohorts (list, optional): Cohorts summed into the Total column. Defaults to all cohorts.
+    - min_sample_count (int): Only keep variants and genes found in at least this many samples.
+    - min_cohort_frequency (float): Only keep variants and genes found in at least this
+      fraction of a cohort's samples.
+    - shards (int, optional): Number of shards the reducer expects the samples to be split into.
+
+    Returns:
+    - dict: Counts of rows read and rows written.
+    """
+    mapped = read_shard_marker(shard_folder, MAP_MARKER) if os.path.isdir(shard_folder) else None
+    if mapped is None:
+        raise FileNotFoundError(f"{shard_folder} has not been mapped; run --shard-stage map first.")
+    if shards is not None and mapped['shards'] != shards:
+        raise ValueError(f"{shard_folder} was mapped into {mapped['shards']} shards, not {shards}.")
+    missing = [cohort for cohort in mapped['cohorts'] if not os.path.isdir(os.path.join(shard_folder, cohort))]
+    if missing:
+        raise FileNotFoundError(f"The folders of {', '.join(missing)} are missing from {shard_folder}.")
+
+    # A reducer that fails part way leaves no marker behind
+    if os.path.exists(os.path.join(shard_folder, REDUCE_MARKER)):
+        os.remove(os.path.join(shard_folder, REDUCE_MARKER))
+
+    output_dir = os.path.join(shard_folder, 'variant_classifications')
+    cohort_tables = {}
+    rows_read = 0
+    rows_written = 0
+    for cohort in cohorts:
+        if cohort not in mapped['cohorts']:
+            continue
+        cohort_folder = os.path.join(shard_folder, cohort)
+        result = count_variants(cohort_folder, return_tables=True, min_sample_count=min_sample_count,
+                                min_cohort_frequency=min_cohort_frequency, output_dir=output_dir)
+        cohort_tables[cohort] = result
+        rows_read += result['rows_read']
+        rows_written += result['rows_written']
+    result = combine_cohorts(classifications, cohorts, total_cohorts, cohort_tables, output_dir=output_dir)
+    write_shard_marker(shard_folder, REDUCE_MARKER, {'shards': mapped['shards'], 'cohorts': mapped['cohorts']})
+    print(f"Shard {os.path.basename(shard_folder)} reduced.")
+    return {'rows_read': rows_read, 'rows_written': rows_written + result['rows_written']}
+
+
+def merge_shard_outputs(shard_dir, shards, folder, output_dir='variant_classifications'):
+    """
+    Final step of the sharded mode: concatenates the outputs of one folder of the reducers
+    (a cohort, or 'all_cohorts') into output_dir. The shards hold disjoint sets of genes,
+    so no counts are added up: the per-cohort files are merged by Sample_Count (highest
+    first, as written by count_variants) and the combined files by Gene_Nucleotide (as
+    written by combine_cohorts). Rows with the same Sample_Count are taken shard by shard,
+    so they may be in a different order than in an unsharded run.
+
+    Parameters:
+    - shard_dir (str): Folder holding all shards.
+    - shards (int): Number of shards.
+    - folder (str): Cohort name or 'all_cohorts'.
+    - output_dir (str): Directory the merged folder is written to.
+
+    Returns:
+    - dict: Counts of rows read and rows written.
+    """
+    input_dirs = [os.path.join(shard_path(shard_dir, shard_index), 'variant_classifications', folder)
+                  for shard_index in range(shards)]
+    file_names = sorted(set(chain.from_iterable(
+        os.listdir(input_dir) for input_dir in input_dirs if os.path.isdir(input_dir))))
+    if folder == 'all_cohorts':
+        sort_key = lambda row: row[0]
+    else:
+        sort_key = lambda row: -int(row[1])
+
+    merged_dir = os.path.join(output_dir, folder)
+    if file_names:
+        os.makedirs(merged_dir, exist_ok=True)
+    rows_written = 0
+    for file_name in file_names:
+        input_files = []
+        try:
+            for input_dir in input_dirs:
+                input_path = os.path.join(input_dir, file_name)
+                if os.path.exists(input_path):
+                    input_files.append(open(input_path, mode='r', newline=''))
+            readers = [csv.reader(input_file) for input_file in input_files]
+            headers = [next(reader, None) for reader in readers]
+            with open(os.path.join(merged_dir, file_name), mode='w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(next(header for header in headers if header is not None))
+                for row in heapq.merge(*readers, key=sort_key):
+                    writer.writerow(row)
+                    rows_written += 1
+        finally:
+            for input_file in input_files:
+                input_file.close()
+    return {'rows_read': rows_written, 'rows_written': rows_written}
+
+
+def run_tasks(function, tasks, workers=1):
+    """
+    Runs a function over a list of argument tuples, either one after another or across
+    a pool of worker processes. Results are returned in the same order as the tasks.
+
+    Parameters:
+    - function (callable): Module-level function to call for each task.
+    - tasks (list): List of argument tuples, one per call.
+    - workers (int): Number of worker processes. A value of 1 runs the tasks serially.
+
+    Returns:
+    - list: The result of each call, in task order.
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        return [function(*task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        futures = [executor.submit(function, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def run_stage(report, stage, function, tasks, workers=1, labels=None):
+    """
+    Runs the tasks of one pipeline stage through run_tasks, measuring each task and
+    recording the measurements in the pipeline report.
+
+    Parameters:
+    - report (PipelineReport): Report that receives the measurements.
+    - stage (str): Stage name used in the report.
+    - function (callable): Module-level function to call for each task.
+    - tasks (list): List of argument tuples, one per call.
+    - workers (int): Number of worker processes. A value of 1 runs the tasks serially.
+    - labels (list, optional): (cohort, sample) of each task, used to group the measurements.
+
+    Returns:
+    - list: The result of each call, in task order.
+    """
+    if labels is None:
+        labels = [(None, None)] * len(tasks)
+    start = time.perf_counter()
+    outcomes = run_tasks(instrumented_call, [(function, task, report.profile_path(stage, label))
+                                             for task, label in zip(tasks, labels)], workers)
+    report.record_stage(stage, time.perf_counter() - start, labels, [metrics for _, metrics in outcomes])
+    return [result for result, _ in outcomes]
+
+
+def cohort_sample_files(cohorts):
+    """
+    Lists the cleaned sample files of each cohort folder, in sorted order.
+
+    Parameters:
+    - cohorts (list): Cohort folder names.
+
+    Returns:
+    - dict: Cohort name to a list of (sample name, file path).
+    """
+    return {cohort: [(sample, os.path.join(cohort, filename)) for sample, filename in list_files(cohort, '.csv')]
+            for cohort in cohorts if os.path.isdir(cohort)}
+
+
+def index_cohorts(db_path, cohort_folders, samples=None, removed_samples=None):
+    """
+    Loads cleaned samples into the SQLite variant index (see variant_index.build_index)
+    and returns the number of inserted rows as a report counter.
+
+    Returns:
+    - dict: Count of rows written to the index.
+    """
+    return {'rows_written': build_index(db_path, cohort_folders, samples, removed_samples)}
+
+
+def merge_shards(report, shards, shard_dir, cohorts, workers=1, output_dir='variant_classifications'):
+    """
+    Checks that every shard has been reduced and concatenates the outputs of the reducers
+    into output_dir, one task per cohort and one for the combined files.
+
+    Parameters:
+    - report (PipelineReport): Report that receives the measurements.
+    - shards (int): Number of shards.
+    - shard_dir (str): Folder holding all shards.
+    - cohorts (list): Cohort names.
+    - workers (int): Number of worker processes.
+    - output_dir (str): Directory the merged cohort and all_cohorts folders are written to.
+    """
+    reduced = [read_shard_marker(shard_path(shard_dir, index), REDUCE_MARKER)
+               if os.path.isdir(shard_path(shard_dir, index)) else None for index in range(shards)]
+    missing = [index for index, marker in enumerate(reduced) if marker is None]
+    if missing:
+        raise FileNotFoundError(f"Shards {missing} of {shard_dir} have not been reduced.")
+    mismatched = [index for index, marker in enumerate(reduced) if marker['shards'] != shards]
+    if mismatched:
+        raise ValueError(f"Shards {mismatched} of {shard_dir} were not mapped into {shards} shards.")
+    folders = cohorts + ['all_cohorts']
+    run_stage(report, 'merge_shards', merge_shard_outputs, [(shard_dir, shards, folder, output_dir) for folder in folders],
+              workers, [(folder, None) for folder in folders])
+    print("Shards merged.")
+
+
+def finish_report(report, report_path):
+    """
+    Writes the pipeline report and prints a one-line summary of each stage.
+
+    Parameters:
+    - report (PipelineReport): Report of the run.
+    - report_path (str, optional): Path of the JSON report. Nothing is written if None.
+    """
+    if not report_path:
+        return
+    for stage, summary in report.stages.items():
+        print(f"{stage}: {summary['wall_seconds']:.2f} s wall, {summary.get('cpu_seconds', 0):.2f} s CPU, "
+              f"{summary.get('rows_read', 0)} rows read, {summary.get('rows_written', 0)} rows written.")
+    report.save(report_path)
+    print(f"Report written to {report_path}.")
 
 
 # Main function to run the entire pipeline
-def run_pipeline():
+def run_pipeline(streaming=False, workers=1, incremental=False, manifest_path='pipeline_manifest.json',
+                 index_db=None, columnar=False, report_path=None, profile_dir=None, gene_panel=None,
+                 association=False, case_cohorts=None, control_cohorts=None, in_memory=False,
+                 output_layout='legacy', compression=None, min_sample_count=1, min_cohort_frequency=0.0,
+                 top_k=None, shards=None, shard_dir='shards', shard_stage=None, shard_index=None,
+                 output_dir='variant_classifications'):
+    """
+    Runs the full Cohort Comparison pipeline: cleans every sample, counts variants for
+    each cohort and combines the counts across cohorts. Samples are read from their pair of
+    Franklin exports or, for samples that were not uploaded to Franklin, from their
+    annotated VCF file (<sample>.vcf or <sample>.vcf.gz) in the cohort folder.
+
+    In incremental mode a manifest of input sizes, modification times and hashes is kept
+    between runs. Unchanged samples are not cleaned again, and the per-cohort and combined
+    counts are patched with the variants of the added, changed or removed samples only.
+
+    In sharded mode the cleaned rows are split by the hash of their Gene into shards
+    (shard_sample), each shard is counted and combined on its own (reduce_shard) and the
+    shard outputs are concatenated into output_dir (merge_shard_outputs).
+    The three steps run one after another here, with the reducers spread over the worker
+    processes, or one at a time with shard_stage, so the reducers can run as separate jobs.
+
+    Parameters:
+    - streaming (bool): If True, clean samples in streaming mode and write duplicate rows
+      to per-sample side-files under 'duplicates/' instead of printing them.
+    - workers (int): Number of worker processes used to clean samples and count cohorts.
+      Outputs are identical to the serial run (workers=1).
+    - incremental (bool): If True, only reprocess samples whose inputs changed since the last run.
+    - manifest_path (str): Path to the JSON manifest used in incremental mode.
+    - index_db (str, optional): Path to a SQLite variant index (see variant_index.py) that is
+      kept up to date with the cleaned samples.
+    - columnar (bool): If True, also write each cleaned sample in the binary columnar form,
+      which the counting stages read instead of the CSV file.
+    - report_path (str, optional): Path to write a JSON report to with the wall time, CPU time,
+      rows read and written, duplicates dropped and peak memory of each stage, cohort and sample.
+    - profile_dir (str, optional): Directory to dump cProfile data of every task to, with a
+      merged profile and a text summary of the hottest functions for each stage.
+    - gene_panel (str, optional): File with one gene per line. Only the blocks of VCF samples
+      that hold these genes are read (Franklin exports are not filtered).
+    - association (bool): If True, test every variant for a difference in carrier frequency
+      between cohorts and write ranked tables to <output_dir>/all_cohorts
+      (see association.py).
+    - case_cohorts (list, optional): Case cohorts of the association tests. By default every
+      cohort is tested against the others.
+    - control_cohorts (list, optional): Control cohorts of the association tests. Defaults to
+      all cohorts that are not case cohorts.
+    - in_memory (bool): If True, the counts of every cohort are handed from the counting stage
+      to the combining stage directly instead of being read back from the per-cohort files.
+    - output_layout (str): 'legacy' writes one file per cohort, classification and level under
+      <output_dir>/<cohort>; 'long' writes the two long-format tables of
+      write_long_tables instead (and implies in_memory); 'both' writes both.
+    - compression (str, optional): 'gzip' or 'zstd' to write the cleaned samples and their
+      duplicate side-files compressed (<sample>.csv.gz or .csv.zst). Compressed Franklin
+      exports and cleaned samples are read whatever this is set to.
+    - min_sample_count (int): Only keep variants and genes found in at least this many samples
+      of a cohort in the per-cohort counts (and so in the combined counts).
+    - min_cohort_frequency (float): Only keep variants and genes found in at least this
+      fraction of a cohort's samples.
+    - top_k (int, optional): Only keep the top_k variants and genes with the most samples per
+      cohort and classification.
+    - shards (int, optional): Number of gene-hash shards to count and combine separately.
+    - shard_dir (str): Folder for the shard files and the outputs of the reducers.
+    - shard_stage (str, optional): Run only one step of the sharded mode: 'map' cleans the
+      samples and splits them into shards, 'reduce' counts and combines the shard
+      shard_index, and 'merge' concatenates the outputs of all shards.
+    - shard_index (int, optional): Shard reduced by shard_stage='reduce'.
+    - output_dir (str): Directory for the per-cohort and combined counts and the
+      association tables.
+
+    Returns:
+    - None: Writes the cleaned samples and the output_dir outputs.
+    """
+    if output_layout not in ('legacy', 'long', 'both'):
+        raise ValueError(f"Unknown output layout: {output_layout}")
+    check_pruning_options(min_sample_count, min_cohort_frequency, top_k)
+    # Incremental runs patch the per-cohort files, so they need the legacy layout on disk
+    if incremental and (in_memory or output_layout != 'legacy'):
+        raise ValueError("Incremental mode patches the per-cohort count files; "
+                         "it cannot be combined with in-memory counts or the long output layout.")
+    # The patched counts would no longer match pruned ones
+    pruning = min_sample_count > 1 or min_cohort_frequency > 0 or top_k is not None
+    if incremental and pruning:
+        raise ValueError("Incremental mode patches the full per-cohort counts; it cannot be combined with "
+                         "a minimum sample count, a minimum cohort frequency or top-k.")
+    # The per-cohort files are not written in the long layout, so there is nothing to read back
+    in_memory = in_memory or output_layout == 'long'
+    if control_cohorts and not case_cohorts:
+        raise ValueError("Control cohorts need case cohorts to be compared with (--case-cohorts).")
+    if shard_stage is not None and not shards:
+        raise ValueError("A shard stage needs the number of shards.")
+    if shards is not None:
+        if shards < 1:
+            raise ValueError("The number of shards must be at least 1.")
+        if shard_stage not in (None, 'map', 'reduce', 'merge'):
+            raise ValueError(f"Unknown shard stage: {shard_stage}")
+        if shard_stage == 'reduce' and not (shard_index is not None and 0 <= shard_index < shards):
+            raise ValueError(f"The reduce stage needs a shard index from 0 to {shards - 1}.")
+        # Shards are merged into the per-cohort files; the top k of a cohort spans every shard
+        if incremental or output_layout != 'legacy' or top_k is not None:
+            raise ValueError("Sharded mode writes the legacy layout from scratch; it cannot be combined with "
+                             "--incremental, the long output layout or top-k.")
+
     # Define the list of cohorts to process
     cohort_folders = ['Cohort_1_raw', 'Cohort_2_raw', 'Cohort_3_raw', 'Cohort_4_raw', 'Cohort_5_raw']
     
     # Define corresponding output folders
     cohort_output_folders = ['Cohort_1', 'Cohort_2', 'Cohort_3', 'Cohort_4', 'Cohort_5']
 
+    # Combine data from different cohorts
+    classifications = [
+        "BENIGN", "LIKELY_BENIGN", "LIKELY_PATHOGENIC", "PATHOGENIC",
+        "POSSIBLY_BENIGN", "POSSIBLY_PATHOGENIC_LOW", "POSSIBLY_PATHOGENIC_MODERATE", "UNCERTAIN_SIGNIFICANCE"
+    ]
+    
+    # Define cohort names for combining data
+    cohorts = ['Cohort_1', 'Cohort_2', 'Cohort_3', 'Cohort_4', 'Cohort_5']
+
+    # Cohort_5 is left out of the Total so it can be compared against the other cohorts
+    total_cohorts = cohorts[:-1]
+
+    # The association tables are written next to the combined counts
+    association_dir = os.path.join(output_dir, 'all_cohorts')
+
+    # Measurements of every stage, cohort and sample
+    report = PipelineReport(settings={'streaming': streaming, 'workers': workers, 'incremental': incremental,
+                                      'index_db': index_db, 'columnar': columnar, 'in_memory': in_memory,
+                                      'output_layout': output_layout, 'compression': compression,
+                                      'min_sample_count': min_sample_count,
+                                      'min_cohort_frequency': min_cohort_frequency, 'top_k': top_k,
+                                      'shards': shards, 'shard_stage': shard_stage, 'shard_index': shard_index,
+                                      'output_dir': output_dir},
+                            profile_dir=profile_dir)
+
+    # The reduce and merge steps of a sharded run start from the shard files of the map step
+    if shard_stage == 'reduce':
+        run_stage(report, 'reduce', reduce_shard,
+                  [(shard_path(shard_dir, shard_index), classifications, cohorts, total_cohorts,
+                    min_sample_count, min_cohort_frequency, shards)], labels=[(None, f"shard_{shard_index}")])
+        finish_report(report, report_path)
+        print(f"Shard {shard_index} of {shards} complete.")
+        return
+    if shard_stage == 'merge':
+        merge_shards(report, shards, shard_dir, cohorts, workers, output_dir)
+        if association:
+            run_stage(report, 'association', run_association,
+                      [(cohort_sample_files(cohorts), read_sample_variants, classifications,
+                        case_cohorts, control_cohorts, association_dir)])
+        finish_report(report, report_path)
+        print("Pipeline complete.")
+        return
+
+    # Collect the cleaning tasks for every sample and the cohorts that need counting
+    clean_tasks = []
+    clean_labels = []
+    vcf_tasks = []
+    vcf_labels = []
+    count_tasks = []
+
+    # Only the genes of the panel are read from VCF samples
+    genes = read_gene_panel(gene_panel) if gene_panel else None
+
+    # Fingerprints from the previous run and the samples that changed since then
+    manifest = load_manifest(manifest_path) if incremental else {}
+    new_manifest = {}
+    updated_samples = defaultdict(list)
+
     # Loop through each cohort folder
     for cohort_folder, cohort_output_folder in zip(cohort_folders, cohort_output_folders):
         # List all files in the current cohort folder
         files = os.listdir(cohort_folder)
         os.makedirs(cohort_output_folder, exist_ok=True)
+        # Duplicate side-files are kept outside the cohort folder so they are not counted
+        duplicates_folder = os.path.join('duplicates', cohort_output_folder)
+        if streaming:
+            os.makedirs(duplicates_folder, exist_ok=True)
 
         # Check if the cohort folder is empty
         if not files:
             print(f"Skipping {cohort_folder}: folder is empty.")
             continue
         
-        # Process each sample (two input files per sample)
+        # Process each sample (two Franklin input files per sample, or one VCF file)
         samples = set()
+        vcf_files = {}
+        # File name of each Franklin export by its name without compression (.gz or .zst)
+        franklin_files = {}
         for file in files:
             if 'single_snp_variants' in file:
                 # Extract sample name
                 sample_name = file.split('_single_snp_variants')[0]
                 samples.add(sample_name)
+                franklin_files[strip_compression(file)] = file
+            elif file.endswith('.vcf') or file.endswith('.vcf.gz'):
+                vcf_files[file[:-len('.vcf')] if file.endswith('.vcf') else file[:-len('.vcf.gz')]] = file
+
+        # Franklin exports take precedence over a VCF file of the same sample
+        for sample in sorted(samples & set(vcf_files)):
+            print(f"Using the Franklin exports of {sample}; ignoring {vcf_files.pop(sample)}.")
+        samples |= set(vcf_files)
         
         # Check if there are any valid samples to process
         if not samples:
@@ -243,30 +1443,239 @@ def run_pipeline():
             continue
         
         # For each sample, clean and merge the input files
-        for sample in samples:
-            file_default = os.path.join(cohort_folder, f"{sample}_single_snp_variants.csv")
-            file_UTR = os.path.join(cohort_folder, f"{sample}_single_snp_variants (1).csv")
-            output_file = os.path.join(cohort_output_folder, f"{sample}.csv")
+        for sample in sorted(samples):
+            if sample in vcf_files:
+                input_files = (os.path.join(cohort_folder, vcf_files[sample]),)
+            else:
+                input_files = tuple(
+                    os.path.join(cohort_folder, franklin_files.get(name, name))
+                    for name in (f"{sample}_single_snp_variants.csv", f"{sample}_single_snp_variants (1).csv"))
+            output_file = with_compression(os.path.join(cohort_output_folder, f"{sample}.csv"), compression)
+            duplicates_file = with_compression(
+                os.path.join(duplicates_folder, f"{sample}_duplicates.csv"), compression) if streaming else None
+            columnar_file = columnar_path_for(output_file) if columnar else None
+
+            # A cleaned file left by a run with another compression would be counted twice
+            for stale_file in (with_compression(strip_compression(output_file), other)
+                               for other in (None, 'gzip', 'zstd')):
+                if stale_file != output_file and os.path.exists(stale_file):
+                    os.remove(stale_file)
 
-            # Clean the files for the current sample
-            clean_franklin(file_default, file_UTR, output_file)
+            # Skip samples whose inputs are unchanged since the last incremental run
+            if incremental:
+                manifest_key = f"{cohort_output_folder}/{sample}"
+                previous = {entry['path']: entry for entry in manifest.get(manifest_key, [])}
+                fingerprints = [file_fingerprint(path, previous.get(path)) for path in input_files]
+                new_manifest[manifest_key] = fingerprints
+                unchanged = all(
+                    fingerprint['path'] in previous
+                    and fingerprint['size'] == previous[fingerprint['path']]['size']
+                    and fingerprint['sha256'] == previous[fingerprint['path']]['sha256']
+                    for fingerprint in fingerprints)
+                if unchanged and os.path.exists(output_file):
+                    continue
+                updated_samples[cohort_output_folder].append(sample)
+
+            if sample in vcf_files:
+                vcf_tasks.append(input_files + (output_file, streaming, duplicates_file, columnar_file, genes))
+                vcf_labels.append((cohort_output_folder, sample))
+            else:
+                clean_tasks.append(input_files + (output_file, streaming, duplicates_file, columnar_file))
+                clean_labels.append((cohort_output_folder, sample))
         
-        # Count variants for the current cohort
-        count_variants(cohort_output_folder)
+        count_tasks.append((cohort_output_folder,))
 
-    # Combine data from different cohorts
-    classifications = [
-        "BENIGN", "LIKELY_BENIGN", "LIKELY_PATHOGENIC", "PATHOGENIC",
-        "POSSIBLY_BENIGN", "POSSIBLY_PATHOGENIC_LOW", "POSSIBLY_PATHOGENIC_MODERATE", "UNCERTAIN_SIGNIFICANCE"
-    ]
-    
-    # Define cohort names for combining data
-    cohorts = ['Cohort_1', 'Cohort_2', 'Cohort_3', 'Cohort_4', 'Cohort_5']
-    
-    # Combine cohorts
-    combine_cohorts(classifications, cohorts)
+    # Clean the files for every sample that needs it
+    run_stage(report, 'clean', clean_franklin, clean_tasks, workers, clean_labels)
+    run_stage(report, 'clean_vcf', clean_vcf, vcf_tasks, workers, vcf_labels)
+
+    if not incremental:
+        if index_db:
+            run_stage(report, 'index', index_cohorts, [(index_db, [task[0] for task in count_tasks])])
+
+        if shards:
+            # Map: split every cleaned sample into the shards, starting from empty shard folders
+            clear_shards(shard_dir)
+            for index in range(shards):
+                for task in count_tasks:
+                    os.makedirs(os.path.join(shard_path(shard_dir, index), task[0]), exist_ok=True)
+            map_tasks = []
+            map_labels = []
+            for cohort, sample_files in cohort_sample_files([task[0] for task in count_tasks]).items():
+                for sample, file_path in sample_files:
+                    map_tasks.append((file_path, cohort, shard_dir, shards))
+                    map_labels.append((cohort, sample))
+            run_stage(report, 'map', shard_sample, map_tasks, workers, map_labels)
+            for index in range(shards):
+                write_shard_marker(shard_path(shard_dir, index), MAP_MARKER,
+                                   {'shards': shards, 'cohorts': [task[0] for task in count_tasks]})
+            if shard_stage == 'map':
+                finish_report(report, report_path)
+                print(f"Samples split into {shards} shards in {shard_dir}. "
+                      f"Run --shard-stage reduce for shard indices 0 to {shards - 1}, then --shard-stage merge.")
+                return
+
+            # Reduce: every shard is counted and combined on its own
+            run_stage(report, 'reduce', reduce_shard,
+                      [(shard_path(shard_dir, index), classifications, cohorts, total_cohorts,
+                        min_sample_count, min_cohort_frequency, shards) for index in range(shards)],
+                      workers, [(None, f"shard_{index}") for index in range(shards)])
+            merge_shards(report, shards, shard_dir, cohorts, workers, output_dir)
+            if association:
+                run_stage(report, 'association', run_association,
+                          [(cohort_sample_files(cohorts), read_sample_variants, classifications,
+                            case_cohorts, control_cohorts, association_dir)])
+            finish_report(report, report_path)
+            print("Pipeline complete.")
+            return
+
+        # Count variants for each cohort and combine cohorts
+        return_tables = in_memory or output_layout != 'legacy'
+        count_results = run_stage(report, 'count', count_variants,
+                                  [task + (output_layout != 'long', return_tables, min_sample_count,
+                                           min_cohort_frequency, top_k, output_dir) for task in count_tasks],
+                                  workers, [(task[0], None) for task in count_tasks])
+        cohort_tables = {task[0]: result for task, result in zip(count_tasks, count_results)} if return_tables else None
+        if output_layout != 'legacy':
+            run_stage(report, 'long_tables', write_long_tables, [(cohort_tables, classifications, output_dir)])
+        run_stage(report, 'combine', combine_cohorts,
+                  [(classifications, cohorts, total_cohorts, cohort_tables if in_memory else None,
+                    SORT_CHUNK_SIZE, output_dir)])
+        if association:
+            run_stage(report, 'association', run_association,
+                      [(cohort_sample_files(cohorts), read_sample_variants, classifications,
+                        case_cohorts, control_cohorts, association_dir)])
+        finish_report(report, report_path)
+        print("Pipeline complete.")
+        return
+
+    # Remove the cleaned files of samples that are no longer in the raw folders
+    removed_samples = defaultdict(list)
+    for manifest_key in manifest:
+        if manifest_key not in new_manifest:
+            cohort_output_folder, sample = manifest_key.rsplit('/', 1)
+            removed_samples[cohort_output_folder].append(sample)
+            output_file = existing_path(os.path.join(cohort_output_folder, f"{sample}.csv"))
+            for path in (output_file, columnar_path_for(output_file)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # Only the changed samples are reloaded into an existing index
+    if index_db:
+        if os.path.exists(index_db):
+            changed_cohorts = sorted(set(updated_samples) | set(removed_samples))
+            run_stage(report, 'index', index_cohorts, [(index_db, changed_cohorts, updated_samples, removed_samples)])
+        else:
+            run_stage(report, 'index', index_cohorts, [(index_db, [task[0] for task in count_tasks])])
+
+    # Cohorts with existing counts are patched; new cohorts are counted from scratch
+    patch_tasks = []
+    recount_tasks = []
+    for cohort_output_folder in sorted(set(updated_samples) | set(removed_samples)):
+        cohort_dir = os.path.join(output_dir, cohort_output_folder)
+        has_counts = all(
+            os.path.exists(os.path.join(cohort_dir, f"{cohort_output_folder}_{classification}_{suffix}.csv"))
+            for classification in classifications for suffix in ('gene_nucleotide', 'gene'))
+        if has_counts and any(key.startswith(f"{cohort_output_folder}/") for key in manifest):
+            patch_tasks.append((cohort_output_folder, classifications,
+                                updated_samples[cohort_output_folder], removed_samples[cohort_output_folder],
+                                output_dir))
+        else:
+            recount_tasks.append((cohort_output_folder, True, False, min_sample_count, min_cohort_frequency,
+                                  top_k, output_dir))
+
+    if not patch_tasks and not recount_tasks:
+        print("No sample changes found; counts are up to date.")
+    else:
+        run_stage(report, 'count', count_variants, recount_tasks, workers,
+                  [(task[0], None) for task in recount_tasks])
+        deltas = run_stage(report, 'patch', update_cohort_counts, patch_tasks, workers,
+                           [(task[0], None) for task in patch_tasks])
+        cohort_deltas = {task[0]: delta for task, delta in zip(patch_tasks, deltas)}
+
+        # New cohorts have no deltas, so the combined files are rebuilt in that case
+        patched = not recount_tasks and run_stage(
+            report, 'patch_combined', apply_combined_deltas,
+            [(classifications, cohorts, cohort_deltas, total_cohorts, output_dir)])[0]
+        if not patched:
+            run_stage(report, 'combine', combine_cohorts,
+                      [(classifications, cohorts, total_cohorts, None, SORT_CHUNK_SIZE, output_dir)])
+
+    if association:
+        run_stage(report, 'association', run_association,
+                  [(cohort_sample_files(cohorts), read_sample_variants, classifications,
+                    case_cohorts, control_cohorts, association_dir)])
+
+    save_manifest(new_manifest, manifest_path)
+    finish_report(report, report_path)
     print("Pipeline complete.")
 
 # Run the pipeline
 if __name__ == "__main__":
-    run_pipeline()  
+    parser = argparse.ArgumentParser(description="Cohort Comparison pipeline for Franklin exports.")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Stream samples through clean_franklin and write duplicates to side-files.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes for cleaning samples and counting cohorts (default: 1).")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only reprocess samples whose inputs changed since the last run.")
+    parser.add_argument('--manifest', default='pipeline_manifest.json',
+                        help="Manifest of input fingerprints used by --incremental (default: pipeline_manifest.json).")
+    parser.add_argument('--index-db',
+                        help="Keep a SQLite variant index of the cleaned samples at this path.")
+    parser.add_argument('--columnar', action='store_true',
+                        help="Also write each cleaned sample in the binary columnar form (.vcol).")
+    parser.add_argument('--report',
+                        help="Write a JSON report of the time, rows and memory of each stage, cohort and sample.")
+    parser.add_argument('--gene-panel',
+                        help="File with one gene per line; VCF samples are restricted to these genes.")
+    parser.add_argument('--association', action='store_true',
+                        help="Test every variant for a carrier frequency difference between cohorts.")
+    parser.add_argument('--case-cohorts', nargs='+',
+                        help="Case cohorts of the association tests (default: each cohort against the rest).")
+    parser.add_argument('--control-cohorts', nargs='+',
+                        help="Control cohorts of the association tests (default: all other cohorts).")
+    parser.add_argument('--profile',
+                        help="Dump cProfile data of every task, and a summary per stage, to this directory.")
+    parser.add_argument('--in-memory', action='store_true',
+                        help="Hand the cohort counts to the combining stage without reading the files back.")
+    parser.add_argument('--compress', choices=['gzip', 'zstd'],
+                        help="Write the cleaned samples compressed (.csv.gz or .csv.zst; zstd needs 'zstandard').")
+    parser.add_argument('--min-sample-count', type=int, default=1,
+                        help="Only keep variants found in at least this many samples of a cohort.")
+    parser.add_argument('--min-cohort-frequency', type=float, default=0.0,
+                        help="Only keep variants found in at least this fraction of a cohort's samples.")
+    parser.add_argument('--top-k', type=int,
+                        help="Only keep the K variants with the most samples per cohort and classification.")
+    parser.add_argument('--output-layout', choices=['legacy', 'long', 'both'], default='legacy',
+                        help="Per-cohort count files (legacy), two long-format tables (long) or both (default: legacy).")
+    parser.add_argument('--shards', type=int,
+                        help="Split the samples into this many gene-hash shards that are counted and combined separately.")
+    parser.add_argument('--shard-dir', default='shards',
+                        help="Folder for the shard files and the outputs of the reducers (default: shards).")
+    parser.add_argument('--shard-stage', choices=['map', 'reduce', 'merge'],
+                        help="Only run one step of the sharded mode, e.g. one reducer per PBS job.")
+    parser.add_argument('--shard-index', type=int,
+                        help="Shard counted by --shard-stage reduce (0 to --shards - 1).")
+    parser.add_argument('--output-dir', default='variant_classifications',
+                        help="Folder for the per-cohort and combined counts (default: variant_classifications).")
+    args = parser.parse_args()
+    try:
+        check_pruning_options(args.min_sample_count, args.min_cohort_frequency, args.top_k)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.shards is not None and args.shards < 1:
+        parser.error("--shards must be at least 1.")
+    if args.shard_stage is not None and args.shards is None:
+        parser.error("--shard-stage needs --shards.")
+    if args.shard_stage == 'reduce' and not (args.shard_index is not None and 0 <= args.shard_index < args.shards):
+        parser.error(f"--shard-stage reduce needs a --shard-index from 0 to {args.shards - 1}.")
+
+    run_pipeline(streaming=args.streaming, workers=args.workers, incremental=args.incremental,
+                 manifest_path=args.manifest, index_db=args.index_db, columnar=args.columnar,
+                 report_path=args.report, profile_dir=args.profile, gene_panel=args.gene_panel,
+                 association=args.association, case_cohorts=args.case_cohorts, control_cohorts=args.control_cohorts,
+                 in_memory=args.in_memory, output_layout=args.output_layout, compression=args.compress,
+                 min_sample_count=args.min_sample_count, min_cohort_frequency=args.min_cohort_frequency,
+                 top_k=args.top_k, shards=args.shards, shard_dir=args.shard_dir, shard_stage=args.shard_stage,
+                 shard_index=args.shard_index, output_dir=args.output_dir)
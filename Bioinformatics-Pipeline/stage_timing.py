@@ -0,0 +1,390 @@
+"""
+Stage timings of variant_calling.pbs across samples.
+
+variant_calling.pbs writes a timestamped 'Starting <stage>' and 'Finished <stage>' line to
+<sample>/variant_calling.log around every step (FastQC, BWA, BAM sorting, HaplotypeCaller,
+SNP and INDEL filtration, ...). This script finds the logs of every sample directory
+under the given folders and reports, for each stage:
+- the distribution of its duration across samples (median, mean, 90th percentile, maximum)
+- its share of the sample's run and the number of samples in which it is the longest stage.
+  The stages of the job run one after another, so the longest stage is the one that
+  bounds the critical path of the run
+- its throughput normalised by the size of the sample's input FASTQ files (GB per hour)
+- samples whose duration (per GB of FASTQ where the sizes are known) is an outlier by the
+  modified z-score of the median absolute deviation (MAD)
+
+The time between one stage finishing and the next starting (module loads, file copies)
+is reported as '(between stages)', and the total run time of each sample is compared
+with the walltime of the job. Stages are named as they are logged, so a step that is not
+in the script (e.g. MarkDuplicates) is only reported once it is logged.
+
+Usage: python stage_timing.py <folder of sample directories> --fastq-root <folder of raw FASTQ directories>
+"""
+
+import argparse
+import csv
+import os
+import re
+import statistics
+from datetime import datetime
+
+# Name of the log file written by variant_calling.pbs in each sample directory
+LOG_NAME = 'variant_calling.log'
+
+# e.g. '2024-08-12 09:14:03 - Starting HaplotypeCaller'
+LOG_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - (Starting|Finished) (.+?)\s*$')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+FASTQ_EXTENSIONS = ('.fq.gz', '.fastq.gz', '.fq', '.fastq')
+
+# Name given to the time between stages
+BETWEEN_STAGES = '(between stages)'
+
+# Scale of the MAD to a standard deviation for normal data, and the modified z-score
+# above which a sample is flagged (Iglewicz and Hoaglin)
+MAD_SCALE = 1.4826
+OUTLIER_THRESHOLD = 3.5
+
+# Samples less than this many seconds from the median of a stage are not flagged, as
+# short stages vary by seconds with module loads and file system load
+MIN_OUTLIER_SECONDS = 60
+
+GB = 1024 ** 3
+
+
+def parse_log(log_path):
+    """
+    Reads the stage start and finish times of one sample's log. When a job was restarted
+    and a stage was started again, the last start before its finish is used.
+
+    Parameters:
+    - log_path (str): Path to a variant_calling.log file.
+
+    Returns:
+    - dict: 'stages' (list of (stage, start, end) in the order they finished), 'unfinished'
+      (stages started but never finished, e.g. when the job ran out of walltime), 'start'
+      and 'end' (first and last time in the log, or None for an empty log).
+    """
+    started = {}
+    stages = []
+    times = []
+    with open(log_path, 'r') as log_file:
+        for line in log_file:
+            match = LOG_LINE.match(line)
+            if not match:
+                continue
+            time = datetime.strptime(match.group(1), TIME_FORMAT)
+            event, stage = match.group(2), match.group(3)
+            times.append(time)
+            if event == 'Starting':
+                started[stage] = time
+            elif stage in started:
+                stages.append((stage, started.pop(stage), time))
+            else:
+                print(f"Warning: {log_path} finishes {stage} without starting it. Skipping...")
+    return {'stages': stages, 'unfinished': list(started), 'start': min(times, default=None),
+            'end': max(times, default=None)}
+
+
+def find_logs(roots):
+    """
+    Finds the variant_calling.log of every sample directory under the given folders.
+
+    Parameters:
+    - roots (list): Folders to search (a sample directory itself may also be given).
+
+    Returns:
+    - list: (sample name, sample directory) pairs sorted by sample name. The sample name is
+      the name of the directory holding the log.
+    """
+    samples = {}
+    for root in roots:
+        for directory, _, files in os.walk(root):
+            if LOG_NAME in files:
+                sample = os.path.basename(os.path.normpath(directory))
+                if sample in samples:
+                    print(f"Warning: {sample} has logs in {samples[sample]} and {directory}; using {directory}.")
+                samples[sample] = directory
+    return sorted(samples.items())
+
+
+def fastq_size(directory):
+    """
+    Returns the total size of the FASTQ files in a directory (not its subdirectories).
+
+    Parameters:
+    - directory (str): Directory holding the sample's FASTQ files.
+
+    Returns:
+    - int or None: Size in bytes, or None if there are no FASTQ files.
+    """
+    if not os.path.isdir(directory):
+        return None
+    sizes = [entry.stat().st_size for entry in os.scandir(directory)
+             if entry.is_file() and entry.name.endswith(FASTQ_EXTENSIONS)]
+    return sum(sizes) if sizes else None
+
+
+def percentile(values, fraction):
+    """
+    Returns a percentile of a list of values, interpolating between the closest ranks.
+
+    Parameters:
+    - values (list): Values (at least one).
+    - fraction (float): Percentile as a fraction, e.g. 0.9.
+
+    Returns:
+    - float: The percentile.
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def modified_z_scores(values):
+    """
+    Returns the modified z-score of each value: its distance from the median in units of
+    the scaled median absolute deviation, which, unlike the standard deviation, is not
+    inflated by the outliers themselves.
+
+    Parameters:
+    - values (list): Values of one stage across samples.
+
+    Returns:
+    - list: The score of each value, or all zeros when the MAD is zero.
+    """
+    median = statistics.median(values)
+    mad = statistics.median(abs(value - median) for value in values)
+    if mad == 0:
+        return [0.0] * len(values)
+    return [(value - median) / (MAD_SCALE * mad) for value in values]
+
+
+def sample_timings(roots, fastq_root=None):
+    """
+    Reads the logs and FASTQ sizes of every sample.
+
+    Parameters:
+    - roots (list): Folders holding the sample directories.
+    - fastq_root (str, optional): Folder with one directory of raw FASTQ files per sample
+      (e.g. DP_batch3/<sample>). By default the FASTQ files in the sample directory (the
+      combined FASTQ files written by variant_calling.pbs) are used.
+
+    Returns:
+    - list: One dict per sample with 'sample', 'fastq_bytes', 'durations' (stage to
+      seconds, including BETWEEN_STAGES), 'stages' (from parse_log), 'total_seconds' and
+      'unfinished'.
+    """
+    timings = []
+    for sample, directory in find_logs(roots):
+        log = parse_log(os.path.join(directory, LOG_NAME))
+        if log['start'] is None:
+            print(f"Warning: {sample} has an empty log. Skipping...")
+            continue
+
+        # A stage that was run twice (e.g. after a restart) is counted once, with its last run
+        durations = {}
+        for stage, start, end in log['stages']:
+            durations[stage] = (end - start).total_seconds()
+        total_seconds = (log['end'] - log['start']).total_seconds()
+        durations[BETWEEN_STAGES] = max(total_seconds - sum(durations.values()), 0.0)
+
+        fastq_dir = os.path.join(fastq_root, sample) if fastq_root else directory
+        timings.append({'sample': sample, 'fastq_bytes': fastq_size(fastq_dir), 'durations': durations,
+                        'stages': log['stages'], 'total_seconds': total_seconds,
+                        'unfinished': log['unfinished']})
+    return timings
+
+
+def summarise_stages(timings, threshold=OUTLIER_THRESHOLD):
+    """
+    Summarises the duration of every stage across samples.
+
+    Parameters:
+    - timings (list): Output of sample_timings.
+    - threshold (float): Modified z-score above which a sample is flagged as an outlier.
+
+    Returns:
+    - list: One dict per stage, in the order the stages run, with the number of samples,
+      the median, mean, 90th percentile and maximum hours, the median share of the run,
+      the number of samples in which it is the longest stage, the median GB per hour and
+      the outlier samples (with their modified z-score).
+    """
+    # Stages in the order they first finish in any log, with the gaps between them last
+    stage_order = []
+    for timing in timings:
+        for stage, _, _ in timing['stages']:
+            if stage not in stage_order:
+                stage_order.append(stage)
+    stage_order.append(BETWEEN_STAGES)
+
+    # The longest stage of each sample bounds its run
+    longest = [max((stage for stage in timing['durations'] if stage != BETWEEN_STAGES),
+                   key=timing['durations'].get, default=None) for timing in timings]
+
+    summaries = []
+    for stage in stage_order:
+        samples = [timing for timing in timings if stage in timing['durations']]
+        seconds = [timing['durations'][stage] for timing in samples]
+        sized = [timing for timing in samples if timing['fastq_bytes']]
+        gb_per_hour = [timing['fastq_bytes'] / GB / (timing['durations'][stage] / 3600)
+                       for timing in sized if timing['durations'][stage] > 0 and stage != BETWEEN_STAGES]
+
+        # Durations are compared per GB of FASTQ when every sample's size is known, so
+        # that larger inputs are not flagged for taking longer
+        if sized and len(sized) == len(samples):
+            metric = [timing['durations'][stage] / (timing['fastq_bytes'] / GB) for timing in samples]
+        else:
+            metric = seconds
+        scores = modified_z_scores(metric)
+        median_seconds = statistics.median(seconds)
+        outliers = [(timing['sample'], score) for timing, score, duration in zip(samples, scores, seconds)
+                    if abs(score) > threshold and abs(duration - median_seconds) >= MIN_OUTLIER_SECONDS]
+
+        summaries.append({
+            'stage': stage,
+            'samples': len(samples),
+            'median_hours': median_seconds / 3600,
+            'mean_hours': statistics.mean(seconds) / 3600,
+            'p90_hours': percentile(seconds, 0.9) / 3600,
+            'max_hours': max(seconds) / 3600,
+            'median_share': statistics.median(
+                timing['durations'][stage] / timing['total_seconds'] if timing['total_seconds'] else 0.0
+                for timing in samples),
+            'longest_in': sum(1 for name in longest if name == stage),
+            'median_gb_per_hour': statistics.median(gb_per_hour) if gb_per_hour else None,
+            'outliers': outliers,
+        })
+    return summaries
+
+
+def write_durations(timings, output_file):
+    """
+    Writes one row per sample and stage with its start, end and duration.
+
+    Parameters:
+    - timings (list): Output of sample_timings.
+    - output_file (str): Path to the output CSV file.
+    """
+    with open(output_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Sample', 'Stage', 'Start', 'End', 'Hours', 'FASTQ_GB', 'Hours_per_GB'])
+        for timing in timings:
+            fastq_gb = timing['fastq_bytes'] / GB if timing['fastq_bytes'] else None
+            for stage, start, end in timing['stages']:
+                hours = (end - start).total_seconds() / 3600
+                writer.writerow([timing['sample'], stage, start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT),
+                                 round(hours, 4), round(fastq_gb, 3) if fastq_gb else '',
+                                 round(hours / fastq_gb, 4) if fastq_gb else ''])
+            for stage in timing['unfinished']:
+                writer.writerow([timing['sample'], stage, '', '', '', round(fastq_gb, 3) if fastq_gb else '', ''])
+
+
+def write_summary(summaries, output_file):
+    """
+    Writes the per-stage summary to a CSV file.
+
+    Parameters:
+    - summaries (list): Output of summarise_stages.
+    - output_file (str): Path to the output CSV file.
+    """
+    with open(output_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Stage', 'Samples', 'Median_Hours', 'Mean_Hours', 'P90_Hours', 'Max_Hours',
+                         'Median_Share', 'Longest_In', 'Median_GB_per_Hour', 'Outliers'])
+        for summary in summaries:
+            writer.writerow([summary['stage'], summary['samples'], round(summary['median_hours'], 4),
+                             round(summary['mean_hours'], 4), round(summary['p90_hours'], 4),
+                             round(summary['max_hours'], 4), round(summary['median_share'], 4),
+                             summary['longest_in'],
+                             '' if summary['median_gb_per_hour'] is None else round(summary['median_gb_per_hour'], 3),
+                             '; '.join(f"{sample} ({score:+.1f})" for sample, score in summary['outliers'])])
+
+
+def stage_timing(roots, fastq_root=None, walltime_hours=60.0, threshold=OUTLIER_THRESHOLD,
+                 durations_file='stage_durations.csv', summary_file='stage_summary.csv'):
+    """
+    Analyses the stage timings of every sample, prints a summary and writes the
+    per-sample durations and the per-stage summary to CSV files.
+
+    Parameters:
+    - roots (list): Folders holding the sample directories.
+    - fastq_root (str, optional): Folder with one directory of raw FASTQ files per sample.
+    - walltime_hours (float): Walltime of the job, to compare the total run times with.
+    - threshold (float): Modified z-score above which a sample is flagged as an outlier.
+    - durations_file (str): Output CSV file with one row per sample and stage.
+    - summary_file (str): Output CSV file with one row per stage.
+
+    Returns:
+    - list: Output of summarise_stages.
+    """
+    timings = sample_timings(roots, fastq_root)
+    if not timings:
+        print(f"No {LOG_NAME} files found.")
+        return []
+    summaries = summarise_stages(timings, threshold)
+
+    print(f"{len(timings)} samples.")
+    print(f"{'Stage':<34}{'Median h':>10}{'P90 h':>9}{'Max h':>9}{'Share':>8}{'Longest':>9}{'GB/h':>8}")
+    for summary in summaries:
+        gb_per_hour = summary['median_gb_per_hour']
+        print(f"{summary['stage']:<34}{summary['median_hours']:>10.2f}{summary['p90_hours']:>9.2f}"
+              f"{summary['max_hours']:>9.2f}{summary['median_share']:>8.1%}{summary['longest_in']:>9}"
+              f"{'' if gb_per_hour is None else f'{gb_per_hour:.2f}':>8}")
+
+    # The stage that is longest in most samples bounds the run
+    critical = max((summary for summary in summaries if summary['stage'] != BETWEEN_STAGES),
+                   key=lambda summary: (summary['longest_in'], summary['median_hours']), default=None)
+    if critical:
+        print(f"Critical-path stage: {critical['stage']} (longest in {critical['longest_in']} of {len(timings)} "
+              f"samples, median {critical['median_share']:.1%} of the run).")
+
+    for summary in summaries:
+        for sample, score in summary['outliers']:
+            direction = 'slower' if score > 0 else 'faster'
+            print(f"Outlier: {sample} {summary['stage']} is {direction} than the other samples "
+                  f"(modified z-score {score:+.1f}).")
+
+    # Run times against the walltime of the job
+    totals = [timing['total_seconds'] / 3600 for timing in timings]
+    print(f"Total run time: median {statistics.median(totals):.2f} h, 90th percentile {percentile(totals, 0.9):.2f} h, "
+          f"maximum {max(totals):.2f} h of the {walltime_hours:g} h walltime.")
+    sized = [timing for timing in timings if timing['fastq_bytes'] and not timing['unfinished']]
+    if sized:
+        hours_per_gb = [timing['total_seconds'] / 3600 / (timing['fastq_bytes'] / GB) for timing in sized]
+        largest_gb = max(timing['fastq_bytes'] for timing in sized) / GB
+        print(f"Hours per GB of FASTQ: median {statistics.median(hours_per_gb):.3f}, "
+              f"maximum {max(hours_per_gb):.3f}; the walltime fits {walltime_hours / max(hours_per_gb):.1f} GB "
+              f"at the slowest rate (largest input: {largest_gb:.1f} GB).")
+    for timing in timings:
+        if timing['unfinished']:
+            print(f"Unfinished: {timing['sample']} stopped during {', '.join(timing['unfinished'])} "
+                  f"after {timing['total_seconds'] / 3600:.2f} h.")
+
+    write_durations(timings, durations_file)
+    write_summary(summaries, summary_file)
+    print(f"Timings written to {durations_file} and {summary_file}.")
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise the stage timings of variant_calling.pbs across samples.")
+    parser.add_argument('roots', nargs='*', default=['.'],
+                        help=f"Folders holding the sample directories with a {LOG_NAME} (default: .).")
+    parser.add_argument('--fastq-root',
+                        help="Folder with one directory of raw FASTQ files per sample "
+                             "(default: the FASTQ files in each sample directory).")
+    parser.add_argument('--walltime', type=float, default=60.0,
+                        help="Walltime of the job in hours (default: 60, as in variant_calling.pbs).")
+    parser.add_argument('--threshold', type=float, default=OUTLIER_THRESHOLD,
+                        help=f"Modified z-score above which a sample is an outlier (default: {OUTLIER_THRESHOLD}).")
+    parser.add_argument('--durations-file', default='stage_durations.csv',
+                        help="Output CSV file with one row per sample and stage (default: stage_durations.csv).")
+    parser.add_argument('--summary-file', default='stage_summary.csv',
+                        help="Output CSV file with one row per stage (default: stage_summary.csv).")
+    args = parser.parse_args()
+
+    stage_timing(args.roots, fastq_root=args.fastq_root, walltime_hours=args.walltime, threshold=args.threshold,
+                 durations_file=args.durations_file, summary_file=args.summary_file)
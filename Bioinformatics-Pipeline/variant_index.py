@@ -0,0 +1,347 @@
+"""
+This script maintains a local SQLite index of the cleaned Franklin samples produced by
+processing.py, so that sample x variant x classification questions can be answered
+without re-reading every cleaned CSV file.
+
+The script consists of four main functions:
+1. build_index: Bulk loads the cleaned rows of one or more cohorts into the index.
+2. query_variants: Looks up indexed rows by variant, gene, sample, cohort and classification.
+3. export_cohort_counts: Reproduces the per-cohort *_gene_nucleotide.csv and *_gene.csv
+   files of count_variants with aggregate queries.
+4. export_combined_counts: Reproduces the combined_cohorts_*_gene_nucleotide.csv files
+   of combine_cohorts with aggregate queries.
+
+Usage:
+    python variant_index.py --db variants.sqlite build Cohort_1 Cohort_2
+    python variant_index.py --db variants.sqlite query --gene BRCA2 --classification LIKELY_PATHOGENIC
+    python variant_index.py --db variants.sqlite export --cohorts Cohort_1 Cohort_2
+"""
+
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+
+from compressed_io import list_files, open_text, strip_compression
+from hgvs_normalise import normalise_gene, normalise_nucleotide, variant_key
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    sample_id INTEGER PRIMARY KEY,
+    cohort TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    sample_file TEXT NOT NULL,
+    UNIQUE (cohort, sample)
+);
+CREATE TABLE IF NOT EXISTS variants (
+    sample_id INTEGER NOT NULL REFERENCES samples (sample_id),
+    position INTEGER NOT NULL,
+    gene TEXT NOT NULL,
+    nucleotide TEXT NOT NULL,
+    classification TEXT NOT NULL,
+    zygosity TEXT,
+    inheritance_model TEXT
+);
+DROP INDEX IF EXISTS variants_gene_nucleotide;
+CREATE INDEX IF NOT EXISTS variants_gene_nocase_nucleotide ON variants (gene COLLATE NOCASE, nucleotide);
+CREATE INDEX IF NOT EXISTS variants_classification ON variants (classification);
+CREATE INDEX IF NOT EXISTS variants_sample ON variants (sample_id);
+"""
+
+
+def connect(db_path):
+    """
+    Opens the variant index, creating the tables and indexes if they do not exist yet.
+
+    Parameters:
+    - db_path (str): Path to the SQLite database file.
+
+    Returns:
+    - sqlite3.Connection: Open connection to the index.
+    """
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def build_index(db_path, cohort_folders, samples=None, removed_samples=None):
+    """
+    Loads the cleaned sample CSV files of each cohort into the index with bulk inserts.
+    By default every sample of a cohort is replaced. When samples or removed_samples are
+    given, only those samples are replaced or deleted.
+
+    Parameters:
+    - db_path (str): Path to the SQLite database file.
+    - cohort_folders (list): Cohort directories of cleaned sample CSV files (e.g. 'Cohort_1').
+    - samples (dict, optional): Sample names to (re)load, keyed by cohort folder.
+    - removed_samples (dict, optional): Sample names to delete, keyed by cohort folder.
+
+    Returns:
+    - int: Number of variant rows inserted.
+    """
+    connection = connect(db_path)
+    inserted = 0
+    try:
+        with connection:
+            for cohort_folder in cohort_folders:
+                cohort = os.path.basename(os.path.normpath(cohort_folder))
+                sample_files = list_files(cohort_folder, '.csv')
+
+                # Work out which samples to delete and which to load
+                if samples is None and removed_samples is None:
+                    to_delete = None
+                    to_load = sample_files
+                else:
+                    wanted = set((samples or {}).get(cohort_folder, ()))
+                    to_delete = wanted | set((removed_samples or {}).get(cohort_folder, ()))
+                    to_load = [(sample, filename) for sample, filename in sample_files if sample in wanted]
+
+                delete_samples(connection, cohort, to_delete)
+
+                for sample, filename in to_load:
+                    # The file name without compression keeps the sample order of count_variants
+                    cursor = connection.execute(
+                        "INSERT INTO samples (cohort, sample, sample_file) VALUES (?, ?, ?)",
+                        (cohort, sample, strip_compression(filename)))
+                    sample_id = cursor.lastrowid
+                    with open_text(os.path.join(cohort_folder, filename), mode='r', newline='') as file:
+                        reader = csv.DictReader(file)
+                        # Keys are normalised as count_variants reads them, so exports match its outputs
+                        rows = (
+                            (sample_id, position, *variant_key(row['Gene'], row['Nucleotide']),
+                             row['Genoox_Classification'], row.get('Zygosity'), row.get('Inheritance_Model'))
+                            for position, row in enumerate(reader)
+                        )
+                        cursor = connection.executemany(
+                            "INSERT INTO variants (sample_id, position, gene, nucleotide, classification, "
+                            "zygosity, inheritance_model) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                        inserted += cursor.rowcount
+    finally:
+        connection.close()
+
+    print(f"Indexed {inserted} variant rows into {db_path}.")
+    return inserted
+
+
+def delete_samples(connection, cohort, sample_names=None):
+    """
+    Deletes indexed samples of a cohort, together with their variant rows.
+
+    Parameters:
+    - connection (sqlite3.Connection): Open connection to the index.
+    - cohort (str): Cohort name.
+    - sample_names (set, optional): Samples to delete. Defaults to every sample of the cohort.
+
+    Returns:
+    - None: Removes the rows from the index.
+    """
+    if sample_names is None:
+        sample_ids = connection.execute("SELECT sample_id FROM samples WHERE cohort = ?", (cohort,)).fetchall()
+    else:
+        sample_ids = [
+            row for sample in sample_names
+            for row in connection.execute(
+                "SELECT sample_id FROM samples WHERE cohort = ? AND sample = ?", (cohort, sample))
+        ]
+    connection.executemany("DELETE FROM variants WHERE sample_id = ?", sample_ids)
+    connection.executemany("DELETE FROM samples WHERE sample_id = ?", sample_ids)
+
+
+def query_variants(db_path, gene=None, nucleotide=None, sample=None, cohort=None, classification=None):
+    """
+    Looks up indexed variant rows. Every filter that is given must match. The gene and
+    nucleotide are normalised like the indexed keys, and genes match regardless of case,
+    so e.g. 'brca2' and 'NM_000059.4:c.68a>g' find the rows of BRCA2 c.68A>G.
+
+    Parameters:
+    - db_path (str): Path to the SQLite database file.
+    - gene (str, optional): Gene name.
+    - nucleotide (str, optional): Nucleotide (HGVS c.) change, with or without its transcript.
+    - sample (str, optional): Sample name.
+    - cohort (str, optional): Cohort name.
+    - classification (str, optional): Genoox classification.
+
+    Returns:
+    - list: One dict per matching row, with the cleaned columns plus 'Sample' and 'Cohort'.
+    """
+    if gene is not None:
+        gene = normalise_gene(gene)
+    if nucleotide is not None:
+        nucleotide = normalise_nucleotide(nucleotide)
+    filters = {
+        'v.gene': gene,
+        'v.nucleotide': nucleotide,
+        's.sample': sample,
+        's.cohort': cohort,
+        'v.classification': classification,
+    }
+    conditions = [f"{column} = ? COLLATE NOCASE" if column == 'v.gene' else f"{column} = ?"
+                  for column, value in filters.items() if value is not None]
+    parameters = [value for value in filters.values() if value is not None]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    connection = connect(db_path)
+    try:
+        rows = connection.execute(
+            "SELECT v.gene, v.nucleotide, v.classification, v.zygosity, v.inheritance_model, s.sample, s.cohort "
+            f"FROM variants v JOIN samples s ON s.sample_id = v.sample_id {where} "
+            "ORDER BY s.cohort, s.sample_file, v.position", parameters).fetchall()
+    finally:
+        connection.close()
+
+    fieldnames = ['Gene', 'Nucleotide', 'Genoox_Classification', 'Zygosity', 'Inheritance_Model', 'Sample', 'Cohort']
+    return [dict(zip(fieldnames, row)) for row in rows]
+
+
+# Count, sample list and first occurrence of every key, in the order count_variants writes them.
+# Rows are ordered by sample file and position within it, which is the order count_variants reads them.
+GROUPED_COUNTS = """
+SELECT key, sample_count, samples FROM (
+    SELECT key, sample_file, position,
+           COUNT(*) OVER whole AS sample_count,
+           GROUP_CONCAT(sample, ', ') OVER whole AS samples,
+           ROW_NUMBER() OVER first AS occurrence
+    FROM ({rows})
+    WINDOW whole AS (PARTITION BY key ORDER BY sample_file, position
+                     ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING),
+           first AS (PARTITION BY key ORDER BY sample_file, position)
+)
+WHERE occurrence = 1
+ORDER BY sample_count DESC, sample_file, position
+"""
+
+VARIANT_ROWS = """
+SELECT v.gene || '_' || v.nucleotide AS key, s.sample, s.sample_file, v.position
+FROM variants v JOIN samples s ON s.sample_id = v.sample_id
+WHERE s.cohort = ? AND v.classification = ?
+"""
+
+# One row per gene and sample, at the first position the gene occurs in that sample
+GENE_ROWS = """
+SELECT v.gene AS key, s.sample, s.sample_file, MIN(v.position) AS position
+FROM variants v JOIN samples s ON s.sample_id = v.sample_id
+WHERE s.cohort = ? AND v.classification = ?
+GROUP BY v.gene, s.sample_id
+"""
+
+
+def export_cohort_counts(db_path, cohort, classifications, output_dir='variant_classifications'):
+    """
+    Writes the per-cohort *_gene_nucleotide.csv and *_gene.csv files of count_variants
+    from the index, using aggregate queries instead of re-reading the cleaned files.
+
+    Parameters:
+    - db_path (str): Path to the SQLite database file.
+    - cohort (str): Cohort name.
+    - classifications (list): Variant classifications to write.
+    - output_dir (str): Directory that receives the '<cohort>' output folder.
+
+    Returns:
+    - None: Writes the per-cohort count files.
+    """
+    cohort_dir = os.path.join(output_dir, cohort)
+    os.makedirs(cohort_dir, exist_ok=True)
+
+    connection = connect(db_path)
+    try:
+        for classification in classifications:
+            for rows_query, key_field, suffix in ((VARIANT_ROWS, 'Gene_Nucleotide', 'gene_nucleotide'),
+                                                  (GENE_ROWS, 'Gene', 'gene')):
+                rows = connection.execute(GROUPED_COUNTS.format(rows=rows_query), (cohort, classification))
+                with open(os.path.join(cohort_dir, f'{cohort}_{classification}_{suffix}.csv'), mode='w', newline='') as file:
+                    writer = csv.writer(file)
+                    writer.writerow([key_field, 'Sample_Count', 'Samples'])
+                    writer.writerows(rows)
+    finally:
+        connection.close()
+
+    print(f"Variant counts for {cohort} exported from {db_path}.")
+
+
+def export_combined_counts(db_path, classifications, cohorts, total_cohorts=None, output_dir='variant_classifications'):
+    """
+    Writes the combined_cohorts_*_gene_nucleotide.csv files of combine_cohorts from the
+    index, using aggregate queries instead of re-reading the per-cohort files.
+
+    Parameters:
+    - db_path (str): Path to the SQLite database file.
+    - classifications (list): Variant classifications to write.
+    - cohorts (list): Cohort names, in column order.
+    - total_cohorts (list, optional): Cohorts summed into the Total column. Defaults to all cohorts.
+    - output_dir (str): Directory that receives the 'all_cohorts' output folder.
+
+    Returns:
+    - None: Writes the combined count files.
+    """
+    if total_cohorts is None:
+        total_cohorts = cohorts
+    total_indices = [index for index, cohort in enumerate(cohorts) if cohort in total_cohorts]
+
+    combined_dir = os.path.join(output_dir, 'all_cohorts')
+    os.makedirs(combined_dir, exist_ok=True)
+
+    cohort_columns = ', '.join('SUM(s.cohort = ?)' for _ in cohorts)
+    placeholders = ', '.join('?' for _ in cohorts)
+    query = (
+        f"SELECT v.gene || '_' || v.nucleotide AS key, {cohort_columns} "
+        "FROM variants v JOIN samples s ON s.sample_id = v.sample_id "
+        f"WHERE v.classification = ? AND s.cohort IN ({placeholders}) "
+        "GROUP BY key ORDER BY key"
+    )
+
+    connection = connect(db_path)
+    try:
+        for classification in classifications:
+            rows = connection.execute(query, list(cohorts) + [classification] + list(cohorts))
+            output_file = os.path.join(combined_dir, f"combined_cohorts_{classification}_gene_nucleotide.csv")
+            with open(output_file, mode='w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['Gene_Nucleotide'] + cohorts + ['Total'])
+                for gene_nucleotide, *counts in rows:
+                    writer.writerow([gene_nucleotide] + counts + [sum(counts[index] for index in total_indices)])
+    finally:
+        connection.close()
+
+    print(f"Combined counts exported from {db_path}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite index of cleaned Franklin samples.")
+    parser.add_argument('--db', default='variants.sqlite', help="Path to the index (default: variants.sqlite).")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Load cleaned cohort folders into the index.")
+    build_parser.add_argument('cohort_folders', nargs='+', help="Cohort folders of cleaned sample CSV files.")
+
+    query_parser = subparsers.add_parser('query', help="Print indexed rows matching the given filters as CSV.")
+    query_parser.add_argument('--gene')
+    query_parser.add_argument('--nucleotide')
+    query_parser.add_argument('--sample')
+    query_parser.add_argument('--cohort')
+    query_parser.add_argument('--classification')
+
+    export_parser = subparsers.add_parser('export', help="Rebuild the variant_classifications outputs from the index.")
+    export_parser.add_argument('--cohorts', nargs='+', required=True, help="Cohort names, in column order.")
+    export_parser.add_argument('--total-cohorts', nargs='+', help="Cohorts summed into Total (default: all).")
+    export_parser.add_argument('--output-dir', default='variant_classifications')
+
+    args = parser.parse_args()
+    classifications = [
+        "BENIGN", "LIKELY_BENIGN", "LIKELY_PATHOGENIC", "PATHOGENIC",
+        "POSSIBLY_BENIGN", "POSSIBLY_PATHOGENIC_LOW", "POSSIBLY_PATHOGENIC_MODERATE", "UNCERTAIN_SIGNIFICANCE"
+    ]
+
+    if args.command == 'build':
+        build_index(args.db, args.cohort_folders)
+    elif args.command == 'query':
+        results = query_variants(args.db, gene=args.gene, nucleotide=args.nucleotide, sample=args.sample,
+                                 cohort=args.cohort, classification=args.classification)
+        writer = csv.DictWriter(sys.stdout, fieldnames=['Gene', 'Nucleotide', 'Genoox_Classification', 'Zygosity',
+                                                        'Inheritance_Model', 'Sample', 'Cohort'])
+        writer.writeheader()
+        writer.writerows(results)
+    elif args.command == 'export':
+        for cohort in args.cohorts:
+            export_cohort_counts(args.db, cohort, classifications, args.output_dir)
+        export_combined_counts(args.db, classifications, args.cohorts, args.total_cohorts, args.output_dir)
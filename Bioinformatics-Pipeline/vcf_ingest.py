@@ -0,0 +1,683 @@
+"""
+This script reads the VCF files produced by variant_calling.pbs (plain or bgzip-compressed)
+directly, as an alternative to uploading them to Franklin and cleaning the exported CSV
+files. Each called variant is turned into the same record that clean_franklin writes
+(Gene, Nucleotide, Genoox_Classification, Zygosity, Inheritance_Model):
+- Gene and Nucleotide come from the functional annotation in INFO, either SnpEff (ANN)
+  or VEP (CSQ); the field order is read from the VCF header.
+- Genoox_Classification is mapped from a ClinVar CLNSIG annotation when present.
+- Zygosity is taken from the genotype (GT) of the sample.
+- Inheritance_Model is not available in a VCF and is left empty.
+
+For gene panel or region queries a block index (<file>.vidx) is built once per VCF. It
+records, for every BGZF block (or every 64 KiB of a plain VCF), where the first record of
+the block starts and which chromosomes, positions and genes the block holds, so a query
+seeks straight to the matching blocks instead of decompressing the whole genome.
+
+The script consists of four main functions:
+1. read_vcf_header: Reads the sample names and annotation field order from the header.
+2. build_block_index: Builds and saves the block index of a VCF.
+3. query_lines: Yields the record lines of the blocks that match a gene panel or region.
+4. read_vcf_records: Yields cleaned records, optionally restricted to a gene panel or region.
+
+Usage:
+    python vcf_ingest.py index sample.vcf.gz
+    python vcf_ingest.py query sample.vcf.gz --genes BRCA1 BRCA2 --output sample.csv
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import re
+import struct
+import sys
+import zlib
+
+INDEX_EXTENSION = '.vidx'
+
+# Size of the index blocks of plain (uncompressed) VCF files
+PLAIN_BLOCK_SIZE = 64 * 1024
+
+# Fields of the cleaned records, in the order written by clean_franklin
+RECORD_COLUMNS = ["Gene", "Nucleotide", "Genoox_Classification", "Zygosity", "Inheritance_Model"]
+
+# ClinVar CLNSIG values mapped to the Franklin classifications used by count_variants
+CLNSIG_CLASSIFICATIONS = {
+    'pathogenic': 'PATHOGENIC',
+    'pathogenic/likely_pathogenic': 'LIKELY_PATHOGENIC',
+    'likely_pathogenic': 'LIKELY_PATHOGENIC',
+    'uncertain_significance': 'UNCERTAIN_SIGNIFICANCE',
+    'conflicting_interpretations_of_pathogenicity': 'UNCERTAIN_SIGNIFICANCE',
+    'conflicting_classifications_of_pathogenicity': 'UNCERTAIN_SIGNIFICANCE',
+    'likely_benign': 'LIKELY_BENIGN',
+    'benign/likely_benign': 'LIKELY_BENIGN',
+    'benign': 'BENIGN',
+}
+
+# Default positions of the allele, gene and HGVS c. fields in the ANN and CSQ annotations
+DEFAULT_ANNOTATION_FIELDS = {
+    'ANN': {'allele': 0, 'gene': 3, 'hgvs': 9},
+    'CSQ': {'allele': 0, 'gene': 3, 'hgvs': 10},
+}
+
+FIELD_NAMES = {
+    'allele': ('Allele',),
+    'gene': ('Gene_Name', 'SYMBOL'),
+    'hgvs': ('HGVS.c', 'HGVSc'),
+}
+
+
+def is_bgzf(vcf_path):
+    """
+    Checks whether a file is BGZF-compressed (bgzip), i.e. a gzip file whose members carry
+    the 'BC' extra field with the block size.
+
+    Parameters:
+    - vcf_path (str): Path to the VCF file.
+
+    Returns:
+    - bool: True for bgzip files.
+    """
+    with open(vcf_path, 'rb') as file:
+        header = file.read(16)
+    return len(header) == 16 and header[:4] == b'\x1f\x8b\x08\x04' and header[12:14] == b'BC'
+
+
+def is_compressed(vcf_path):
+    """
+    Checks whether a file is gzip-compressed (plain gzip or bgzip).
+
+    Parameters:
+    - vcf_path (str): Path to the VCF file.
+
+    Returns:
+    - bool: True for gzip and bgzip files.
+    """
+    with open(vcf_path, 'rb') as file:
+        return file.read(2) == b'\x1f\x8b'
+
+
+def open_vcf_text(vcf_path):
+    """
+    Opens a plain, gzip or bgzip VCF file for reading as text.
+
+    Parameters:
+    - vcf_path (str): Path to the VCF file.
+
+    Returns:
+    - file: Text file object.
+    """
+    if is_compressed(vcf_path):
+        return gzip.open(vcf_path, 'rt', encoding='utf-8', newline='')
+    return open(vcf_path, 'r', encoding='utf-8', newline='')
+
+
+def read_bgzf_block(file):
+    """
+    Reads and decompresses the BGZF block at the current position of a binary file.
+
+    Parameters:
+    - file (file): Binary file object positioned at the start of a block.
+
+    Returns:
+    - tuple or None: (block offset, decompressed bytes), or None at the end of the file.
+    """
+    offset = file.tell()
+    header = file.read(12)
+    if not header:
+        return None
+    if len(header) < 12 or header[:4] != b'\x1f\x8b\x08\x04':
+        raise ValueError(f"Invalid BGZF block at offset {offset}.")
+    (extra_length,) = struct.unpack('<H', header[10:12])
+    extra = file.read(extra_length)
+
+    # The 'BC' subfield holds the total block size minus one
+    block_size = None
+    position = 0
+    while position + 4 <= extra_length:
+        subfield_id = extra[position:position + 2]
+        (subfield_length,) = struct.unpack('<H', extra[position + 2:position + 4])
+        if subfield_id == b'BC':
+            (block_size,) = struct.unpack('<H', extra[position + 4:position + 6])
+        position += 4 + subfield_length
+    if block_size is None:
+        raise ValueError(f"BGZF block at offset {offset} has no block size.")
+
+    compressed = file.read(block_size - extra_length - 19)
+    file.read(8)  # CRC32 and uncompressed size
+    return offset, zlib.decompress(compressed, -15)
+
+
+def read_vcf_header(vcf_path):
+    """
+    Reads the header of a VCF file: the sample names and the field positions of the
+    ANN and CSQ annotations described in the ##INFO lines.
+
+    Parameters:
+    - vcf_path (str): Path to the VCF file.
+
+    Returns:
+    - dict: 'samples' (list of sample names) and 'annotations' (dict of INFO key to the
+      positions of its allele, gene and HGVS c. fields).
+    """
+    annotations = {key: dict(fields) for key, fields in DEFAULT_ANNOTATION_FIELDS.items()}
+    samples = []
+    with open_vcf_text(vcf_path) as file:
+        for line in file:
+            if line.startswith('##INFO=<ID=ANN,') or line.startswith('##INFO=<ID=CSQ,'):
+                key = line[11:14]
+                # SnpEff: "Functional annotations: 'Allele | Annotation | ...'"; VEP: "... Format: Allele|..."
+                match = re.search(r"(?:annotations: '|Format: )([^'\"]+)", line)
+                if match:
+                    names = [name.strip() for name in match.group(1).split('|')]
+                    for field, candidates in FIELD_NAMES.items():
+                        for candidate in candidates:
+                            if candidate in names:
+                                annotations[key][field] = names.index(candidate)
+                                break
+            elif line.startswith('#CHROM'):
+                samples = line.rstrip('\r\n').split('\t')[9:]
+                break
+            elif not line.startswith('#'):
+                break
+    return {'samples': samples, 'annotations': annotations}
+
+
+def parse_info(info):
+    """
+    Splits a VCF INFO column into a dict. Flags are stored with a value of True.
+
+    Parameters:
+    - info (str): The INFO column.
+
+    Returns:
+    - dict: INFO keys and values.
+    """
+    fields = {}
+    if info == '.':
+        return fields
+    for entry in info.split(';'):
+        key, separator, value = entry.partition('=')
+        fields[key] = value if separator else True
+    return fields
+
+
+def annotation_genes(fields, annotations):
+    """
+    Returns the genes named in the ANN or CSQ annotation of a record.
+
+    Parameters:
+    - fields (dict): Parsed INFO column.
+    - annotations (dict): Annotation field positions from read_vcf_header.
+
+    Returns:
+    - set: Gene names.
+    """
+    genes = set()
+    for key, positions in annotations.items():
+        value = fields.get(key)
+        if isinstance(value, str):
+            for entry in value.split(','):
+                parts = entry.split('|')
+                if len(parts) > positions['gene'] and parts[positions['gene']]:
+                    genes.add(parts[positions['gene']])
+    return genes
+
+
+def allele_annotation(fields, annotations, allele, alt_count):
+    """
+    Finds the gene and HGVS c. notation of one alternate allele. The first annotation of
+    the allele with an HGVS c. value is used (SnpEff orders annotations by impact). When
+    a record has a single alternate allele, annotations whose Allele field is written
+    differently (as VEP does for indels) are accepted as well.
+
+    Parameters:
+    - fields (dict): Parsed INFO column.
+    - annotations (dict): Annotation field positions from read_vcf_header.
+    - allele (str): The alternate allele.
+    - alt_count (int): Number of alternate alleles of the record.
+
+    Returns:
+    - tuple or None: (Gene, Nucleotide), or None when the allele is not annotated.
+    """
+    for key, positions in annotations.items():
+        value = fields.get(key)
+        if not isinstance(value, str):
+            continue
+        fallback = None
+        for entry in value.split(','):
+            parts = entry.split('|')
+            if len(parts) <= max(positions.values()) or not parts[positions['hgvs']]:
+                continue
+            # VEP prefixes HGVSc with the transcript ('ENST00000380152.8:c.68A>G')
+            result = (parts[positions['gene']], parts[positions['hgvs']].rpartition(':')[2])
+            if parts[positions['allele']] == allele:
+                return result
+            if fallback is None:
+                fallback = result
+        if fallback is not None and alt_count == 1:
+            return fallback
+    return None
+
+
+def classification_for(fields, allele_number, alt_count):
+    """
+    Maps the ClinVar CLNSIG annotation of an allele to a Franklin classification.
+
+    Parameters:
+    - fields (dict): Parsed INFO column.
+    - allele_number (int): 1-based number of the alternate allele.
+    - alt_count (int): Number of alternate alleles of the record.
+
+    Returns:
+    - str: The classification, or an empty string when CLNSIG is missing or unknown.
+    """
+    value = fields.get('CLNSIG')
+    if not isinstance(value, str):
+        return ''
+    # Older ClinVar releases join extra significances with ',_' (e.g. 'Pathogenic,_risk_factor')
+    values = value.replace(',_', '|').split(',')
+    # One value per alternate allele when the counts match, otherwise one for the record
+    value = values[allele_number - 1] if len(values) == alt_count else values[0]
+    value = value.split('|')[0].lower()
+    return CLNSIG_CLASSIFICATIONS.get(value, '')
+
+
+def zygosity_for(genotype, allele_number):
+    """
+    Works out the zygosity of an alternate allele from a GT value.
+
+    Parameters:
+    - genotype (str): The GT value (e.g. '0/1', '1|1', '1').
+    - allele_number (int): 1-based number of the alternate allele.
+
+    Returns:
+    - str or None: 'HET', 'HOM' or 'HEMI', or None when the allele is not carried.
+    """
+    alleles = [allele for allele in re.split(r'[/|]', genotype) if allele != '.']
+    carried = alleles.count(str(allele_number))
+    if not carried:
+        return None
+    if len(alleles) == 1:
+        return 'HEMI'
+    return 'HOM' if carried == len(alleles) else 'HET'
+
+
+def parse_record(line, header, sample_index=0, pass_only=True, genes=None):
+    """
+    Turns one VCF record line into cleaned records, one per carried alternate allele.
+
+    Parameters:
+    - line (str): The record line.
+    - header (dict): Header information from read_vcf_header.
+    - sample_index (int): Index of the sample column to read the genotype from.
+    - pass_only (bool): If True, records with a FILTER other than PASS or '.' are skipped.
+    - genes (set, optional): Only keep records annotated to these genes.
+
+    Returns:
+    - list: Record dicts with Chromosome, Position and the RECORD_COLUMNS fields.
+    """
+    columns = line.rstrip('\r\n').split('\t')
+    if len(columns) < 8:
+        return []
+    if pass_only and columns[6] not in ('PASS', '.'):
+        return []
+
+    genotype = None
+    if len(columns) > 9 + sample_index:
+        format_keys = columns[8].split(':')
+        if 'GT' in format_keys:
+            sample_values = columns[9 + sample_index].split(':')
+            gt_index = format_keys.index('GT')
+            genotype = sample_values[gt_index] if gt_index < len(sample_values) else '.'
+
+    fields = parse_info(columns[7])
+    alts = columns[4].split(',')
+    records = []
+    for allele_number, allele in enumerate(alts, start=1):
+        if allele in ('*', '.', '<NON_REF>'):
+            continue
+        zygosity = zygosity_for(genotype, allele_number) if genotype is not None else ''
+        if zygosity is None:
+            continue
+        annotation = allele_annotation(fields, header['annotations'], allele, len(alts))
+        if annotation is None:
+            continue
+        gene, nucleotide = annotation
+        if genes is not None and gene not in genes:
+            continue
+        records.append({
+            'Chromosome': columns[0],
+            'Position': int(columns[1]),
+            'Gene': gene,
+            'Nucleotide': nucleotide,
+            'Genoox_Classification': classification_for(fields, allele_number, len(alts)),
+            'Zygosity': zygosity,
+            'Inheritance_Model': '',
+        })
+    return records
+
+
+def iter_record_lines(vcf_path):
+    """
+    Yields every record line of a VCF with the block it starts in.
+
+    Parameters:
+    - vcf_path (str): Path to the VCF file.
+
+    Yields:
+    - tuple: (block offset, offset of the line in the block, line as bytes). For plain
+      files the block offset is the byte offset of the 64 KiB block the line starts in.
+    """
+    if is_bgzf(vcf_path):
+        with open(vcf_path, 'rb') as file:
+            pending = b''
+            pending_start = None
+            while True:
+                block = read_bgzf_block(file)
+                if block is None:
+                    break
+                block_offset, data = block
+                position = 0
+                # Finish the line carried over from the previous block
+                if pending_start is not None:
+                    end = data.find(b'\n')
+                    if end == -1:
+                        pending += data
+                        continue
+                    pending += data[:end + 1]
+                    yield pending_start[0], pending_start[1], pending
+                    pending, pending_start = b'', None
+                    position = end + 1
+                while position < len(data):
+                    end = data.find(b'\n', position)
+                    if end == -1:
+                        pending = data[position:]
+                        pending_start = (block_offset, position)
+                        break
+                    yield block_offset, position, data[position:end + 1]
+                    position = end + 1
+            if pending_start is not None:
+                yield pending_start[0], pending_start[1], pending
+        return
+
+    block_offset = None
+    with open(vcf_path, 'rb') as file:
+        offset = 0
+        for line in file:
+            if not line.startswith(b'#'):
+                if block_offset is None or offset >= block_offset + PLAIN_BLOCK_SIZE:
+                    block_offset = offset
+                yield block_offset, offset - block_offset, line
+            offset += len(line)
+
+
+def index_path_for(vcf_path):
+    """
+    Returns the path of the block index of a VCF file.
+
+    Parameters:
+    - vcf_path (str): Path to the VCF file.
+
+    Returns:
+    - str: The VCF path with .vidx appended.
+    """
+    return vcf_path + INDEX_EXTENSION
+
+
+def build_block_index(vcf_path):
+    """
+    Builds the block index of a VCF file and saves it next to the file. For every block
+    that holds the start of at least one record, the index keeps the offset of the block,
+    the offset of its first record, the position range per chromosome and the genes.
+
+    Parameters:
+    - vcf_path (str): Path to the VCF file.
+
+    Returns:
+    - dict: The block index.
+    """
+    header = read_vcf_header(vcf_path)
+    blocks = []
+    for block_offset, line_offset, line in iter_record_lines(vcf_path):
+        if line.startswith(b'#'):
+            continue
+        if not blocks or blocks[-1]['offset'] != block_offset:
+            blocks.append({'offset': block_offset, 'line_offset': line_offset, 'chroms': {}, 'genes': set()})
+        block = blocks[-1]
+        columns = line.decode('utf-8').split('\t', 8)
+        if len(columns) < 8:
+            continue
+        position = int(columns[1])
+        span = block['chroms'].setdefault(columns[0], [position, position])
+        span[0] = min(span[0], position)
+        span[1] = max(span[1], position)
+        block['genes'].update(annotation_genes(parse_info(columns[7]), header['annotations']))
+
+    stat = os.stat(vcf_path)
+    index = {
+        'format': 'bgzf' if is_bgzf(vcf_path) else 'plain',
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'blocks': [dict(block, genes=sorted(block['genes'])) for block in blocks],
+    }
+    temp_path = f"{index_path_for(vcf_path)}.tmp"
+    with open(temp_path, 'w') as index_file:
+        json.dump(index, index_file)
+    os.replace(temp_path, index_path_for(vcf_path))
+    return index
+
+
+def load_block_index(vcf_path):
+    """
+    Loads the block index of a VCF file, building it first when it is missing or was
+    built for a different version of the file.
+
+    Parameters:
+    - vcf_path (str): Path to the VCF file.
+
+    Returns:
+    - dict: The block index.
+    """
+    index_path = index_path_for(vcf_path)
+    if os.path.exists(index_path):
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+        stat = os.stat(vcf_path)
+        if index.get('size') == stat.st_size and index.get('mtime') == stat.st_mtime:
+            return index
+    return build_block_index(vcf_path)
+
+
+def parse_region(region):
+    """
+    Parses a region such as 'chr13:32315000-32400000' or 'chr13'.
+
+    Parameters:
+    - region (str): The region.
+
+    Returns:
+    - tuple: (chromosome, start, end); start and end are None for a whole chromosome.
+    """
+    chrom, _, span = region.partition(':')
+    if not span:
+        return chrom, None, None
+    start, _, end = span.replace(',', '').partition('-')
+    return chrom, int(start), int(end) if end else int(start)
+
+
+def block_matches(block, genes=None, region=None):
+    """
+    Checks whether a block of the index can hold records for a gene panel or region.
+
+    Parameters:
+    - block (dict): Block entry of the index.
+    - genes (set, optional): Gene panel.
+    - region (tuple, optional): (chromosome, start, end) from parse_region.
+
+    Returns:
+    - bool: True if the block has to be read.
+    """
+    if genes is not None and not genes.intersection(block['genes']):
+        return False
+    if region is not None:
+        chrom, start, end = region
+        span = block['chroms'].get(chrom)
+        if span is None:
+            return False
+        if start is not None and (span[1] < start or span[0] > end):
+            return False
+    return True
+
+
+def query_lines(vcf_path, genes=None, region=None):
+    """
+    Yields the record lines of the blocks that match a gene panel or region, seeking
+    straight to them with the block index. Lines are not filtered further here.
+
+    Parameters:
+    - vcf_path (str): Path to the VCF file.
+    - genes (set, optional): Gene panel.
+    - region (tuple, optional): (chromosome, start, end) from parse_region.
+
+    Yields:
+    - bytes: Record lines of the matching blocks, in file order.
+    """
+    index = load_block_index(vcf_path)
+    blocks = index['blocks']
+    with open(vcf_path, 'rb') as file:
+        for block_number, block in enumerate(blocks):
+            if not block_matches(block, genes, region):
+                continue
+            file.seek(block['offset'])
+
+            if index['format'] == 'plain':
+                # The block holds every line up to the start of the next block
+                end = blocks[block_number + 1]['offset'] if block_number + 1 < len(blocks) else None
+                data = file.read(end - block['offset']) if end is not None else file.read()
+                yield from data.splitlines(keepends=True)
+                continue
+
+            # Lines that start in this BGZF block; the last one may end in a later block
+            _, data = read_bgzf_block(file)
+            data = data[block['line_offset']:]
+            while not data.endswith(b'\n'):
+                next_block = read_bgzf_block(file)
+                if next_block is None or not next_block[1]:
+                    break
+                end = next_block[1].find(b'\n')
+                data += next_block[1] if end == -1 else next_block[1][:end + 1]
+            for line in data.splitlines(keepends=True):
+                if not line.startswith(b'#'):
+                    yield line
+
+
+def read_vcf_records(vcf_path, genes=None, region=None, sample=None, pass_only=True):
+    """
+    Reads a VCF file and yields cleaned records in the form written by clean_franklin.
+    Without a gene panel or region the file is streamed from start to end; with one, only
+    the matching blocks are decompressed (see query_lines).
+
+    Parameters:
+    - vcf_path (str): Path to a plain, gzip or bgzip VCF file.
+    - genes (iterable, optional): Only yield records annotated to these genes.
+    - region (str, optional): Only yield records in this region (e.g. 'chr13:32315000-32400000').
+    - sample (str, optional): Sample column to take genotypes from. Defaults to the first sample.
+    - pass_only (bool): If True, records that failed a filter (FILTER not PASS or '.') are skipped.
+
+    Yields:
+    - dict: Chromosome, Position, Gene, Nucleotide, Genoox_Classification, Zygosity and Inheritance_Model.
+    """
+    header = read_vcf_header(vcf_path)
+    sample_index = header['samples'].index(sample) if sample else 0
+    genes = set(genes) if genes is not None else None
+    parsed_region = parse_region(region) if region else None
+
+    if genes is None and parsed_region is None:
+        for line in stream_record_lines(vcf_path):
+            yield from parse_record(line, header, sample_index, pass_only)
+        return
+
+    # gzip files without BGZF blocks cannot be sought into and are streamed instead
+    if is_compressed(vcf_path) and not is_bgzf(vcf_path):
+        print(f"Warning: {vcf_path} is not bgzip-compressed; reading the whole file.")
+        lines = stream_record_lines(vcf_path)
+    else:
+        lines = (line.decode('utf-8') for line in query_lines(vcf_path, genes, parsed_region))
+
+    for line in lines:
+        for record in parse_record(line, header, sample_index, pass_only, genes):
+            if parsed_region is not None:
+                chrom, start, end = parsed_region
+                if record['Chromosome'] != chrom or (start is not None and not start <= record['Position'] <= end):
+                    continue
+            yield record
+
+
+def stream_record_lines(vcf_path):
+    """
+    Yields the record lines of a VCF file from start to end, skipping the header.
+
+    Parameters:
+    - vcf_path (str): Path to a plain, gzip or bgzip VCF file.
+
+    Yields:
+    - str: Record lines.
+    """
+    with open_vcf_text(vcf_path) as file:
+        for line in file:
+            if not line.startswith('#'):
+                yield line
+
+
+def read_gene_panel(panel_path):
+    """
+    Reads a gene panel file with one gene name per line ('#' starts a comment).
+
+    Parameters:
+    - panel_path (str): Path to the gene panel file.
+
+    Returns:
+    - set: Gene names.
+    """
+    with open(panel_path) as panel_file:
+        return {line.split('#')[0].strip() for line in panel_file} - {''}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read VCF files into cleaned variant records.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    index_parser = subparsers.add_parser('index', help="Build the block index of one or more VCF files.")
+    index_parser.add_argument('vcf_files', nargs='+')
+
+    query_parser = subparsers.add_parser('query', help="Write the cleaned records of a VCF file as CSV.")
+    query_parser.add_argument('vcf_file')
+    query_parser.add_argument('--genes', nargs='+', help="Only include these genes.")
+    query_parser.add_argument('--gene-panel', help="File with one gene per line to include.")
+    query_parser.add_argument('--region', help="Only include this region, e.g. chr13:32315000-32400000.")
+    query_parser.add_argument('--sample', help="Sample column to read genotypes from (default: the first).")
+    query_parser.add_argument('--all-filters', action='store_true', help="Include records that failed a filter.")
+    query_parser.add_argument('--output', help="Output CSV file (default: standard output).")
+    args = parser.parse_args()
+
+    if args.command == 'index':
+        for vcf_file in args.vcf_files:
+            index = build_block_index(vcf_file)
+            print(f"{vcf_file}: {len(index['blocks'])} blocks indexed.")
+    else:
+        genes = set(args.genes or [])
+        if args.gene_panel:
+            genes |= read_gene_panel(args.gene_panel)
+        records = read_vcf_records(args.vcf_file, genes=genes or None, region=args.region,
+                                   sample=args.sample, pass_only=not args.all_filters)
+        output = open(args.output, 'w', newline='') if args.output else None
+        try:
+            writer = csv.DictWriter(output or sys.stdout, fieldnames=['Chromosome', 'Position'] + RECORD_COLUMNS)
+            writer.writeheader()
+            writer.writerows(records)
+        finally:
+            if output is not None:
+                output.close()
@@ -1,13 +1,56 @@
 # This script processes the output .txt file from VIPR, to create a .csv file 
 # retaining only the genes, nucleotide variants, and VIPR Pathogenicity scores.
 
+import argparse
 import csv
+import io
+import locale
+import os
+import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# Compressed (.gz, .zst) inputs and outputs are handled by compressed_io, which lives with the pipeline scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Bioinformatics-Pipeline'))
+from compressed_io import compression_of, open_text
+from hgvs_normalise import normalise_gene, normalise_nucleotide
+
+# Compiled extract_c_dot patterns, keyed by (start_str, end_chars)
+_c_dot_patterns = {}
+
+def c_dot_pattern(start_str, end_chars):
+    """
+    Compile (once per combination of arguments) the regular expression used by
+    extract_c_dot: the start string followed by everything up to the first end character.
+
+    Parameters:
+    start_str (str): The starting string to look for.
+    end_chars (tuple): Characters that denote the end of the substring.
+
+    Returns:
+    re.Pattern: The compiled pattern.
+    """
+    key = (start_str, end_chars)
+    pattern = _c_dot_patterns.get(key)
+    if pattern is None:
+        if end_chars:
+            body = '[^' + ''.join(re.escape(char) for char in end_chars) + ']*'
+        else:
+            body = '.*'
+        pattern = _c_dot_patterns[key] = re.compile(re.escape(start_str) + body, re.DOTALL)
+    return pattern
 
 def extract_c_dot(sequence, start_str='c.', end_chars=[':', ';']):
     """
     Extract all substrings from the input sequence that start with 'c.'
     and end with the first occurrence of specified end characters.
 
+    The sequence is scanned once with a compiled regular expression, which gives
+    the same substrings as searching for each end character in turn.
+
     Parameters:
     sequence (str): The input string from which to extract substrings.
     start_str (str): The starting string to look for (default is 'c.').
@@ -16,64 +59,150 @@ def extract_c_dot(sequence, start_str='c.', end_chars=[':', ';']):
     Returns:
     list: A list of extracted substrings.
     """
-    extracted_list = []  # List to store extracted substrings
-    start_idx = sequence.find(start_str)  # Find the first occurrence of 'c.'
+    return c_dot_pattern(start_str, tuple(end_chars)).findall(sequence)
+
+def extract_rows(row):
+    """
+    Extract the output rows (Gene, Nucleotide, VIPR Pathogenicity score) for one
+    row of the VIPR TSV file, one for each c. value found. Gene and Nucleotide are
+    normalised (see hgvs_normalise.py) so they join with the Franklin and eVai keys.
+
+    Parameters:
+    row (dict): A row of the VIPR TSV file.
+
+    Returns:
+    list: A list of [Gene, Nucleotide, VIPR_Pathogenicity] rows.
+    """
+    gene = normalise_gene(row['Gene.refGene'])  # Extract gene name
+    vipr_pathogenicity = row['.pred_P_LP']  # Extract VIPR Pathogenicity score
+    gene_detail = row['GeneDetail.refGene'] 
+    aa_change = row['AAChange.refGene']
     
-    while start_idx != -1:
-        # Find the earliest occurrence of an end character
-        end_idx = len(sequence)
-        for char in end_chars:
-            idx = sequence.find(char, start_idx)  # Search for end character
-            if idx != -1:
-                end_idx = min(end_idx, idx)  # Update end index to the earliest found
-        
-        # Append the extracted part from 'c.' to ':' or ';' or end of the line
-        extracted_list.append(sequence[start_idx:end_idx])
-        start_idx = sequence.find(start_str, end_idx)  # Look for more 'c.' in the sequence
-
-    return extracted_list
-
-def process_tsv(input_file, output_file):
+    # Determine which field to extract c_dot values from
+    if gene_detail == ".":
+        c_dots = extract_c_dot(aa_change, start_str='c.', end_chars=[':'])
+    elif aa_change == ".":
+        c_dots = extract_c_dot(gene_detail, start_str='c.', end_chars=[';', '\n'])
+    else:
+        c_dots = []
+
+    # A new row for each extracted c_dot as "Nucleotide"
+    return [[gene, normalise_nucleotide(c_dot), vipr_pathogenicity] for c_dot in c_dots]
+
+def process_chunk(input_file, start, end, fieldnames, part_file):
     """
-    Process the input TSV file to extract Gene, Nucleotide and VIPR Pathogenicity score
-    and save it to a CSV file.
+    Process the rows between two line-aligned byte offsets of the input TSV file and
+    write the extracted rows (without a header) to a part file.
 
     Parameters:
     input_file (str): The path to the input .txt file in TSV format.
-    output_file (str): The path to the output .csv file.
+    start (int): Byte offset of the first line of the chunk.
+    end (int): Byte offset just past the last line of the chunk.
+    fieldnames (list): Column names from the header line of the input file.
+    part_file (str): The path to the part .csv file to write.
+
+    Returns:
+    str: The path to the part file.
     """
-    with open(input_file, 'r') as tsvfile, open(output_file, 'w', newline='') as csvfile:
-        reader = csv.DictReader(tsvfile, delimiter='\t')
-        fieldnames = ['Gene', 'Nucleotide', 'VIPR_Pathogenicity']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
+    with open(input_file, 'rb') as tsvfile:
+        tsvfile.seek(start)
+        text = tsvfile.read(end - start).decode(locale.getpreferredencoding(False))
 
-        # Process each row in the input file
+    with open(part_file, 'w', newline='') as csvfile:
+        reader = csv.DictReader(io.StringIO(text, newline=None), fieldnames=fieldnames, delimiter='\t')
+        writer = csv.writer(csvfile)
         for row in reader:
-            gene = row['Gene.refGene']  # Extract gene name
-            vipr_pathogenicity = row['.pred_P_LP']  # Extract VIPR Pathogenicity score
-            gene_detail = row['GeneDetail.refGene'] 
-            aa_change = row['AAChange.refGene']
-            
-            # Determine which field to extract c_dot values from
-            if gene_detail == ".":
-                c_dots = extract_c_dot(aa_change, start_str='c.', end_chars=[':'])
-            elif aa_change == ".":
-                c_dots = extract_c_dot(gene_detail, start_str='c.', end_chars=[';', '\n'])
-            else:
-                c_dots = []
-
-            # Write a new row for each extracted c_dot as "Nucleotide"
-            for c_dot in c_dots:
-                writer.writerow({
-                    'Gene': gene,
-                    'Nucleotide': c_dot,
-                    'VIPR_Pathogenicity': vipr_pathogenicity
-                })
-
-# Define input and output file paths
-input_file = 'prioritised_file.txt'
-output_file = 'extracted_prioritised_file_2.csv'
-
-# Run the processing function
-process_tsv(input_file, output_file)
+            writer.writerows(extract_rows(row))
+    return part_file
+
+def chunk_offsets(input_file, chunk_size):
+    """
+    Split the input TSV file (after its header line) into byte ranges of roughly
+    chunk_size bytes that start and end on line boundaries.
+
+    Parameters:
+    input_file (str): The path to the input .txt file in TSV format.
+    chunk_size (int): Target size of each chunk in bytes.
+
+    Returns:
+    tuple: The header line's fieldnames and a list of (start, end) byte offsets.
+    """
+    with open(input_file, 'rb') as tsvfile:
+        header = tsvfile.readline()
+        file_size = os.fstat(tsvfile.fileno()).st_size
+        offsets = []
+        start = tsvfile.tell()
+        while start < file_size:
+            tsvfile.seek(min(start + chunk_size, file_size))
+            tsvfile.readline()  # Move on to the next line boundary
+            end = min(tsvfile.tell(), file_size)
+            offsets.append((start, end))
+            start = end
+
+    header_text = header.decode(locale.getpreferredencoding(False))
+    fieldnames = next(csv.reader(io.StringIO(header_text, newline=None), delimiter='\t'))
+    return fieldnames, offsets
+
+def process_tsv(input_file, output_file, workers=1, chunk_size=64 * 1024 * 1024):
+    """
+    Process the input TSV file to extract Gene, Nucleotide and VIPR Pathogenicity score
+    and save it to a CSV file.
+
+    With more than one worker, the file is split into line-aligned byte ranges that are
+    processed in parallel. The parts are joined in file order, so the output is the same
+    as a single-process run. Fields must not contain quoted line breaks in this mode.
+    Compressed inputs (.gz, .zst) cannot be split by byte offset and are read in a single
+    pass; compressed outputs are written when output_file ends in .gz or .zst.
+
+    Parameters:
+    input_file (str): The path to the input .txt file in TSV format (optionally compressed).
+    output_file (str): The path to the output .csv file (optionally compressed).
+    workers (int): Number of worker processes (default is 1, a single pass).
+    chunk_size (int): Target size in bytes of each chunk processed by a worker.
+    """
+    fieldnames = ['Gene', 'Nucleotide', 'VIPR_Pathogenicity']
+
+    if workers > 1 and compression_of(input_file):
+        print(f"{input_file} is compressed; processing it in a single pass.")
+        workers = 1
+
+    if workers <= 1:
+        with open_text(input_file, 'r') as tsvfile, open_text(output_file, 'w', newline='') as csvfile:
+            reader = csv.DictReader(tsvfile, delimiter='\t')
+            writer = csv.writer(csvfile)
+            writer.writerow(fieldnames)
+
+            # Process each row in the input file
+            for row in reader:
+                writer.writerows(extract_rows(row))
+        return
+
+    input_fieldnames, offsets = chunk_offsets(input_file, chunk_size)
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    with tempfile.TemporaryDirectory(dir=output_dir) as temp_dir:
+        part_files = [os.path.join(temp_dir, f"part_{index}.csv") for index in range(len(offsets))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            finished = executor.map(process_chunk, repeat(input_file), [start for start, _ in offsets],
+                                    [end for _, end in offsets], repeat(input_fieldnames), part_files)
+
+            # Join the parts in file order as they finish
+            with open_text(output_file, 'w', newline='') as csvfile:
+                csv.writer(csvfile).writerow(fieldnames)
+                for part_file in finished:
+                    with open(part_file, 'r', newline='') as part:
+                        shutil.copyfileobj(part, csvfile)
+                    os.remove(part_file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract Gene, Nucleotide and VIPR Pathogenicity from a VIPR TSV file.")
+    parser.add_argument('input_file', nargs='?', default='prioritised_file.txt',
+                        help="VIPR output file in TSV format (default: prioritised_file.txt).")
+    parser.add_argument('output_file', nargs='?', default='extracted_prioritised_file_2.csv',
+                        help="Output CSV file (default: extracted_prioritised_file_2.csv).")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes (default: 1).")
+    parser.add_argument('--chunk-size', type=int, default=64,
+                        help="Size in MB of the chunks processed by each worker (default: 64).")
+    args = parser.parse_args()
+
+    # Run the processing function
+    process_tsv(args.input_file, args.output_file, workers=args.workers, chunk_size=args.chunk_size * 1024 * 1024)
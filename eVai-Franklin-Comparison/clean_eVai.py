@@ -1,61 +1,149 @@
 # This script refines eVai output TXT files, retaining only the
-# Gene, HGVS_Coding, Classification, Zygosity, Condition Inheritance  
+# Gene, HGVS_Coding, Classification, Zygosity, Condition Inheritance
 # and Pathogenicity Socre columns to streamline subsequent analysis.
+# A whole directory of eVai outputs can be cleaned in parallel.
 
+import argparse
 import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-input_file_path = 'eVai_outputs/CVD46_eVai.txt'
-output_file_path = 'clean_eVai_outputs/CVD46_eVai_compared.csv'
+# Compressed (.gz, .zst) inputs and outputs are handled by compressed_io, which lives with the pipeline scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Bioinformatics-Pipeline'))
+from compressed_io import list_files, open_text, strip_compression, with_compression
+from hgvs_normalise import variant_key
+
+input_dir = 'eVai_outputs'
+output_dir = 'clean_eVai_outputs'
 
 columns_to_keep = ["Gene", "HGVS_Coding", "Classification", "Sample_Zygosity", "Condition_Inheritance", "Pathogenicity_Score"]
 
+def data_lines(infile):
+    """
+    Yield the lines of an eVai output file from the header line onwards,
+    skipping the '##' metadata block and anything else before the header.
+
+    Parameters:
+    infile (file): The open eVai output file.
+
+    Yields:
+    str: The header line followed by every data line.
+    """
+    for line in infile:
+        if line.startswith("##") or not line.lstrip('"').startswith("Gene"):
+            continue  # Skip metadata lines
+        yield line
+        break
+    yield from infile
+
 def clean_data(input_file_path, output_file_path, columns_to_keep):
-    with open(input_file_path, 'r') as infile, open(output_file_path, 'w', newline='') as outfile:
-        headers_found = False
-        headers = []
-        seen_entries = set()
-        
+    """
+    Clean one eVai output file. Lines are parsed with the csv module, so quoted
+    fields that contain commas or '","' are kept intact, and only the indices of
+    columns_to_keep are projected from each row. Gene and HGVS_Coding are written in
+    their canonical form (see hgvs_normalise.py), and rows with a (Gene, HGVS_Coding)
+    pair that was already seen are dropped.
+
+    Parameters:
+    input_file_path (str): The path to the eVai output .txt file (optionally .gz or .zst).
+    output_file_path (str): The path to the cleaned output .csv file (compressed if it ends in .gz or .zst).
+    columns_to_keep (list): The columns to write, in output order.
+
+    Returns:
+    int: The number of rows written.
+    """
+    rows_written = 0
+    with open_text(input_file_path, 'r', newline='') as infile, open_text(output_file_path, 'w', newline='') as outfile:
+        reader = csv.reader(data_lines(infile))
         writer = csv.writer(outfile)
-        
-        for line in infile:
-            line = line.strip()
-            if line.startswith("##"):
-                continue  # Skip metadata lines
-            
-            # Process the header line
-            if not headers_found:
-                if line.startswith("Gene"):
-                    headers = line.split(",")
-                    writer.writerow(columns_to_keep)  # Write the header to the output file
-                    headers_found = True
+
+        # Process the header line
+        headers = next(reader, None)
+        if headers is None:
+            return rows_written
+        writer.writerow(columns_to_keep)  # Write the header to the output file
+
+        # Index of each column by name (the last one wins, as with a dict of the row)
+        header_index = {header.strip(): index for index, header in enumerate(headers)}
+        keep_indices = [header_index.get(key) for key in columns_to_keep]
+        gene_index = header_index.get("Gene")
+        hgvs_index = header_index.get("HGVS_Coding")
+        # Output positions of the Gene and HGVS_Coding columns, which are written normalised
+        key_positions = [columns_to_keep.index(key) if key in columns_to_keep else None
+                         for key in ("Gene", "HGVS_Coding")]
+
+        seen_entries = set()
+        for values in reader:
+            if not values:
+                continue  # Skip blank lines
+            field_count = len(values)
+
+            # Check for duplicates
+            gene = values[gene_index] if gene_index is not None and gene_index < field_count else ""
+            hgvs_coding = values[hgvs_index] if hgvs_index is not None and hgvs_index < field_count else ""
+            entry_key = variant_key(gene, hgvs_coding)
+            if entry_key in seen_entries:
                 continue
-            
-            # Process data lines
-            # Split the line into gene and the rest of the data
-            if line:
-                # Extract gene name and the rest of the line
-                gene_name, rest_of_line = line.split(',', 1)
-                
-                # Handle rest of the line: Split by '","' and clean entries
-                line_data = rest_of_line.split('","')
-                line_data = [gene_name.strip('"')] + [entry.strip('"') for entry in line_data]
-                
-                # Create a dictionary from the line data
-                data_dict = dict(zip(headers, line_data))
-                
-                # Check for duplicates
-                gene = data_dict.get("Gene", "")
-                hgvs_coding = data_dict.get("HGVS_Coding", "")
-                entry_key = (gene, hgvs_coding)
-                
-                if entry_key not in seen_entries:
-                    seen_entries.add(entry_key)
-                    
-                    # Clean and select columns to keep
-                    cleaned_row = [data_dict.get(key, "") for key in columns_to_keep]
-                    
-                    # Write the cleaned row to the output file
-                    writer.writerow(cleaned_row)
-
-# Call the function
-clean_data(input_file_path, output_file_path, columns_to_keep)
+            seen_entries.add(entry_key)
+
+            # Select the columns to keep and write the cleaned row to the output file
+            row = [values[index] if index is not None and index < field_count else "" for index in keep_indices]
+            for position, value in zip(key_positions, entry_key):
+                if position is not None:
+                    row[position] = value
+            writer.writerow(row)
+            rows_written += 1
+    return rows_written
+
+def clean_directory(input_dir, output_dir, columns_to_keep, workers=1, compression=None):
+    """
+    Clean every eVai output .txt file (or .txt.gz, .txt.zst) in a directory, in parallel
+    when more than one worker is used. 'CVD46_eVai.txt' is written as 'CVD46_eVai_compared.csv'.
+
+    Parameters:
+    input_dir (str): The directory containing the eVai output .txt files.
+    output_dir (str): The directory to write the cleaned .csv files to.
+    columns_to_keep (list): The columns to write, in output order.
+    workers (int): Number of worker processes (default is 1).
+    compression (str): 'gzip' or 'zstd' to write compressed .csv.gz or .csv.zst files (default is None).
+
+    Returns:
+    dict: The number of rows written for each input file name.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    input_files = list_files(input_dir, '.txt')
+    file_names = [f for _, f in input_files]
+    input_paths = [os.path.join(input_dir, f) for f in file_names]
+    output_paths = [with_compression(os.path.join(output_dir, f"{name}_compared.csv"), compression)
+                    for name, _ in input_files]
+
+    if workers <= 1:
+        counts = [clean_data(i, o, columns_to_keep) for i, o in zip(input_paths, output_paths)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            counts = list(executor.map(clean_data, input_paths, output_paths, [columns_to_keep] * len(file_names)))
+
+    for file_name, count in zip(file_names, counts):
+        print(f"{file_name}: {count} rows written.")
+    return dict(zip(file_names, counts))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean eVai output files.")
+    parser.add_argument('--input-dir', default=input_dir, help="Directory of eVai output .txt files.")
+    parser.add_argument('--output-dir', default=output_dir, help="Directory for the cleaned .csv files.")
+    parser.add_argument('--input-file', help="Clean a single eVai output file instead of a directory.")
+    parser.add_argument('--output-file', help="Output path used with --input-file.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes (default: 1).")
+    parser.add_argument('--compress', choices=['gzip', 'zstd'],
+                        help="Write compressed .csv.gz or .csv.zst files in directory mode.")
+    args = parser.parse_args()
+
+    # Call the function
+    if args.input_file:
+        output_file_path = args.output_file or os.path.join(
+            args.output_dir, f"{os.path.splitext(strip_compression(os.path.basename(args.input_file)))[0]}_compared.csv")
+        clean_data(args.input_file, output_file_path, columns_to_keep)
+    else:
+        clean_directory(args.input_dir, args.output_dir, columns_to_keep, workers=args.workers,
+                        compression=args.compress)
@@ -3,6 +3,12 @@
 # to streamline subsequent analysis.
 
 import csv
+import os
+import sys
+
+# Gene and Nucleotide are normalised with hgvs_normalise, which lives with the pipeline scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Bioinformatics-Pipeline'))
+from hgvs_normalise import variant_key
 
 # Define file paths
 input_file_path_default = 'Cohort_3_raw/CVD930_single_snp_variants.csv'
@@ -39,8 +45,8 @@ with open(output_file_path, 'w', newline='', encoding='utf-8') as outfile:
 
     # Process each row in the merged data
     for row in merged_rows:
-        # Create a unique identifier based on Gene and Nucleotide
-        unique_id = (row["Gene"], row["Nucleotide"])
+        # Create a unique identifier based on the canonical Gene and Nucleotide
+        unique_id = variant_key(row["Gene"], row["Nucleotide"])
 
         # Check if the entry is a duplicate
         if unique_id in seen_entries:
@@ -49,6 +55,7 @@ with open(output_file_path, 'w', newline='', encoding='utf-8') as outfile:
             seen_entries.add(unique_id)
             # Clean up the data by removing extra quotes and keeping only the columns of interest
             cleaned_row = {key: row[key].replace('""', '').strip('"') for key in columns_to_keep}
+            cleaned_row["Gene"], cleaned_row["Nucleotide"] = unique_id
             writer.writerow(cleaned_row)
 
     # Print out any duplicates
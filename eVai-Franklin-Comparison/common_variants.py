@@ -0,0 +1,210 @@
+# This script builds the common variant tables used by compare_common_variants.R and
+# Kappa_comparison.R (CVD*_common_variants.csv and CVD_common_variants.csv) for every
+# sample in one run. The cleaned Franklin outputs (Cohort_* folders) and the cleaned
+# eVai outputs (clean_eVai_outputs) are paired by sample name and joined on
+# Variant_ID (Gene_Nucleotide), with the same standardisation as compare_all_variants.R.
+
+import os
+import csv
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# compressed_io and hgvs_normalise live with the pipeline scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Bioinformatics-Pipeline'))
+from compressed_io import open_text, strip_compression
+from hgvs_normalise import variant_key
+from merge_with_VIPR import sample_rows
+
+FRANKLIN_COLUMNS = ['Gene', 'Nucleotide', 'Genoox_Classification', 'Zygosity', 'Inheritance_Model']
+EVAI_COLUMNS = ['HGVS_Coding', 'eVai_Classification', 'Sample_Zygosity', 'Condition_Inheritance',
+                'Pathogenicity_Score']
+OUTPUT_COLUMNS = ['Variant_ID'] + FRANKLIN_COLUMNS + EVAI_COLUMNS
+
+def sample_name_for(file_name):
+    """
+    Derives the sample name of a cleaned output file, e.g. 'CVD46' from 'CVD46.csv',
+    'CVD46.csv.gz' or 'CVD46_eVai_compared.csv'.
+
+    Parameters:
+    - file_name (str): Name of the cleaned Franklin or eVai file.
+
+    Returns:
+    - str: The sample name.
+    """
+    return os.path.splitext(strip_compression(os.path.basename(file_name)))[0].split('_')[0]
+
+def find_samples(evai_dir, franklin_dirs):
+    """
+    Pairs the cleaned eVai and Franklin files of each sample.
+
+    Parameters:
+    - evai_dir (str): Directory of cleaned eVai outputs.
+    - franklin_dirs (list): Directories of cleaned Franklin outputs (e.g. Cohort_1 ... Cohort_5).
+
+    Returns:
+    - list: (sample, Franklin file, eVai file) tuples for samples found in both, sorted by sample.
+    """
+    franklin_files = {}
+    for franklin_dir in franklin_dirs:
+        for file_name in sorted(os.listdir(franklin_dir)):
+            if strip_compression(file_name).endswith('.csv'):
+                sample = sample_name_for(file_name)
+                if sample in franklin_files:
+                    print(f"Warning: {sample} is in more than one Franklin folder; using {franklin_files[sample]}.")
+                    continue
+                franklin_files[sample] = os.path.join(franklin_dir, file_name)
+
+    evai_files = {}
+    for file_name in sorted(os.listdir(evai_dir)):
+        if strip_compression(file_name).endswith('.csv'):
+            evai_files.setdefault(sample_name_for(file_name), os.path.join(evai_dir, file_name))
+
+    for sample in sorted(set(evai_files) ^ set(franklin_files)):
+        source = 'eVai' if sample in evai_files else 'Franklin'
+        print(f"Skipping {sample}: only found in the {source} outputs.")
+
+    return [(sample, franklin_files[sample], evai_files[sample])
+            for sample in sorted(set(evai_files) & set(franklin_files))]
+
+def read_franklin_index(file_path):
+    """
+    Reads a cleaned Franklin file into an index keyed by the canonical (Gene, Nucleotide)
+    (see hgvs_normalise.py). As in compare_all_variants.R, a leading 'n.' in the
+    Nucleotide is then replaced with 'c.'.
+
+    Parameters:
+    - file_path (str): Path to the cleaned Franklin file (its .vcol form is used when fresh).
+
+    Returns:
+    - tuple: A dict of (Gene, Nucleotide) to the list of Franklin rows with that key, and
+      a dict of Gene to the nucleotides of that gene grouped by their first two characters.
+    """
+    index = {}
+    nucleotides_by_gene = {}
+    indices = None
+    for columns, values in sample_rows(file_path):
+        if indices is None:
+            indices = [columns.index(column) for column in FRANKLIN_COLUMNS]
+        row = [values[i] for i in indices]
+        row[0], row[1] = variant_key(row[0], row[1])
+        if row[1].startswith('n.'):
+            row[1] = 'c.' + row[1][2:]
+        gene, nucleotide = row[0], row[1]
+        index.setdefault((gene, nucleotide), []).append(row)
+        if nucleotide:
+            nucleotides_by_gene.setdefault(gene, {}).setdefault(nucleotide[:2], set()).add(nucleotide)
+    return index, nucleotides_by_gene
+
+def match_nucleotide(hgvs_coding, candidates):
+    """
+    Finds the Franklin nucleotide that an eVai HGVS_Coding value refers to. As in
+    compare_all_variants.R, an HGVS_Coding that contains a Franklin nucleotide of the
+    same gene (e.g. 'NM_000059.4:c.68A>G' and 'c.68A>G') is matched to it. Only
+    positions that start like one of the nucleotides are checked, and the longest
+    nucleotide found wins.
+
+    Parameters:
+    - hgvs_coding (str): The eVai HGVS_Coding value.
+    - candidates (dict): Nucleotides of the gene grouped by their first two characters.
+
+    Returns:
+    - str or None: The matched nucleotide, or None.
+    """
+    best = None
+    for prefix, nucleotides in candidates.items():
+        position = hgvs_coding.find(prefix)
+        while position != -1:
+            tail = hgvs_coding[position:]
+            for nucleotide in nucleotides:
+                if tail.startswith(nucleotide) and (best is None or len(nucleotide) > len(best)):
+                    best = nucleotide
+            position = hgvs_coding.find(prefix, position + 1)
+    return best
+
+def join_sample(sample, franklin_file, evai_file, output_file):
+    """
+    Joins the Franklin and eVai variants of one sample on Variant_ID and writes the
+    common variants. Franklin rows are indexed in memory; eVai rows are streamed.
+
+    Parameters:
+    - sample (str): Sample name.
+    - franklin_file (str): Path to the cleaned Franklin file.
+    - evai_file (str): Path to the cleaned eVai file.
+    - output_file (str): Path to the per-sample common variants file.
+
+    Returns:
+    - int: Number of common variant rows written.
+    """
+    franklin_index, nucleotides_by_gene = read_franklin_index(franklin_file)
+    rows_written = 0
+    with open_text(evai_file, 'r', newline='') as infile, open(output_file, 'w', newline='') as outfile:
+        reader = csv.DictReader(infile)
+        writer = csv.writer(outfile)
+        writer.writerow(OUTPUT_COLUMNS)
+        for row in reader:
+            gene, hgvs_coding = variant_key(row['Gene'], row['HGVS_Coding'])
+            if (gene, hgvs_coding) not in franklin_index and gene in nucleotides_by_gene:
+                hgvs_coding = match_nucleotide(hgvs_coding, nucleotides_by_gene[gene]) or hgvs_coding
+            franklin_rows = franklin_index.get((gene, hgvs_coding))
+            if not franklin_rows:
+                continue
+            evai_values = [hgvs_coding, row['Classification'], row['Sample_Zygosity'],
+                           row['Condition_Inheritance'], row['Pathogenicity_Score']]
+            for franklin_row in franklin_rows:
+                writer.writerow([f"{gene}_{hgvs_coding}"] + franklin_row + evai_values)
+                rows_written += 1
+    return rows_written
+
+def build_common_variants(evai_dir, franklin_dirs, output_dir, workers=1):
+    """
+    Writes the common variant table of every sample found in both the eVai and Franklin
+    outputs, and the overall table with a Sample column. Each input file is read once;
+    samples are joined in parallel when more than one worker is used.
+
+    Parameters:
+    - evai_dir (str): Directory of cleaned eVai outputs.
+    - franklin_dirs (list): Directories of cleaned Franklin outputs.
+    - output_dir (str): Directory for CVD*_common_variants.csv and CVD_common_variants.csv.
+    - workers (int): Number of worker processes.
+
+    Returns:
+    - dict: Number of common variants for each sample.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    samples = find_samples(evai_dir, franklin_dirs)
+    tasks = [(sample, franklin_file, evai_file, os.path.join(output_dir, f"{sample}_common_variants.csv"))
+             for sample, franklin_file, evai_file in samples]
+
+    if workers <= 1 or len(tasks) <= 1:
+        counts = [join_sample(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            counts = list(executor.map(join_sample, *zip(*tasks)))
+
+    # The overall table is the per-sample tables one after another, with the sample name
+    with open(os.path.join(output_dir, 'CVD_common_variants.csv'), 'w', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['Sample'] + OUTPUT_COLUMNS)
+        for sample, _, _, output_file in tasks:
+            with open(output_file, 'r', newline='') as infile:
+                reader = csv.reader(infile)
+                next(reader, None)
+                writer.writerows([sample] + values for values in reader)
+
+    for (sample, _, _, _), count in zip(tasks, counts):
+        print(f"{sample}: {count} common variants.")
+    return {task[0]: count for task, count in zip(tasks, counts)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the eVai-Franklin common variant tables for every sample.")
+    parser.add_argument('--evai-dir', default='clean_eVai_outputs', help="Directory of cleaned eVai outputs.")
+    parser.add_argument('--franklin-dirs', nargs='+',
+                        help="Directories of cleaned Franklin outputs (default: every Cohort_<n> folder).")
+    parser.add_argument('--output-dir', default='comparison_results', help="Directory for the common variant tables.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes (default: 1).")
+    args = parser.parse_args()
+
+    franklin_dirs = args.franklin_dirs or sorted(
+        f for f in os.listdir('.') if os.path.isdir(f) and f.startswith('Cohort_') and not f.endswith('_raw'))
+    build_common_variants(args.evai_dir, franklin_dirs, args.output_dir, workers=args.workers)
@@ -0,0 +1,272 @@
+# This script calculates Cohen's weighted Kappa as an index of interrater agreement
+# between eVai and Franklin on ordinal data (variant classifications), for every
+# sample at once. It is the batch counterpart of Kappa_comparison.R: the common
+# variants are read in one pass, one 5x5 confusion matrix is built per sample, and
+# Kappa and its bootstrap confidence interval are computed on all matrices together.
+
+import os
+import csv
+import argparse
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Compressed (.gz, .zst) inputs are read with compressed_io, which lives with the pipeline scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Bioinformatics-Pipeline'))
+from compressed_io import open_text, strip_compression
+
+# Ordinal codes of the Franklin (Genoox_Classification) values, as in Kappa_comparison.R
+FRANKLIN_CODES = {
+    'BENIGN': 1,
+    'LIKELY_BENIGN': 2,
+    'UNCERTAIN_SIGNIFICANCE': 3,
+    'POSSIBLY_BENIGN': 3,
+    'POSSIBLY_PATHOGENIC_LOW': 3,
+    'POSSIBLY_PATHOGENIC_MODERATE': 3,
+    'LIKELY_PATHOGENIC': 4,
+    'PATHOGENIC': 5,
+}
+
+# Ordinal codes of the eVai_Classification values
+EVAI_CODES = {
+    'Benign': 1,
+    'Likely benign': 2,
+    'Uncertain significance': 3,
+    'Likely pathogenic': 4,
+    'Pathogenic': 5,
+}
+
+LEVELS = 5
+OVERALL = 'overall'
+
+def sample_name_for(file_path):
+    """
+    Derives the sample name of a per-sample common variants file,
+    e.g. 'CVD12' from 'CVD12_common_variants.csv'.
+
+    Parameters:
+    - file_path (str): Path to the per-sample file.
+
+    Returns:
+    - str: The sample name.
+    """
+    return os.path.basename(strip_compression(file_path)).split('_common_variants')[0]
+
+def input_files(paths):
+    """
+    Expands the input paths into (file, sample) pairs. Directories are searched for
+    per-sample CVD*_common_variants.csv files; the combined CVD_common_variants.csv in a
+    directory is skipped, as the overall matrix is built from the per-sample rows.
+    Files given directly are read as combined files with a Sample column unless they
+    are named like a per-sample file.
+
+    Parameters:
+    - paths (list): Files and directories to read.
+
+    Returns:
+    - list: (file path, sample name or None) pairs; None means the Sample column is used.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for file_name in sorted(os.listdir(path)):
+                if strip_compression(file_name).endswith('_common_variants.csv') and sample_name_for(file_name) != 'CVD':
+                    files.append((os.path.join(path, file_name), sample_name_for(file_name)))
+        elif strip_compression(path).endswith('_common_variants.csv') and sample_name_for(path) != 'CVD':
+            files.append((path, sample_name_for(path)))
+        else:
+            files.append((path, None))
+    return files
+
+def read_confusion_matrices(paths):
+    """
+    Reads the common variants of all samples in one pass and counts, for each sample,
+    how often each (Franklin code, eVai code) pair occurs. Rows with a classification
+    that has no code are dropped, as na.omit does in irr::kappa2.
+
+    Parameters:
+    - paths (list): Files and directories to read (see input_files).
+
+    Returns:
+    - tuple: The sample names and an integer array of shape (samples, 5, 5) with the
+      Franklin code on the first axis and the eVai code on the second.
+    """
+    sample_index = {}
+    sample_ids = []
+    cells = []
+    for file_path, file_sample in input_files(paths):
+        with open_text(file_path, 'r', newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            if file_sample is None and 'Sample' not in (reader.fieldnames or []):
+                raise ValueError(f"{file_path} has no Sample column; pass per-sample files or a directory instead.")
+            for row in reader:
+                franklin_code = FRANKLIN_CODES.get(row['Genoox_Classification'])
+                evai_code = EVAI_CODES.get(row['eVai_Classification'])
+                if franklin_code is None or evai_code is None:
+                    continue
+                sample = file_sample if file_sample is not None else row['Sample']
+                if sample not in sample_index:
+                    sample_index[sample] = len(sample_index)
+                sample_ids.append(sample_index[sample])
+                cells.append((franklin_code - 1) * LEVELS + evai_code - 1)
+
+    # One bincount over (sample, cell) indices builds every confusion matrix at once
+    samples = list(sample_index)
+    flat = np.asarray(sample_ids, dtype=np.int64) * LEVELS * LEVELS + np.asarray(cells, dtype=np.int64)
+    counts = np.bincount(flat, minlength=len(samples) * LEVELS * LEVELS)
+    return samples, counts.reshape(len(samples), LEVELS, LEVELS)
+
+def weighted_kappa(tables):
+    """
+    Calculates Cohen's weighted Kappa with squared (Fleiss-Cohen) weights for a batch of
+    confusion matrices, matching irr::kappa2(weight = "squared"): the weights are taken
+    over the codes observed in each matrix (by either rater), ranked 0..k-1, so a matrix
+    that only uses codes 2, 3 and 5 is weighted as a 3x3 table.
+
+    Parameters:
+    - tables (numpy.ndarray): Counts of shape (..., 5, 5).
+
+    Returns:
+    - numpy.ndarray: Kappa for each matrix, of shape tables.shape[:-2]. NaN where
+      fewer than two codes were observed or the matrix is empty.
+    """
+    tables = np.asarray(tables, dtype=np.float64)
+    row_totals = tables.sum(axis=-1)
+    column_totals = tables.sum(axis=-2)
+    totals = row_totals.sum(axis=-1)
+
+    # Rank of each code among the observed codes, and the number of observed codes
+    observed = (row_totals + column_totals) > 0
+    ranks = np.cumsum(observed, axis=-1) - 1
+    level_count = observed.sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance = (ranks[..., :, None] - ranks[..., None, :]) ** 2
+        weights = 1 - distance / ((level_count - 1) ** 2)[..., None, None]
+        # Codes that were not observed have no counts; their weights must not be NaN
+        weights = np.where(observed[..., :, None] & observed[..., None, :], weights, 0)
+
+        agreement = (tables * weights).sum(axis=(-2, -1)) / totals
+        expected = row_totals[..., :, None] * column_totals[..., None, :] / totals[..., None, None]
+        chance = (expected * weights).sum(axis=(-2, -1)) / totals
+        kappa = (agreement - chance) / (1 - chance)
+    return np.where((level_count > 1) & (totals > 0), kappa, np.nan)
+
+def bootstrap_kappa(tables, replicates, seed):
+    """
+    Calculates weighted Kappa on bootstrap resamples of each sample's variants.
+    Resampling the variants of a sample with replacement is the same as drawing its
+    confusion matrix from a multinomial distribution over the observed cell proportions,
+    so each replicate is drawn directly as a matrix.
+
+    Parameters:
+    - tables (numpy.ndarray): Counts of shape (samples, 5, 5).
+    - replicates (int): Number of bootstrap replicates.
+    - seed (numpy.random.SeedSequence or int): Seed of this batch of replicates.
+
+    Returns:
+    - numpy.ndarray: Kappa of shape (replicates, samples).
+    """
+    rng = np.random.default_rng(seed)
+    sample_count = tables.shape[0]
+    flat = tables.reshape(sample_count, LEVELS * LEVELS).astype(np.int64)
+    totals = flat.sum(axis=1)
+    proportions = flat / np.maximum(totals, 1)[:, None]
+    # Empty samples get a dummy distribution; their Kappa is NaN either way
+    proportions[totals == 0, 0] = 1.0
+    draws = rng.multinomial(totals, proportions, size=(replicates, sample_count))
+    return weighted_kappa(draws.reshape(replicates, sample_count, LEVELS, LEVELS))
+
+def bootstrap_intervals(tables, replicates=1000, confidence=0.95, workers=1, seed=None, batch_size=100):
+    """
+    Calculates percentile bootstrap confidence intervals of weighted Kappa for all samples.
+    Replicates are split into batches that run across a process pool; each batch has its
+    own independent random stream, so results depend only on the seed and batch size.
+
+    Parameters:
+    - tables (numpy.ndarray): Counts of shape (samples, 5, 5).
+    - replicates (int): Number of bootstrap replicates.
+    - confidence (float): Confidence level of the intervals.
+    - workers (int): Number of worker processes.
+    - seed (int, optional): Random seed.
+    - batch_size (int): Number of replicates per batch.
+
+    Returns:
+    - tuple: Lower and upper bounds, each an array with one value per sample.
+    """
+    batch_sizes = [min(batch_size, replicates - start) for start in range(0, replicates, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    if workers <= 1 or len(batch_sizes) <= 1:
+        batches = [bootstrap_kappa(tables, size, batch_seed) for size, batch_seed in zip(batch_sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            batches = list(executor.map(bootstrap_kappa, [tables] * len(batch_sizes), batch_sizes, seeds))
+
+    kappas = np.concatenate(batches, axis=0)
+    alpha = (1 - confidence) / 2
+    with np.errstate(invalid='ignore'):
+        lower, upper = np.nanquantile(kappas, [alpha, 1 - alpha], axis=0)
+    return lower, upper
+
+def kappa_comparison(paths, output_file, replicates=1000, confidence=0.95, workers=1, seed=None):
+    """
+    Calculates weighted Kappa and its bootstrap confidence interval for every sample and
+    for all samples together ('overall'), and writes them to a CSV file.
+
+    Parameters:
+    - paths (list): Files and directories to read (see input_files).
+    - output_file (str): Path to the output CSV file.
+    - replicates (int): Number of bootstrap replicates (0 to skip the intervals).
+    - confidence (float): Confidence level of the intervals.
+    - workers (int): Number of worker processes for the bootstrap.
+    - seed (int, optional): Random seed.
+
+    Returns:
+    - list: One dict per sample with Sample, Variants, Kappa, CI_Lower and CI_Upper.
+    """
+    samples, tables = read_confusion_matrices(paths)
+    samples = samples + [OVERALL]
+    tables = np.concatenate([tables, tables.sum(axis=0, keepdims=True)], axis=0)
+
+    kappas = weighted_kappa(tables)
+    if replicates > 0:
+        lower, upper = bootstrap_intervals(tables, replicates, confidence, workers, seed)
+    else:
+        lower = upper = np.full(len(samples), np.nan)
+
+    results = []
+    for index, sample in enumerate(samples):
+        results.append({
+            'Sample': sample,
+            'Variants': int(tables[index].sum()),
+            'Kappa': kappas[index],
+            'CI_Lower': lower[index],
+            'CI_Upper': upper[index],
+        })
+
+    with open(output_file, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=['Sample', 'Variants', 'Kappa', 'CI_Lower', 'CI_Upper'])
+        writer.writeheader()
+        for result in results:
+            writer.writerow({key: ('NA' if isinstance(value, float) and np.isnan(value) else value)
+                             for key, value in result.items()})
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Weighted Kappa between eVai and Franklin for every sample.")
+    parser.add_argument('inputs', nargs='*', default=['CVD_common_variants.csv'],
+                        help="Combined common variants file(s) with a Sample column, per-sample "
+                             "CVD*_common_variants.csv files, or directories of them.")
+    parser.add_argument('--output-file', default='kappa_values.csv', help="Output CSV file with Kappa per sample.")
+    parser.add_argument('--bootstrap', type=int, default=1000,
+                        help="Number of bootstrap replicates for the confidence intervals (default: 1000, 0 to skip).")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Confidence level (default: 0.95).")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes for the bootstrap.")
+    parser.add_argument('--seed', type=int, help="Random seed for reproducible intervals.")
+    args = parser.parse_args()
+
+    results = kappa_comparison(args.inputs, args.output_file, args.bootstrap, args.confidence, args.workers, args.seed)
+    for result in results:
+        print(f"{result['Sample']} : Kappa = {result['Kappa']:.6f} "
+              f"({args.confidence:.0%} CI {result['CI_Lower']:.4f} to {result['CI_Upper']:.4f})")
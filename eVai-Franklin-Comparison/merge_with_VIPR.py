@@ -4,6 +4,32 @@
 
 import os
 import csv
+import sys
+import argparse
+import heapq
+import tempfile
+from itertools import groupby
+
+# The columnar sample reader, compressed_io and hgvs_normalise live with the pipeline scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Bioinformatics-Pipeline'))
+from columnar import ColumnarReader, columnar_path_for, has_fresh_columnar
+from compressed_io import open_text, strip_compression
+from hgvs_normalise import normalise_field
+
+def row_key(key_fields, values, key_indices):
+    """
+    Builds the join key of a row from its key fields, in their canonical form
+    (see hgvs_normalise.py), so that keys written differently by each tool still match.
+    
+    Parameters:
+    - key_fields (list): Fields used to identify unique entries.
+    - values (list): Values of the row.
+    - key_indices (list): Index of each key field in values.
+    
+    Returns:
+    - tuple: The normalised key values.
+    """
+    return tuple(normalise_field(field, values[index]) for field, index in zip(key_fields, key_indices))
 
 def read_csv_to_dict(file_path, key_fields):
     """
@@ -18,21 +44,23 @@ def read_csv_to_dict(file_path, key_fields):
     - dict: Dictionary of rows keyed by values in `key_fields`.
     """
     data_dict = {}
-    with open(file_path, 'r') as csvfile:
+    with open_text(file_path, 'r') as csvfile:
         reader = csv.DictReader(csvfile)
         for row in reader:
             # Rename 'Nucleotide' field to 'HGVS_Coding' for consistency
             if 'Nucleotide' in row:
                 row['HGVS_Coding'] = row.pop('Nucleotide')
             # Create a tuple key based on specified key_fields
-            key = tuple(row[field] for field in key_fields)
+            key = tuple(normalise_field(field, row[field]) for field in key_fields)
             data_dict[key] = row  # Add row to dictionary with the tuple key
     return data_dict
 
 def merge_csv_files(input_folder, key_fields):
     """
     Merges all sample CSV files, removing duplicates based on
-    the Gene and Nucleotide key.
+    the Gene and Nucleotide key. When a sample has an up-to-date binary
+    columnar form (.vcol), it is read instead of the CSV file and a row
+    dict is only built for entries that are kept.
     
     Parameters:
     - input_folder (str): Directory path containing CSV files to merge.
@@ -42,15 +70,25 @@ def merge_csv_files(input_folder, key_fields):
     - dict: Merged data from all CSV files, with unique entries based on key_fields.
     """
     merged_data = {}  # Dictionary to store unique merged data
-    all_files = [f for f in os.listdir(input_folder) if f.endswith('.csv')]
+    all_files = [f for f in os.listdir(input_folder) if strip_compression(f).endswith('.csv')]
 
     for file in all_files:
         file_path = os.path.join(input_folder, file)
-        with open(file_path, 'r') as csvfile:
+        if has_fresh_columnar(file_path):
+            with ColumnarReader(columnar_path_for(file_path)) as reader:
+                columns = reader.columns
+                key_indices = [columns.index(field) for field in key_fields]
+                for values in reader.rows(columns):
+                    key = row_key(key_fields, values, key_indices)
+                    if key not in merged_data:
+                        merged_data[key] = dict(zip(columns, values))
+            continue
+
+        with open_text(file_path, 'r') as csvfile:
             reader = csv.DictReader(csvfile)
             for row in reader:
                 # Create a tuple key based on key_fields to identify unique entries
-                key = tuple(row[field] for field in key_fields)
+                key = tuple(normalise_field(field, row[field]) for field in key_fields)
                 # Only add row if the key is not already in merged_data (remove duplicates)
                 if key not in merged_data:
                     merged_data[key] = row
@@ -75,7 +113,7 @@ def merge_with_prioritised(merged_data, prioritised_file, key_fields, output_fil
     fieldnames = list(next(iter(merged_data.values())).keys()) + ['VIPR_Pathogenicity']
     
     # Write the final merged data to the output CSV file
-    with open(output_file, 'w', newline='') as csvfile:
+    with open_text(output_file, 'w', newline='') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         writer.writeheader()  # Write the header row for the CSV
         
@@ -87,14 +125,263 @@ def merge_with_prioritised(merged_data, prioritised_file, key_fields, output_fil
                 row['VIPR_Pathogenicity'] = ''  # If no match, leave VIPR_Pathogenicity blank
             writer.writerow(row)  # Write the row to the CSV
 
-# Example usage:
-input_folder = 'Franklin_output/Cohort_5_clean_eVai_outputs'  # Folder with CSV files to merge
-output_file = 'eVai_VIPR_cohort5.csv'  # Final output file with merged data and VIPR_Pathogenicity
-prioritised_file = 'extracted_prioritised_file.csv'  # File with VIPR_Pathogenicity information
-key_fields = ['Gene', 'HGVS_Coding']  # Fields used to uniquely identify and merge rows
+def resolve_fields(columns, key_fields):
+    """
+    Finds the column index of each key field. 'HGVS_Coding' is matched to a
+    'Nucleotide' column in files that do not have it (VIPR and Franklin outputs).
+    
+    Parameters:
+    - columns (list): Column names of the file.
+    - key_fields (list): Fields used to identify unique entries.
+    
+    Returns:
+    - list: Column index of each key field.
+    """
+    indices = []
+    for field in key_fields:
+        if field not in columns and field == 'HGVS_Coding' and 'Nucleotide' in columns:
+            field = 'Nucleotide'
+        indices.append(columns.index(field))
+    return indices
+
+def sample_rows(file_path):
+    """
+    Reads the rows of a sample file as lists of values, using the binary columnar
+    form when it is available and up to date.
+    
+    Parameters:
+    - file_path (str): Path to the sample CSV file.
+    
+    Yields:
+    - tuple: The file's column names and the values of one row.
+    """
+    if has_fresh_columnar(file_path):
+        with ColumnarReader(columnar_path_for(file_path)) as reader:
+            columns = reader.columns
+            for values in reader.rows(columns):
+                yield columns, values
+        return
+
+    with open_text(file_path, 'r', newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        columns = next(reader, None)
+        if columns is None:
+            return
+        for values in reader:
+            if len(values) < len(columns):
+                values += [''] * (len(columns) - len(values))
+            yield columns, values
+
+def read_scores(prioritised_file, key_fields):
+    """
+    Reads only the key and VIPR_Pathogenicity score of each row of the VIPR file.
+    As in read_csv_to_dict, the last row wins when a key occurs more than once.
+    
+    Parameters:
+    - prioritised_file (str): Path to the prioritised CSV file with VIPR_Pathogenicity.
+    - key_fields (list): Fields used to match entries between files.
+    
+    Returns:
+    - dict: VIPR_Pathogenicity scores keyed by values in `key_fields`.
+    """
+    scores = {}
+    with open_text(prioritised_file, 'r', newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        columns = next(reader)
+        key_indices = resolve_fields(columns, key_fields)
+        score_index = columns.index('VIPR_Pathogenicity')
+        for values in reader:
+            scores[row_key(key_fields, values, key_indices)] = values[score_index]
+    return scores
+
+def hash_join(sample_files, prioritised_file, key_fields, output_file):
+    """
+    Joins the sample files with the VIPR scores using an in-memory hash table that
+    holds only the keys and scores. Sample rows are streamed straight to the output,
+    in the same order as merge_csv_files followed by merge_with_prioritised.
+    
+    Parameters:
+    - sample_files (list): Paths of the sample CSV files, in merge order.
+    - prioritised_file (str): Path to the prioritised CSV file with VIPR_Pathogenicity.
+    - key_fields (list): Fields used to identify unique entries and match them.
+    - output_file (str): Path to the output CSV file.
+    """
+    scores = read_scores(prioritised_file, key_fields)
+    seen_keys = set()
+    fieldnames = None
+    
+    with open_text(output_file, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        for file_path in sample_files:
+            key_indices = None
+            for columns, values in sample_rows(file_path):
+                if key_indices is None:
+                    key_indices = resolve_fields(columns, key_fields)
+                    if fieldnames is None:
+                        fieldnames = list(columns)
+                        writer.writerow(fieldnames + ['VIPR_Pathogenicity'])
+                    value_indices = [columns.index(field) if field in columns else None for field in fieldnames]
+                key = row_key(key_fields, values, key_indices)
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
+                row = [values[index] if index is not None else '' for index in value_indices]
+                writer.writerow(row + [scores.get(key, '')])
+
+def external_sort(rows, chunk_size, temp_dir):
+    """
+    Sorts lists of strings that are too large to hold in memory at once. Sorted runs
+    of chunk_size rows are spilled to temporary CSV files and merged back lazily.
+    
+    Parameters:
+    - rows (iterable): Lists of strings to sort.
+    - chunk_size (int): Maximum number of rows sorted in memory at once.
+    - temp_dir (str): Directory for the run files.
+    
+    Yields:
+    - list: The rows in ascending order.
+    """
+    run_files = []
+    chunk = []
+    
+    def spill():
+        chunk.sort()
+        run_file = tempfile.TemporaryFile('w+', newline='', dir=temp_dir)
+        csv.writer(run_file).writerows(chunk)
+        run_file.seek(0)
+        run_files.append(run_file)
+        chunk.clear()
+    
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            spill()
+    if not run_files:
+        chunk.sort()
+        yield from chunk
+        return
+    if chunk:
+        spill()
+    
+    try:
+        yield from heapq.merge(*(csv.reader(run_file) for run_file in run_files))
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+def sort_merge_join(sample_files, prioritised_file, key_fields, output_file, chunk_size=500000):
+    """
+    Joins the sample files with the VIPR scores with an external sort-merge join, for
+    inputs larger than memory. Both inputs are sorted by key in runs spilled to disk and
+    then merged. The kept rows and scores are the same as for the hash join, but the
+    output is ordered by key instead of by first occurrence.
+    
+    Parameters:
+    - sample_files (list): Paths of the sample CSV files, in merge order.
+    - prioritised_file (str): Path to the prioritised CSV file with VIPR_Pathogenicity.
+    - key_fields (list): Fields used to identify unique entries and match them.
+    - output_file (str): Path to the output CSV file.
+    - chunk_size (int): Maximum number of rows sorted in memory at once.
+    """
+    key_count = len(key_fields)
+    # Zero-padded positions keep the original order among rows with the same key
+    position = '{:012d}'.format
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    
+    fieldnames = None
+    
+    def keyed_sample_rows():
+        nonlocal fieldnames
+        for file_index, file_path in enumerate(sample_files):
+            key_indices = None
+            for row_index, (columns, values) in enumerate(sample_rows(file_path)):
+                if key_indices is None:
+                    key_indices = resolve_fields(columns, key_fields)
+                    if fieldnames is None:
+                        fieldnames = list(columns)
+                    value_indices = [columns.index(field) if field in columns else None for field in fieldnames]
+                yield (list(row_key(key_fields, values, key_indices)) + [position(file_index), position(row_index)]
+                       + [values[index] if index is not None else '' for index in value_indices])
+    
+    def keyed_scores(csvfile):
+        reader = csv.reader(csvfile)
+        columns = next(reader)
+        key_indices = resolve_fields(columns, key_fields)
+        score_index = columns.index('VIPR_Pathogenicity')
+        for row_index, values in enumerate(reader):
+            yield list(row_key(key_fields, values, key_indices)) + [position(row_index), values[score_index]]
+    
+    with open_text(prioritised_file, 'r', newline='') as vipr_file, open_text(output_file, 'w', newline='') as csvfile:
+        samples = external_sort(keyed_sample_rows(), chunk_size, output_dir)
+        scores = external_sort(keyed_scores(vipr_file), chunk_size, output_dir)
+        
+        # The last score for each key wins, as in read_csv_to_dict
+        score_groups = ((key, list(group)[-1][-1]) for key, group in groupby(scores, key=lambda row: row[:key_count]))
+        score_key, score = next(score_groups, (None, ''))
+        
+        writer = None
+        for key, group in groupby(samples, key=lambda row: row[:key_count]):
+            # The first occurrence of each key is kept, as in merge_csv_files
+            row = next(group)
+            if writer is None:
+                writer = csv.writer(csvfile)
+                writer.writerow(fieldnames + ['VIPR_Pathogenicity'])
+            while score_key is not None and score_key < key:
+                score_key, score = next(score_groups, (None, ''))
+            writer.writerow(row[key_count + 2:] + [score if score_key == key else ''])
+
+def join_with_prioritised(input_folder, prioritised_file, key_fields, output_file,
+                          mode='auto', memory_limit=2 * 1024 ** 3, chunk_size=500000):
+    """
+    Merges all sample files in a folder with the VIPR output file, without loading
+    whole rows into memory. The 'hash' mode keeps only the keys and scores in memory;
+    the 'sort' mode spills sorted runs to disk for inputs larger than memory. In 'auto'
+    mode the sort mode is used when the inputs together are larger than memory_limit.
+    Any of the files may be gzip or Zstandard compressed (.gz, .zst).
+    
+    Parameters:
+    - input_folder (str): Directory path containing CSV files to merge.
+    - prioritised_file (str): Path to the prioritised CSV file with VIPR_Pathogenicity.
+    - key_fields (list): Fields used to identify unique entries and match them.
+    - output_file (str): Path to the output CSV file.
+    - mode (str): 'auto', 'hash' or 'sort'.
+    - memory_limit (int): Input size in bytes above which 'auto' uses the sort mode.
+    - chunk_size (int): Maximum number of rows sorted in memory at once in the sort mode.
+    
+    Returns:
+    - str: The join mode that was used.
+    """
+    sample_files = [os.path.join(input_folder, f) for f in os.listdir(input_folder) if strip_compression(f).endswith('.csv')]
+    
+    if mode == 'auto':
+        input_size = os.path.getsize(prioritised_file) + sum(os.path.getsize(f) for f in sample_files)
+        mode = 'hash' if input_size <= memory_limit else 'sort'
+    
+    if mode == 'hash':
+        hash_join(sample_files, prioritised_file, key_fields, output_file)
+    elif mode == 'sort':
+        sort_merge_join(sample_files, prioritised_file, key_fields, output_file, chunk_size)
+    else:
+        raise ValueError(f"Unknown join mode: {mode}")
+    return mode
 
-# Step 1: Merge all CSV files in the input folder, removing duplicates based on key_fields
-merged_data = merge_csv_files(input_folder, key_fields)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge eVai or Franklin outputs with VIPR Pathogenicity scores.")
+    parser.add_argument('--input-folder', default='Franklin_output/Cohort_5_clean_eVai_outputs',
+                        help="Folder with CSV files to merge.")
+    parser.add_argument('--output-file', default='eVai_VIPR_cohort5.csv',
+                        help="Final output file with merged data and VIPR_Pathogenicity.")
+    parser.add_argument('--prioritised-file', default='extracted_prioritised_file.csv',
+                        help="File with VIPR_Pathogenicity information.")
+    parser.add_argument('--key-fields', nargs='+', default=['Gene', 'HGVS_Coding'],
+                        help="Fields used to uniquely identify and merge rows.")
+    parser.add_argument('--mode', choices=['auto', 'hash', 'sort'], default='auto',
+                        help="Join mode: in-memory hash join, external sort-merge join, or chosen by input size.")
+    parser.add_argument('--memory-limit', type=int, default=2048,
+                        help="Input size in MB above which the auto mode uses the sort-merge join (default: 2048).")
+    args = parser.parse_args()
 
-# Step 2: Merge the merged data with the prioritised file to add VIPR_Pathogenicity information
-merge_with_prioritised(merged_data, prioritised_file, key_fields, output_file)
+    # Merge all sample files with the prioritised file, removing duplicates based on key_fields
+    mode = join_with_prioritised(args.input_folder, args.prioritised_file, args.key_fields, args.output_file,
+                                 mode=args.mode, memory_limit=args.memory_limit * 1024 * 1024)
+    print(f"Merged with {mode} join.")